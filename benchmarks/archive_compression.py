@@ -0,0 +1,125 @@
+"""
+Benchmark the files handler archive mode for every codec and compression location.
+Remote compression needs a remote source (--host and --path), local sources are compressed locally only.
+
+    python benchmarks/archive_compression.py [--host user@host --path /srv/data] [--size 256] [--codecs gzip,pigz,zstd,xz,none] [--threads 0]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usbackup.handlers import handler_factory
+from usbackup.handlers.backup.files import FilesHandlerModel
+from usbackup.libraries.cleanup_queue import CleanupQueue
+from usbackup.libraries.datastore import Datastore
+from usbackup.models.host import HostModel
+from usbackup.models.path import PathModel
+
+def gen_tree(root: str, size: int) -> None:
+    # log-like text, so the codecs have something to compress
+    words = [''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=random.randint(3, 10))) for _ in range(2000)]
+    file_size = 4 * 1024 ** 2
+    
+    os.makedirs(root)
+    
+    for i in range(max(1, size * 1024 ** 2 // file_size)):
+        with open(os.path.join(root, f'file-{i}.log'), 'w') as f:
+            written = 0
+            
+            while written < file_size:
+                line = f'{i:08d} {" ".join(random.choices(words, k=12))}\n'
+                written += f.write(line)
+
+def cpu_time() -> float:
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+async def run_backup(model: FilesHandlerModel, host: HostModel, dest: str, cleanup: CleanupQueue) -> int:
+    handler = handler_factory('backup', 'files', model, host, cleanup=cleanup, logger=logging.getLogger('files'))
+    
+    await handler.backup(PathModel.model_validate(dest))
+    
+    return handler.stats.total_bytes
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='archive compression benchmark')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--path', help='directory to archive on host (a synthetic tree is generated for local runs)')
+    parser.add_argument('--size', type=int, default=256, help='size of the synthetic tree (MB)')
+    parser.add_argument('--codecs', default='gzip,pigz,zstd,xz,none')
+    parser.add_argument('--level', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=0, help='compression threads (0 uses all cores)')
+    parser.add_argument('--dir', default=tempfile.gettempdir())
+    args = parser.parse_args()
+    
+    host = HostModel.model_validate(args.host)
+    
+    if not host.local and not args.path:
+        parser.error('--path is required for remote hosts')
+    
+    # the local (cpu) column is the time spent on the backup server, including local compression
+    print(f'{"codec":<8}{"location":<10}{"wall (s)":>10}{"local cpu (s)":>15}{"size (MB)":>11}{"ratio":>8}')
+    
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = args.path
+        
+        if not path:
+            path = os.path.join(tmp, 'src')
+            gen_tree(path, args.size)
+        
+        cleanup = CleanupQueue(datastore=Datastore(os.path.join(tmp, 'cleanup')))
+        # compression ratios are relative to the uncompressed archive (or the tree size for local runs)
+        raw_size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) if host.local else None
+        
+        for codec in args.codecs.split(','):
+            if codec == 'none':
+                # streamed with a remote command, like remote compression
+                locations = [] if host.local else ['remote']
+            elif host.local:
+                locations = ['local']
+            else:
+                locations = ['remote', 'local']
+            
+            for location in locations:
+                if codec in ('gzip', 'none'):
+                    threads = 1
+                else:
+                    threads = args.threads
+                
+                level = args.level if codec != 'none' else None
+                model = FilesHandlerModel(mode='archive', limit=[path], compression=codec, compression_level=level, compression_threads=threads, compression_location=location)
+                dest = os.path.join(tmp, 'dest')
+                os.makedirs(dest)
+                
+                cpu_start = cpu_time()
+                start = time.perf_counter()
+                
+                try:
+                    size = asyncio.run(run_backup(model, host, dest, cleanup))
+                except Exception as e:
+                    print(f'{codec:<8}{location:<10} failed: {e}')
+                    continue
+                finally:
+                    shutil.rmtree(dest)
+                
+                elapsed = time.perf_counter() - start
+                
+                if codec == 'none':
+                    raw_size = size
+                
+                ratio = f'{raw_size / size:.2f}' if raw_size else '-'
+                
+                print(f'{codec:<8}{location:<10}{elapsed:>10.2f}{cpu_time() - cpu_start:>15.2f}{size / 1024 ** 2:>11.1f}{ratio:>8}')
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""
+Copy a synthetic tree of several limit paths with the files handler at different parallel settings.
+--bwlimit caps every rsync stream (KB/s), to mimic sources whose throughput is bound by the disk or the link.
+
+    python benchmarks/files_parallel.py [--dirs 10] [--files 200] [--size 64] [--bwlimit 2048] [--parallel 1,2,5,10]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usbackup.handlers import handler_factory
+from usbackup.handlers.backup.files import FilesHandlerModel
+from usbackup.libraries.cleanup_queue import CleanupQueue
+from usbackup.libraries.datastore import Datastore
+from usbackup.models.host import HostModel
+from usbackup.models.path import PathModel
+
+def gen_tree(root: str, dirs: int, files: int, size: int) -> list[str]:
+    limit = []
+    
+    for i in range(dirs):
+        path = os.path.join(root, f'dir-{i}')
+        os.makedirs(path)
+        
+        for j in range(files):
+            with open(os.path.join(path, f'file-{j}'), 'wb') as f:
+                f.write(os.urandom(size * 1024))
+        
+        limit.append(path)
+    
+    return limit
+
+async def run_backup(model: FilesHandlerModel, dest: str, cleanup: CleanupQueue) -> float:
+    handler = handler_factory('backup', 'files', model, HostModel.model_validate('localhost'), cleanup=cleanup, logger=logging.getLogger('files'))
+    start = time.perf_counter()
+    
+    await handler.backup(PathModel.model_validate(dest))
+    
+    return time.perf_counter() - start
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='files handler parallel limit paths benchmark')
+    parser.add_argument('--dirs', type=int, default=10)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size', type=int, default=64, help='file size (KB)')
+    parser.add_argument('--bwlimit', type=int, default=None, help='per rsync stream (KB/s)')
+    parser.add_argument('--parallel', default='1,2,5,10')
+    parser.add_argument('--dir', default=tempfile.gettempdir())
+    args = parser.parse_args()
+    
+    total_mb = args.dirs * args.files * args.size / 1024
+    
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        limit = gen_tree(os.path.join(tmp, 'src'), args.dirs, args.files, args.size)
+        cleanup = CleanupQueue(datastore=Datastore(os.path.join(tmp, 'cleanup')))
+        
+        print(f'{args.dirs} limit paths, {args.dirs * args.files} files, {total_mb:.0f} MB')
+        print(f'{"parallel":<10}{"wall (s)":>10}{"MB/s":>10}')
+        
+        for parallel in [int(value) for value in args.parallel.split(',')]:
+            model = FilesHandlerModel(limit=limit, parallel=parallel, bwlimit=args.bwlimit, mode='full')
+            dest = os.path.join(tmp, f'dest-{parallel}')
+            os.makedirs(dest)
+            
+            elapsed = asyncio.run(run_backup(model, dest, cleanup))
+            
+            print(f'{parallel:<10}{elapsed:>10.2f}{total_mb / elapsed:>10.1f}')
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
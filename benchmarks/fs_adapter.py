@@ -0,0 +1,76 @@
+"""
+Compare the FsAdapter backends on the filesystem operations of a backup job with many sources.
+
+    python benchmarks/fs_adapter.py [--sources 500] [--concurrency 50] [--dir /tmp]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.models.path import PathModel
+
+async def run_source(root: PathModel, index: int) -> None:
+    # roughly the operations a backup run does per source (destination, lock file, version and handler directories)
+    dest = root.join(f'source-{index}')
+    lock = dest.join('backup.lock')
+    handler_dest = dest.join('version').join('files')
+    
+    if not await FsAdapter.exists(dest, 'd'):
+        await FsAdapter.mkdir(dest)
+    
+    await FsAdapter.touch(lock)
+    await FsAdapter.exists(lock, 'f')
+    await FsAdapter.ls(dest)
+    
+    if not await FsAdapter.exists(handler_dest, 'd'):
+        await FsAdapter.mkdir(handler_dest)
+    
+    await FsAdapter.touch(handler_dest.join('file'))
+    await FsAdapter.size(handler_dest.join('file'))
+    await FsAdapter.rm(lock)
+
+async def run_job(root: PathModel, sources: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def run(index: int) -> None:
+        async with semaphore:
+            await run_source(root, index)
+    
+    await asyncio.gather(*[run(index) for index in range(sources)])
+
+def cpu_time() -> float:
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='FsAdapter backends benchmark')
+    parser.add_argument('--sources', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--dir', default=tempfile.gettempdir())
+    args = parser.parse_args()
+    
+    print(f'{args.sources} sources, {args.concurrency} concurrent')
+    print(f'{"backend":<12}{"wall (s)":>10}{"cpu (s)":>10}')
+    
+    for backend in ('subprocess', 'native'):
+        FsAdapter.set_backend(backend)
+        
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            root = PathModel.model_validate(tmp)
+            cpu_start = cpu_time()
+            start = time.perf_counter()
+            
+            asyncio.run(run_job(root, args.sources, args.concurrency))
+            
+            print(f'{backend:<12}{time.perf_counter() - start:>10.2f}{cpu_time() - cpu_start:>10.2f}')
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Compare compressing Proxmox dumps on the hypervisor (vzdump --compress) with compressing them on the backup server.
+
+With --host and --vm the proxmox_vms handler dumps the VM once per compression location. Without them a synthetic
+raw dump of --size MB is streamed through the same stages: compressed by the producer command (source side)
+or by the local compression stage (local side).
+
+    python benchmarks/proxmox_compression.py [--host root@pve --vm 100] [--size 512] [--level 3] [--threads 0]
+"""
+import os
+import sys
+import time
+import shlex
+import asyncio
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usbackup.handlers import handler_factory
+from usbackup.handlers.backup.proxmox_vms import ProxmoxVmsHandlerModel
+from usbackup.libraries.cleanup_queue import CleanupQueue
+from usbackup.libraries.cmd_exec import CmdExec
+from usbackup.libraries.compression import Compression
+from usbackup.libraries.datastore import Datastore
+from usbackup.libraries.stream_pipeline import StreamPipeline, CompressStage
+from usbackup.models.host import HostModel
+from usbackup.models.path import PathModel
+
+def gen_dump(path: str, size: int) -> None:
+    # disk images mix incompressible data, text and zeroed blocks
+    block = 1024 ** 2
+    
+    with open(path, 'wb') as f:
+        for i in range(size):
+            if i % 3 == 0:
+                f.write(os.urandom(block))
+            elif i % 3 == 1:
+                f.write((f'{i:08d} lorem ipsum dolor sit amet\n' * (block // 36 + 1)).encode()[:block])
+            else:
+                f.write(bytes(block))
+
+async def run_synthetic(dump: str, dest: str, location: str, level: int | None, threads: int) -> int:
+    compress_cmd = Compression.gen_cmd('zstd', level=level, threads=threads)
+    
+    if location == 'remote':
+        # the hypervisor compresses while dumping
+        producer = lambda f: CmdExec.exec(['sh', '-c', f'cat {shlex.quote(dump)} | {shlex.join(compress_cmd)}'], stdout=f)
+        stages = []
+    else:
+        producer = lambda f: CmdExec.exec(['cat', dump], stdout=f)
+        stages = [CompressStage('zstd', level=level, threads=threads)]
+    
+    with open(dest, 'wb') as f:
+        if not stages:
+            await producer(f)
+        else:
+            await StreamPipeline(stages).run(producer, f)
+    
+    return os.path.getsize(dest)
+
+async def run_handler(host: HostModel, vm: int, dest: str, location: str, level: int | None, threads: int, cleanup: CleanupQueue) -> int:
+    model = ProxmoxVmsHandlerModel(limit=[vm], compress='zstd', compression_location=location, compression_level=level if location == 'local' else None, compression_threads=threads)
+    handler = handler_factory('backup', 'proxmox_vms', model, host, cleanup=cleanup, logger=logging.getLogger('proxmox_vms'))
+    
+    await handler.backup(PathModel.model_validate(dest), None)
+    
+    return handler.stats.total_bytes
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='proxmox dump compression benchmark')
+    parser.add_argument('--host')
+    parser.add_argument('--vm', type=int)
+    parser.add_argument('--size', type=int, default=512, help='size of the synthetic dump (MB)')
+    parser.add_argument('--level', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=0, help='local compression threads (0 uses all cores)')
+    parser.add_argument('--dir', default=tempfile.gettempdir())
+    args = parser.parse_args()
+    
+    if bool(args.host) != bool(args.vm):
+        parser.error('--host and --vm go together')
+    
+    print(f'{"location":<10}{"wall (s)":>10}{"MB/s":>10}{"size (MB)":>11}')
+    
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        cleanup = CleanupQueue(datastore=Datastore(os.path.join(tmp, 'cleanup')))
+        dump = os.path.join(tmp, 'dump.vma')
+        
+        if not args.host:
+            gen_dump(dump, args.size)
+        
+        for location in ('remote', 'local'):
+            dest = os.path.join(tmp, location)
+            os.makedirs(dest)
+            start = time.perf_counter()
+            
+            if args.host:
+                size = asyncio.run(run_handler(HostModel.model_validate(args.host), args.vm, dest, location, args.level, args.threads, cleanup))
+            else:
+                size = asyncio.run(run_synthetic(dump, os.path.join(dest, 'dump.vma.zst'), location, args.level, args.threads))
+            
+            elapsed = time.perf_counter() - start
+            # throughput of the raw dump (of the stored one for handler runs, vzdump does not report the raw size)
+            raw_size = os.path.getsize(dump) if not args.host else size
+            
+            print(f'{location:<10}{elapsed:>10.2f}{raw_size / 1024 ** 2 / elapsed:>10.1f}{size / 1024 ** 2:>11.1f}')
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+Measure the per-host latency of fetching a generated file and a few small files from config-like hosts:
+one remote invocation (RemoteFetch) against separate generate, copy and cleanup commands.
+
+    python benchmarks/remote_fetch.py --host user@host [--host ...] [--paths /etc/hostname,/etc/hosts] [--runs 5]
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usbackup.libraries.remote_cmd import RemoteCmd
+from usbackup.libraries.remote_fetch import RemoteFetch
+from usbackup.libraries.remote_sync import RemoteSync
+from usbackup.models.host import HostModel
+from usbackup.models.path import PathModel
+
+async def fetch_separate(host: HostModel, paths: list[str], archive: str, dest: PathModel) -> None:
+    # what the config handlers did before: one ssh session per step
+    await RemoteCmd.exec(['tar', '-cf', archive, *paths], host)
+    
+    for path in [archive, *paths]:
+        await RemoteSync.scp(PathModel(path=path, host=host), dest.join(os.path.basename(path)))
+    
+    await RemoteCmd.exec(['rm', '-f', archive], host)
+
+async def fetch_single(host: HostModel, paths: list[str], archive: str, dest: PathModel) -> None:
+    await RemoteFetch.fetch([archive, *paths], host, dest, generate=['tar', '-cf', archive, *paths], cleanup=['rm', '-f', archive])
+
+async def run_host(host: HostModel, paths: list[str], runs: int) -> dict[str, list[float]]:
+    results = {'separate': [], 'single': []}
+    
+    for _ in range(runs):
+        for mode, fetch in (('separate', fetch_separate), ('single', fetch_single)):
+            archive = f'/tmp/usbackup-bench-{uuid.uuid4().hex[:8]}.tar'
+            
+            with tempfile.TemporaryDirectory() as tmp:
+                start = time.perf_counter()
+                await fetch(host, paths, archive, PathModel.model_validate(tmp))
+                results[mode].append(time.perf_counter() - start)
+    
+    return results
+
+async def run(hosts: list[HostModel], paths: list[str], runs: int) -> None:
+    print(f'{len(paths)} files and a generated archive, median of {runs} runs')
+    print(f'{"host":<24}{"separate (ms)":>15}{"single (ms)":>13}{"speedup":>9}')
+    
+    # hosts are measured one by one, so they don't compete for the local CPU
+    for host in hosts:
+        results = await run_host(host, paths, runs)
+        separate = statistics.median(results['separate'])
+        single = statistics.median(results['single'])
+        
+        print(f'{str(host):<24}{separate * 1000:>15.1f}{single * 1000:>13.1f}{separate / single:>9.2f}')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='single invocation remote fetch benchmark')
+    parser.add_argument('--host', action='append', required=True)
+    parser.add_argument('--paths', default='/etc/hostname,/etc/hosts')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    
+    hosts = [HostModel.model_validate(host) for host in args.host]
+    
+    if any(host.local for host in hosts):
+        parser.error('hosts must be remote (use 127.0.0.1 for a local sshd)')
+    
+    asyncio.run(run(hosts, args.paths.split(','), args.runs))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
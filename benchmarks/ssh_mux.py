@@ -0,0 +1,66 @@
+"""
+Measure the round-trip latency of remote commands with and without the shared ssh master connection.
+Needs an ssh server accepting key authentication (eg. a local sshd: --host root@127.0.0.1).
+
+    python benchmarks/ssh_mux.py --host user@host[:port] [--commands 50]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usbackup.libraries.cleanup_queue import CleanupQueue
+from usbackup.libraries.datastore import Datastore
+from usbackup.libraries.remote_cmd import RemoteCmd
+from usbackup.libraries.ssh_mux import SshMux
+from usbackup.models.host import HostModel
+
+async def run_commands(host: HostModel, commands: int) -> list[float]:
+    latencies = []
+    
+    for _ in range(commands):
+        start = time.perf_counter()
+        await RemoteCmd.exec(['true'], host)
+        latencies.append(time.perf_counter() - start)
+    
+    return latencies
+
+async def run(host: HostModel, commands: int) -> None:
+    print(f'{commands} commands on "{host}"')
+    print(f'{"connection":<12}{"first (ms)":>12}{"median (ms)":>13}{"total (s)":>11}')
+    
+    results = {'direct': await run_commands(host, commands)}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        cleanup = CleanupQueue(datastore=Datastore(os.path.join(tmp, 'cleanup')))
+        SshMux.setup(cleanup=cleanup)
+        
+        try:
+            # the first command starts the master connection
+            results['multiplexed'] = await run_commands(host, commands)
+        finally:
+            await cleanup.consume_all()
+    
+    for connection, latencies in results.items():
+        print(f'{connection:<12}{latencies[0] * 1000:>12.1f}{statistics.median(latencies) * 1000:>13.1f}{sum(latencies):>11.2f}')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ssh connection multiplexing benchmark')
+    parser.add_argument('--host', required=True)
+    parser.add_argument('--commands', type=int, default=50)
+    args = parser.parse_args()
+    
+    host = HostModel.model_validate(args.host)
+    
+    if host.local:
+        parser.error('host must be remote (use 127.0.0.1 for a local sshd)')
+    
+    asyncio.run(run(host, args.commands))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
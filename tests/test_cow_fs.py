@@ -0,0 +1,135 @@
+import os
+import uuid
+import shutil
+import asyncio
+import subprocess
+import pytest
+from usbackup.libraries.cow_fs import CowFs
+from usbackup.models.path import PathModel
+
+# copy-on-write filesystems created on loopback images, the tests need root and the filesystem tools
+FILESYSTEMS = {
+    'btrfs': ['mkfs.btrfs', 'btrfs', 'mount', 'umount'],
+    'zfs': ['zpool', 'zfs'],
+    'reflink': ['mkfs.xfs', 'mount', 'umount'],
+}
+
+def run(coro):
+    return asyncio.run(coro)
+
+def sh(*cmd: str) -> None:
+    subprocess.run(cmd, check=True, capture_output=True)
+
+def write(path: PathModel, name: str, data: str) -> None:
+    with open(os.path.join(path.path, name), 'w') as f:
+        f.write(data)
+
+def read(path: PathModel, name: str) -> str:
+    with open(os.path.join(path.path, name)) as f:
+        return f.read()
+
+@pytest.fixture(params=list(FILESYSTEMS))
+def storage(request, tmp_path, monkeypatch):
+    fs = request.param
+    missing = [tool for tool in FILESYSTEMS[fs] if not shutil.which(tool)]
+    
+    if os.geteuid() != 0:
+        pytest.skip('loopback filesystems need root')
+    
+    if missing:
+        pytest.skip(f'{", ".join(missing)} not available')
+    
+    # detection results are cached per path
+    monkeypatch.setattr(CowFs, '_detected', {})
+    
+    image = tmp_path / 'image'
+    mnt = tmp_path / 'mnt'
+    mnt.mkdir()
+    # xfs needs 300M at least, the images are sparse
+    image.write_bytes(b'')
+    os.truncate(image, 512 * 1024 ** 2)
+    
+    if fs == 'zfs':
+        pool = f'usbackup-test-{uuid.uuid4().hex[:8]}'
+        
+        try:
+            sh('zpool', 'create', '-m', str(mnt), pool, str(image))
+        except subprocess.CalledProcessError as e:
+            pytest.skip(f'failed to create zfs pool: {e.stderr.decode().strip()}')
+        
+        yield fs, PathModel.model_validate(str(mnt))
+        
+        sh('zpool', 'destroy', '-f', pool)
+        return
+    
+    try:
+        if fs == 'btrfs':
+            sh('mkfs.btrfs', '-q', str(image))
+        else:
+            sh('mkfs.xfs', '-q', '-m', 'reflink=1', str(image))
+        
+        sh('mount', '-o', 'loop', str(image), str(mnt))
+    except subprocess.CalledProcessError as e:
+        pytest.skip(f'failed to mount {fs} image: {e.stderr.decode().strip()}')
+    
+    yield fs, PathModel.model_validate(str(mnt))
+    
+    sh('umount', str(mnt))
+
+def test_detect(storage):
+    fs, root = storage
+    
+    assert run(CowFs.detect(root)) == fs
+
+def test_clone(storage):
+    fs, root = storage
+    src = root.join('v1')
+    dst = root.join('v2')
+    
+    run(CowFs.create(src, fs))
+    write(src, 'file', 'v1')
+    run(CowFs.clone(src, dst, fs))
+    
+    assert read(dst, 'file') == 'v1'
+    assert run(CowFs.is_volume(dst, fs)) == (fs != 'reflink')
+    
+    # the clone is independent from its source
+    write(dst, 'file', 'v2')
+    
+    assert read(src, 'file') == 'v1'
+
+def test_remove(storage):
+    fs, root = storage
+    path = root.join('v1')
+    
+    run(CowFs.create(path, fs))
+    write(path, 'file', 'v1')
+    run(CowFs.remove(path, fs))
+    
+    assert not os.path.exists(path.path)
+    assert not run(CowFs.is_volume(path, fs))
+
+def test_remove_cloned_versions(storage):
+    fs, root = storage
+    versions = [root.join(f'v{i}') for i in range(3)]
+    
+    run(CowFs.create(versions[0], fs))
+    write(versions[0], 'file', 'v0')
+    
+    # every version is a clone of the previous one
+    for src, dst in zip(versions, versions[1:]):
+        run(CowFs.clone(src, dst, fs))
+        write(dst, 'file', dst.path)
+    
+    # the oldest versions go first (ZFS clones are promoted so their origin can be destroyed)
+    for i, version in enumerate(versions):
+        run(CowFs.remove(version, fs))
+        
+        assert not os.path.exists(version.path)
+        
+        for newer in versions[i + 1:]:
+            assert read(newer, 'file') == newer.path
+    
+    if fs == 'zfs':
+        # no snapshots left behind
+        assert run(CowFs._exec(['zfs', 'list', '-H', '-t', 'snapshot', '-o', 'name', '-r', run(CowFs.zfs_containing_dataset(root.path))[0]])) == ''
\ No newline at end of file
@@ -34,6 +34,19 @@ def main():
     
     stats_parser.add_argument('--json', dest='json', action='store_true', help='Output the stats in JSON format')
     
+    restore_stream_parser = subparsers.add_parser('restore-stream', help='Reassemble a chunked stream output (eg. a vzdump file) from its index')
+    
+    restore_stream_parser.add_argument('index', help='Index of the stream (the ".chunks" file in the backup version)')
+    restore_stream_parser.add_argument('output', help='File where to write the stream ("-" for stdout)')
+    
+    verify_stream_parser = subparsers.add_parser('verify-stream', help='Verify the chunks of a chunked stream output')
+    
+    verify_stream_parser.add_argument('index', help='Index of the stream (the ".chunks" file in the backup version)')
+    
+    verify_version_parser = subparsers.add_parser('verify-version', help='Verify the files of a backup version against the checksums recorded during the backup')
+    
+    verify_version_parser.add_argument('version', help='Directory of the backup version')
+    
     args = parser.parse_args()
 
     if args.command is None:
@@ -83,5 +96,36 @@ def main():
     elif args.command == 'stats':
         format = 'json' if args.json else 'text'
         print(usbackup.stats(format=format))
+    elif args.command == 'restore-stream':
+        if not usbackup.restore_stream(args.index, args.output):
+            sys.exit(1)
+    elif args.command == 'verify-stream':
+        errors = usbackup.verify_stream(args.index)
+        
+        if errors is None:
+            sys.exit(1)
+        
+        for error in errors:
+            print(error)
+        
+        if errors:
+            print(f"Stream verification failed with {len(errors)} error(s)")
+            sys.exit(1)
+        
+        print("Stream is valid")
+    elif args.command == 'verify-version':
+        errors = usbackup.verify_version(args.version)
+        
+        if errors is None:
+            sys.exit(1)
+        
+        for error in errors:
+            print(error)
+        
+        if errors:
+            print(f"Version verification failed with {len(errors)} error(s)")
+            sys.exit(1)
+        
+        print("Version is valid")
 
     sys.exit(0)
\ No newline at end of file
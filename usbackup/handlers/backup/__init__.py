@@ -1,15 +1,28 @@
+import os
 import logging
+import asyncio
+import datetime
 import uuid
 from abc import ABC, abstractmethod
+from typing import IO, Awaitable, Callable
+from usbackup.libraries.checksum_manifest import ChecksumManifest, ChecksumManifestWriter, ChecksumManifestIndex
+from usbackup.libraries.chunk_store import ChunkStore
 from usbackup.libraries.cleanup_queue import CleanupQueue
+from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.libraries.stream_pipeline import StreamPipeline, StreamStage, CommandStage, HashStage
 from usbackup.models.handler_base import HandlerBaseModel
 from usbackup.models.host import HostModel
 from usbackup.models.path import PathModel
+from usbackup.models.transfer_stats import TransferStatsModel
 
 __all__ = ['BackupHandler', 'BackupHandlerError']
 
 class BackupHandler(ABC):
     handler: str | None = None
+    # port probed before the backup starts (None means the host ssh port)
+    probe_port: int | None = None
+    # handler can update the data of a cloned (copy-on-write) version in place
+    cow_capable: bool = False
     
     def __init__(self, model: HandlerBaseModel, host: HostModel, *, cleanup: CleanupQueue, logger: logging.Logger):
         self._host: HostModel = host
@@ -18,12 +31,148 @@ class BackupHandler(ABC):
         self._logger: logging.Logger = logger
         
         self._id: str = str(uuid.uuid4())
+        self._stats: TransferStatsModel = TransferStatsModel()
+        # versions the data written by this handler depends on (eg. the base of an incremental archive)
+        self._depends_on: list[str] = []
+        # dest holds a clone of the previous version to be updated (instead of an empty directory)
+        self._inplace: bool = False
+        # stream outputs are stored as chunk indexes (handlers supporting it read this from their model)
+        self._chunked: bool = False
+        self._chunk_store: ChunkStore | None = None
+        # start of the version dest_link belongs to (files changed after it are not in dest_link)
+        self._base_date: datetime.datetime | None = None
+        # manifest of the version, gets the checksums of the files written by the handler. None when not collected
+        self._checksums: ChecksumManifestWriter | None = None
+        # manifest of the previous version, its checksums are carried forward for unchanged files
+        self._base_checksums: ChecksumManifestIndex | None = None
+    
+    @property
+    def stats(self) -> TransferStatsModel:
+        return self._stats
+    
+    @property
+    def depends_on(self) -> list[str]:
+        return self._depends_on
+    
+    @property
+    def chunked(self) -> bool:
+        return self._chunked
+    
+    def set_inplace(self, inplace: bool = True) -> None:
+        self._inplace = inplace
+    
+    def set_chunk_store(self, chunk_store: ChunkStore) -> None:
+        self._chunk_store = chunk_store
+    
+    def set_base_date(self, base_date: datetime.datetime) -> None:
+        self._base_date = base_date
+    
+    def set_checksums(self, checksums: ChecksumManifestWriter, base_checksums: ChecksumManifestIndex | None = None) -> None:
+        """
+        Record the checksums of the written files in checksums, taking over the ones of base_checksums for unchanged files.
+        """
+        self._checksums = checksums
+        self._base_checksums = base_checksums
 
     @abstractmethod
     async def backup(self, backup_dst: PathModel, backup_dst_link: PathModel | None = None) -> None:
         pass
     
+    async def commit(self) -> None:
+        """
+        Called once the version is complete. Applies the changes the handler deferred until then
+        (eg. moving the base of the next incremental run on the source).
+        """
+        pass
+    
+    async def rollback(self) -> None:
+        """
+        Called when the version is discarded. Drops the deferred changes.
+        """
+        pass
+    
+    def _add_dependency(self, dest_link: PathModel) -> None:
+        """
+        Record that the data written by the handler needs the version dest_link belongs to.
+        """
+        # dest_link is the handler directory inside the version directory
+        self._depends_on.append(os.path.basename(os.path.dirname(dest_link.path.rstrip('/'))))
+    
+    async def _record_checksum(self, path: PathModel, name: str | None = None) -> None:
+        """
+        Hash a file the handler stored without streaming it (eg. fetched files, metadata). When name is given,
+        the file is a link to the file name of the previous version and its checksum is taken over instead.
+        """
+        if self._checksums is None:
+            return
+        
+        checksum = self._get_base_checksum(name) if name else None
+        
+        if checksum:
+            self._checksums.add(path.path, checksum)
+        elif await FsAdapter.exists(path, 'f'):
+            self._checksums.add(path.path, await ChecksumManifest.hash_file(path))
+    
+    def _get_base_checksum(self, name: str) -> str | None:
+        """
+        Checksum of the file name (relative to the handler directory) in the previous version, if recorded.
+        """
+        if not self._base_checksums:
+            return None
+        
+        return self._base_checksums.get(f'{self.handler}/{name}')
+    
+    async def _stream_to(self, path: PathModel, producer: Callable[[IO[bytes]], Awaitable], *, stages: list[StreamStage | CommandStage] | None = None) -> int:
+        """
+        Store the stream written by producer (called with the file object to write to) at path, or as a chunk
+        index next to it when the handler is chunked. The stream passes through stages on its way. Returns the stream size.
+        """
+        stages = list(stages or [])
+        hash_stage = None
+        
+        if self._checksums is not None:
+            # the stored stream is hashed on its way, so it is never read again
+            hash_stage = HashStage(ChecksumManifest.algorithm)
+            stages.append(hash_stage)
+        
+        if not stages:
+            return await self._store_stream(path, producer)
+        
+        pipeline = StreamPipeline(stages)
+        
+        try:
+            size = await self._store_stream(path, lambda f: pipeline.run(producer, f))
+        finally:
+            self._logger.info(f'Stream stages of "{path.path}": {pipeline.format_stats()}')
+        
+        if hash_stage:
+            self._checksums.add(path.path, hash_stage.hexdigest())
+        
+        return size
+    
+    async def _store_stream(self, path: PathModel, producer: Callable[[IO[bytes]], Awaitable]) -> int:
+        if not self._chunked or not self._chunk_store:
+            with FsAdapter.open(path, 'wb') as f:
+                await producer(f)
+            
+            return await FsAdapter.size(path)
+        
+        index = PathModel(path=f'{path.path}{ChunkStore.index_suffix}', host=path.host)
+        read_fd, write_fd = os.pipe()
+        store_task = asyncio.create_task(self._chunk_store.store(os.fdopen(read_fd, 'rb'), index))
+        
+        try:
+            with os.fdopen(write_fd, 'wb') as f:
+                await producer(f)
+        finally:
+            # the stream ends when the write end is closed. A store failure is the cause of a broken pipe, so it wins
+            size, new_bytes = await store_task
+        
+        self._logger.info(f'Stored {size / 1000 ** 2:.2f} MB stream as "{index.path}" ({new_bytes / 1000 ** 2:.2f} MB of new chunks)')
+        
+        return size
+
 class BackupHandlerError(Exception):
     def __init__(self, message, code):
         super().__init__(message)
-        self.code = code
+        self.code = code
\ No newline at end of file
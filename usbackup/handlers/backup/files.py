@@ -1,11 +1,23 @@
 import os
+import re
+import json
+import shlex
+import heapq
+import asyncio
 import datetime
-from typing import Literal
+import tempfile
+from typing import IO, Iterator, Literal
+from pydantic import Field, model_validator
+from usbackup.libraries.checksum_manifest import ChecksumManifest
+from usbackup.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from usbackup.libraries.compression import Compression, CompressionError, CompressionCodec
 from usbackup.libraries.fs_adapter import FsAdapter
 from usbackup.libraries.remote_cmd import RemoteCmd
 from usbackup.libraries.remote_sync import RemoteSync
+from usbackup.libraries.stream_pipeline import CompressStage, ThrottleStage
 from usbackup.models.path import PathModel
 from usbackup.models.host import HostModel
+from usbackup.models.transfer_stats import TransferStatsModel
 from usbackup.handlers.backup import HandlerBaseModel, BackupHandler, BackupHandlerError
 
 class FilesHandlerModel(HandlerBaseModel):
@@ -13,10 +25,39 @@ class FilesHandlerModel(HandlerBaseModel):
     limit: list[str] = []
     exclude: list[str] = []
     bwlimit: int | None = None
-    mode: Literal['incremental', 'archive', 'full'] = 'incremental'
+    mode: Literal['incremental', 'archive', 'archive-incremental', 'full'] = 'incremental'
+    parallel: int = Field(1, ge=1)
+    shards: int = Field(1, ge=1)
+    compression: CompressionCodec = 'gzip'
+    compression_level: int | None = None
+    compression_threads: int = Field(1, ge=0)
+    compression_location: Literal['remote', 'local'] = 'remote'
+    full_every: int = Field(7, ge=1)
+    chunked: bool = False
+    changed_only: bool = False
+    reconcile_every: int = Field(7, ge=1)
+    
+    @model_validator(mode='after')
+    @classmethod
+    def validate_after(cls, values):
+        try:
+            Compression.validate(values.compression, values.compression_level)
+        except CompressionError as e:
+            raise ValueError(str(e))
+        
+        return values
 
 class FilesHandler(BackupHandler):
     handler: str = 'files'
+    # changed-files state, stored next to the copied paths
+    _scan_state_file: str = '.usbackup-scan.json'
+    _scan_margin: int = 300
+    # file counts of the top-level entries of sharded paths, stored next to the copied paths for the next run
+    _shard_weights_file: str = '.usbackup-shards.json'
+    # files reported by rsync are hashed in batches of this many (files hard linked to each other are hashed once per batch)
+    _item_batch: int = 1000
+    _spool_read_size: int = 1024 * 1024
+    _pseudo_fs: tuple = ('proc', 'sysfs', 'devtmpfs', 'devpts', 'cgroup', 'cgroup2', 'debugfs', 'tracefs', 'securityfs', 'pstore', 'bpf')
     
     def __init__(self, model: FilesHandlerModel, *args, **kwargs) -> None:
         super().__init__(model, *args, **kwargs)
@@ -25,6 +66,23 @@ class FilesHandler(BackupHandler):
         self._exclude: list[str] = model.exclude
         self._bwlimit: int | None = model.bwlimit
         self._mode: str = model.mode
+        self._parallel: int = model.parallel
+        self._shards: int = model.shards
+        self._compression: str = model.compression
+        self._compression_level: int | None = model.compression_level
+        self._compression_threads: int = model.compression_threads
+        self._compression_location: str = model.compression_location
+        self._full_every: int = model.full_every
+        # only archives are streams, the other modes keep plain file trees
+        self._chunked: bool = model.chunked and model.mode in ('archive', 'archive-incremental')
+        self._changed_only: bool = model.changed_only and model.mode == 'incremental'
+        self._reconcile_every: int = model.reconcile_every
+        self._base_shard_weights: dict[str, int] = {}
+        self._shard_weights: dict[str, int] = {}
+    
+    @property
+    def cow_capable(self) -> bool:
+        return self._mode == 'incremental'
 
     async def backup(self, dest: PathModel, dest_link: PathModel | None = None) -> None:
         if self._mode == 'incremental':
@@ -39,6 +97,10 @@ class FilesHandler(BackupHandler):
             self._logger.info(f'Using archive backup mode')
             
             await self._backup_tar(dest)
+        elif self._mode == 'archive-incremental':
+            self._logger.info(f'Using incremental archive backup mode')
+            
+            await self._backup_tar_incremental(dest, dest_link)
         else:
             raise BackupHandlerError('Invalid backup mode', 1030)
     
@@ -62,39 +124,556 @@ class FilesHandler(BackupHandler):
         return src_paths
     
     async def _backup_rsync(self, dest: PathModel, dest_link: PathModel | None = None) -> None:
-        for src in self._src_paths:
-            options: list[str | tuple] = [
-                'archive',
-                'hard-links',
-                'acls',
-                'xattrs',
-                'relative',
-            ]
-
-            if self._exclude:
-                for exclude in self._exclude:
-                    options.append(('exclude', exclude))
+        semaphore = asyncio.Semaphore(self._parallel)
+        # a cloned version is its own base
+        base = dest if self._inplace else dest_link
+        scan_state = await self._load_scan_state(base) if self._changed_only and base else None
+        changed_only = self._use_changed_only(scan_state)
+        
+        if self._shards > 1 and base:
+            self._base_shard_weights = await self._load_shard_weights(base)
+        
+        if changed_only and not self._inplace:
+            # unchanged files are taken over from the previous version, only the changed ones are copied
+            self._logger.info(f'Linking files of "{dest_link}" into "{dest.path}"')
+            
+            try:
+                await CmdExec.exec(['cp', '-al', f'{dest_link.path}/.', dest.path])
+            except CmdExecProcessError as e:
+                raise BackupHandlerError(f'Failed to link previous version: {e}', 1037)
+        
+        if self._parallel > 1 and len(self._src_paths) > 1:
+            self._logger.info(f'Copying {len(self._src_paths)} paths with up to {self._parallel} parallel transfers')
+        
+        # entries copied by the changed-files passes
+        changed = set()
+        
+        async def rsync_path(src: PathModel) -> None:
+            async with semaphore:
+                if changed_only:
+                    await self._rsync_changed(src, dest, dest_link, changed=changed)
+                else:
+                    await self._rsync_path(src, dest, dest_link)
+        
+        start_time = datetime.datetime.now()
+        results = await asyncio.gather(*[rsync_path(src) for src in self._src_paths], return_exceptions=True)
+        errors = []
+        
+        # every path is attempted, failures are reported together
+        for src, result in zip(self._src_paths, results):
+            if isinstance(result, BaseException):
+                self._logger.error(f'Failed to copy "{src}": {result}')
+                errors.append(f'"{src.path}": {result}')
+        
+        if errors:
+            raise BackupHandlerError(f'Failed to copy {len(errors)} of {len(self._src_paths)} paths. ' + '; '.join(errors), 1034)
+        
+        if changed_only and self._checksums is not None and self._base_checksums is not None:
+            # rsync only reported the changed files, the others keep the checksums of the previous version
+            carried = await asyncio.to_thread(self._carry_checksums, dest.path, changed)
+            
+            self._logger.debug(f'Carried forward checksums of {carried} unchanged files')
+        
+        if self._changed_only:
+            await self._save_scan_state(dest, scan_state, changed_only, (datetime.datetime.now() - start_time).total_seconds())
+        
+        if self._shard_weights:
+            # replaced (not rewritten), like the scan state
+            await FsAdapter.write(dest.join(self._shard_weights_file), json.dumps(self._shard_weights))
+            await self._record_checksum(dest.join(self._shard_weights_file))
+    
+    def _use_changed_only(self, scan_state: dict | None) -> bool:
+        if not self._changed_only:
+            return False
+        
+        if not scan_state or not self._base_date:
+            self._logger.info('No previous full pass found. Running a full pass')
+            return False
+        
+        # deletions are only picked up by full passes
+        if scan_state['changed_runs'] + 1 >= self._reconcile_every:
+            self._logger.info(f'Running a full reconcile pass after {scan_state["changed_runs"]} changed-files runs')
+            return False
+        
+        self._logger.info(f'Copying files changed since {self._base_date} only')
+        
+        return True
+    
+    async def _load_scan_state(self, base: PathModel) -> dict | None:
+        state_path = base.join(self._scan_state_file)
+        
+        if not await FsAdapter.exists(state_path, 'f'):
+            return None
+        
+        try:
+            state = json.loads(await FsAdapter.read(state_path))
+            
+            return {'full_elapsed': float(state['full_elapsed']), 'changed_runs': int(state['changed_runs'])}
+        except (ValueError, KeyError, TypeError) as e:
+            self._logger.warning(f'Ignoring unusable scan state "{state_path}": {e}')
+            return None
+    
+    async def _load_shard_weights(self, base: PathModel) -> dict[str, int]:
+        weights_path = base.join(self._shard_weights_file)
+        
+        if not await FsAdapter.exists(weights_path, 'f'):
+            return {}
+        
+        try:
+            return {str(entry): int(count) for entry, count in json.loads(await FsAdapter.read(weights_path)).items()}
+        except (ValueError, AttributeError, TypeError) as e:
+            self._logger.warning(f'Ignoring unusable shard weights "{weights_path}": {e}')
+            return {}
+    
+    async def _save_scan_state(self, dest: PathModel, scan_state: dict | None, changed_only: bool, elapsed: float) -> None:
+        if changed_only:
+            saved = scan_state['full_elapsed'] - elapsed
+            
+            self._logger.info(f'Changed-files pass took {elapsed:.2f} seconds. Saved {saved:.2f} seconds compared to the last full pass ({scan_state["full_elapsed"]:.2f} seconds)')
+            
+            scan_state = {'full_elapsed': scan_state['full_elapsed'], 'changed_runs': scan_state['changed_runs'] + 1}
+        else:
+            scan_state = {'full_elapsed': elapsed, 'changed_runs': 0}
+        
+        # replaced (not rewritten) so the file linked from the previous version stays untouched
+        await FsAdapter.write(dest.join(self._scan_state_file), json.dumps(scan_state))
+        await self._record_checksum(dest.join(self._scan_state_file))
+    
+    async def _rsync_changed(self, src: PathModel, dest: PathModel, dest_link: PathModel | None = None, *, changed: set[str]) -> None:
+        prefix = src.path.strip('/')
+        # the margin covers clock differences between the backup server and the source host
+        since = int(self._base_date.timestamp()) - self._scan_margin
+        
+        self._logger.info(f'Scanning "{src}" for changes')
+        start_time = datetime.datetime.now()
+        
+        try:
+            exec_ret = await CmdExec.exec(['find', src.path, '-mindepth', '1', *self._gen_find_prune(), '-newerct', f'@{since}', '-printf', '%y %P\\0'], host=src.host)
+        except CmdExecProcessError as e:
+            raise BackupHandlerError(f'Failed to scan "{src}" for changes: {e}', 1038)
+        
+        files = []
+        dirs = []
+        new_dirs = set()
+        
+        for line in exec_ret.split('\0'):
+            if not line:
+                continue
+            
+            type, _, name = line.partition(' ')
+            entry = os.path.join(prefix, name)
+            
+            # copied along with its new parent directory (find lists directories before their contents)
+            if self._in_entries(os.path.dirname(entry), new_dirs):
+                continue
+            
+            if type != 'd':
+                files.append(entry)
+            elif not await FsAdapter.exists(dest.join(entry), 'd'):
+                # created or moved directories are copied whole, moved contents keep their old change times
+                new_dirs.add(entry)
+            else:
+                dirs.append(entry)
+        
+        scan_elapsed_s = (datetime.datetime.now() - start_time).total_seconds()
+        
+        self._logger.info(f'Found {len(files) + len(dirs)} changed entries and {len(new_dirs)} new directories in "{src}" in {scan_elapsed_s:.2f} seconds')
+        
+        if not self._inplace:
+            # changed files are still linked to the previous version, they must be replaced, not updated
+            for entry in files:
+                await FsAdapter.rm(dest.join(entry))
+        
+        changed.update(files, new_dirs)
+        
+        if files or dirs:
+            await self._rsync_files_from(dirs + files, src, dest, dest_link, recursive=False)
+        
+        if new_dirs:
+            await self._rsync_files_from(sorted(new_dirs), src, dest, dest_link)
+    
+    def _gen_find_prune(self) -> list[str]:
+        fs_types = []
+        
+        # kernel filesystems always look changed
+        for fs_type in self._pseudo_fs:
+            if fs_types:
+                fs_types.append('-o')
+            
+            fs_types += ['-fstype', fs_type]
+        
+        return ['(', *fs_types, ')', '-prune', '-o']
+    
+    async def _rsync_path(self, src: PathModel, dest: PathModel, dest_link: PathModel | None = None) -> None:
+        if self._shards > 1:
+            await self._rsync_sharded(src, dest, dest_link)
+            return
+        
+        options = self._gen_rsync_options(dest_link)
+        
+        self._logger.info(f'Copying "{src}" to "{dest.path}"')
+        start_time = datetime.datetime.now()
+        
+        stats = await self._rsync(src, dest, dest_link, options=options)
+        
+        self._stats.add(stats)
+        
+        end_time = datetime.datetime.now()
+        elapsed_time = end_time - start_time
+        elapsed_time_s = elapsed_time.total_seconds()
+        
+        self._logger.info(f'Finished copying "{src}" in {elapsed_time_s:.2f} seconds. {stats}')
+    
+    async def _rsync_sharded(self, src: PathModel, dest: PathModel, dest_link: PathModel | None = None) -> None:
+        prefix = src.path.strip('/')
+        entries = await self._list_top_level(src, prefix)
+        
+        if not entries:
+            self._logger.info(f'No entries found in "{src}". Copying it as a whole')
+            await self._rsync_files_from([src.path.strip('/') or '.'], src, dest, dest_link)
+            return
+        
+        if self._inplace:
+            await self._remove_vanished_entries(entries, src, dest)
+        
+        weights = self._gen_shard_weights(entries)
+        shards = self._partition(entries, weights, self._shards)
+        
+        self._logger.info(f'Copying "{src}" to "{dest.path}" in {len(shards)} shards ({len(entries)} top-level entries)')
+        start_time = datetime.datetime.now()
+        
+        results = await asyncio.gather(*[self._rsync_files_from(shard, src, dest, dest_link) for shard in shards], return_exceptions=True)
+        errors = [str(result) for result in results if isinstance(result, BaseException)]
+        
+        if errors:
+            raise BackupHandlerError(f'Failed to copy {len(errors)} of {len(shards)} shards of "{src.path}". ' + '; '.join(errors), 1035)
+        
+        for shard, stats in zip(shards, results):
+            self._add_shard_weights(shard, weights, stats.files_scanned)
+        
+        # pick up entries created while the shards were running
+        known_entries = set(entries)
+        new_entries = [entry for entry in await self._list_top_level(src, prefix) if entry not in known_entries]
+        
+        if new_entries:
+            self._logger.info(f'Copying {len(new_entries)} top-level entries that appeared during the run')
+            stats = await self._rsync_files_from(new_entries, src, dest, dest_link)
+            
+            self._add_shard_weights(new_entries, {entry: 1 for entry in new_entries}, stats.files_scanned)
+        
+        elapsed_time_s = (datetime.datetime.now() - start_time).total_seconds()
+        
+        self._logger.info(f'Finished copying "{src}" in {elapsed_time_s:.2f} seconds')
+    
+    async def _rsync_files_from(self, entries: list[str], src: PathModel, dest: PathModel, dest_link: PathModel | None = None, *, recursive: bool = True) -> TransferStatsModel:
+        # entries are relative to / so the layout matches a plain --relative copy of src
+        root = PathModel(path='/', host=src.host)
+        
+        with tempfile.NamedTemporaryFile('w', prefix='usbackup-shard-', suffix='.list') as f:
+            # null separated, file names may contain new lines
+            f.write('\0'.join(entries) + '\0')
+            f.flush()
+            
+            options = self._gen_rsync_options(dest_link)
+            options += [('files-from', f.name), 'from0']
+            
+            # --files-from turns off the recursion implied by --archive
+            if recursive:
+                options.append('recursive')
+            else:
+                # --delete needs recursion, vanished files are removed by the next full pass
+                options = [option for option in options if option != 'delete']
+            
+            stats = await self._rsync(root, dest, dest_link, options=options)
+        
+        self._stats.add(stats)
+        
+        self._logger.debug(f'Finished copying shard of {len(entries)} entries. {stats}')
+        
+        return stats
+    
+    async def _rsync(self, src: PathModel, dest: PathModel, dest_link: PathModel | None = None, *, options: list) -> TransferStatsModel:
+        """
+        Run rsync, recording the checksums of the files it reported. Only transferred files are hashed, files
+        linked from (or left unchanged in the clone of) the previous version take over its checksums.
+        """
+        if self._checksums is None:
+            return await RemoteSync.rsync(src, dest, options=options)
+        
+        # rsync reports files before moving them into place, so they are hashed once it is done.
+        # Meanwhile the reported files are spooled to disk, not kept in memory
+        with tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogateescape', newline='', dir=dest.path) as spool:
+            def collect_item(itemized: str, name: str) -> None:
+                # regular files only (deletions are reported as "*deleting")
+                if itemized[1] == 'f' and not itemized.startswith('*'):
+                    spool.write(f'{itemized}{name}\0')
+            
+            stats = await RemoteSync.rsync(src, dest, options=options, on_item=collect_item)
+            
+            spool.seek(0)
+            recorded, hashed = await asyncio.to_thread(self._record_items, spool, dest.path, dest_link.path if dest_link else None)
+        
+        self._logger.debug(f'Recorded checksums of {recorded} files ({hashed} hashed)')
+        
+        return stats
+    
+    def _record_items(self, spool: IO[str], dest: str, dest_link: str | None) -> tuple[int, int]:
+        recorded = 0
+        hashed = 0
+        
+        for items in self._read_item_batches(spool):
+            # files hard linked to each other are hashed once
+            inodes = {}
+            
+            for itemized, name in items:
+                path = os.path.join(dest, name)
+                
+                try:
+                    stat = os.lstat(path)
+                except FileNotFoundError:
+                    continue
+                
+                key = (stat.st_dev, stat.st_ino)
+                checksum = self._get_base_checksum(name) if self._is_base_file(itemized, stat, name, dest_link) else None
+                
+                if checksum is None:
+                    checksum = inodes.get(key)
+                
+                if checksum is None:
+                    try:
+                        checksum = ChecksumManifest.hash_local_file(path)
+                    except FileNotFoundError:
+                        continue
+                    
+                    inodes[key] = checksum
+                    hashed += 1
+                
+                self._checksums.add(path, checksum)
+                recorded += 1
+        
+        return recorded, hashed
+    
+    def _read_item_batches(self, spool: IO[str]) -> Iterator[list[tuple[str, str]]]:
+        batch = []
+        rest = ''
+        
+        while data := spool.read(self._spool_read_size):
+            records = (rest + data).split('\0')
+            # the last record is incomplete (empty at the end of the spool)
+            rest = records.pop()
+            
+            for record in records:
+                # itemized changes are 11 characters, followed by the name
+                batch.append((record[:11], record[11:]))
+                
+                if len(batch) >= self._item_batch:
+                    yield batch
+                    batch = []
+        
+        if batch:
+            yield batch
+    
+    def _carry_checksums(self, dest: str, changed: set[str]) -> int:
+        """
+        Copy the checksums of the files of the previous version that were not changed into the manifest.
+        """
+        prefix = f'{self.handler}/'
+        carried = 0
+        
+        for name, checksum in self._base_checksums.entries(prefix):
+            name = name[len(prefix):]
+            
+            # the scan state is written again
+            if name == self._scan_state_file:
+                continue
+            
+            # copied again, either as a changed file or as part of a new directory
+            if self._in_entries(name, changed):
+                continue
+            
+            self._checksums.add(os.path.join(dest, name), checksum)
+            carried += 1
+        
+        return carried
+    
+    def _in_entries(self, name: str, entries: set[str]) -> bool:
+        """
+        Whether name is one of entries or inside one of them.
+        """
+        while name:
+            if name in entries:
+                return True
+            
+            name = os.path.dirname(name)
+        
+        return False
+    
+    def _is_base_file(self, itemized: str, stat: os.stat_result, name: str, dest_link: str | None) -> bool:
+        """
+        Whether the file holds the same data as in the previous version.
+        """
+        # not transferred, the file of the cloned / linked version was kept
+        if itemized[0] == '.':
+            return True
+        
+        # hard linked, either to the previous version (--link-dest) or to another file of this transfer
+        if itemized[0] == 'h' and dest_link:
+            try:
+                base_stat = os.lstat(os.path.join(dest_link, name))
+            except OSError:
+                return False
+            
+            return (base_stat.st_dev, base_stat.st_ino) == (stat.st_dev, stat.st_ino)
+        
+        return False
+    
+    async def _list_top_level(self, path: PathModel, prefix: str) -> list[str]:
+        try:
+            exec_ret = await CmdExec.exec(['find', path.path, '-mindepth', '1', '-maxdepth', '1', '-printf', '%P\\n'], host=path.host)
+        except CmdExecProcessError as e:
+            raise BackupHandlerError(f'Failed to list "{path}": {e}', 1036)
+        
+        return sorted(os.path.join(prefix, name) for name in exec_ret.splitlines() if name)
+    
+    async def _remove_vanished_entries(self, entries: list[str], src: PathModel, dest: PathModel) -> None:
+        """
+        Remove top-level entries of a cloned version that no longer exist on the source
+        (--delete only covers the entries listed in --files-from).
+        """
+        prefix = src.path.strip('/')
+        cloned_path = dest.join(prefix)
+        
+        if not await FsAdapter.exists(cloned_path, 'd'):
+            return
+        
+        current = set(entries)
+        
+        for entry in await self._list_top_level(cloned_path, prefix):
+            if entry not in current:
+                self._logger.debug(f'Removing vanished entry "{entry}" from cloned version')
+                await FsAdapter.rm(dest.join(entry))
+    
+    def _gen_shard_weights(self, entries: list[str]) -> dict[str, int]:
+        """
+        Estimate the cost of each entry from the number of files the previous run counted for it.
+        """
+        counts = [self._base_shard_weights.get(entry) for entry in entries]
+        known = [count for count in counts if count is not None]
+        # new entries are assumed to be average sized
+        default = sum(known) // len(known) if known else 1
+        
+        return {entry: count if count is not None else default for entry, count in zip(entries, counts)}
+    
+    def _add_shard_weights(self, entries: list[str], weights: dict[str, int], files: int) -> None:
+        # rsync counts the files of the whole shard, they are split between its entries by their estimated weights
+        total = sum(weights[entry] for entry in entries)
+        
+        for entry in entries:
+            # directories without files still cost a round trip
+            self._shard_weights[entry] = max(1, round(files * weights[entry] / total))
+    
+    def _partition(self, entries: list[str], weights: dict[str, int], shards: int) -> list[list[str]]:
+        # longest processing time first: biggest entries go to the least loaded shard
+        heap = [(0, i) for i in range(min(shards, len(entries)))]
+        partitions: list[list[str]] = [[] for _ in heap]
+        
+        for entry in sorted(entries, key=lambda e: weights[e], reverse=True):
+            load, i = heapq.heappop(heap)
+            partitions[i].append(entry)
+            heapq.heappush(heap, (load + weights[entry], i))
+        
+        return partitions
+    
+    def _gen_rsync_options(self, dest_link: PathModel | None = None) -> list[str | tuple]:
+        options: list[str | tuple] = [
+            'archive',
+            'hard-links',
+            'acls',
+            'xattrs',
+            'relative',
+        ]
 
-            if self._bwlimit:
-                options.append(('bwlimit', str(self._bwlimit)))
+        if self._exclude:
+            for exclude in self._exclude:
+                options.append(('exclude', exclude))
 
-            if dest_link:
-                options.append(('link-dest', dest_link.path))
+        if self._bwlimit:
+            options.append(('bwlimit', str(self._bwlimit)))
 
-            self._logger.info(f'Copying "{src}" to "{dest.path}"')
-            start_time = datetime.datetime.now()
+        if dest_link:
+            options.append(('link-dest', dest_link.path))
+        
+        if self._inplace:
+            # only rewrite the changed blocks of the cloned files, so unchanged extents stay shared
+            options += ['inplace', 'no-whole-file', 'delete']
+        
+        if self._checksums is not None:
+            # report unchanged files too, so the checksums of the version cover every file. Names are printed unescaped
+            options += ['itemize-changes', 'itemize-changes', '8-bit-output']
+        
+        return options
+    
+    async def _backup_tar(self, dest: PathModel) -> None:
+        sources = self._gen_tar_sources()
+        archive_path = dest.join(f'archive.tar{Compression.gen_extension(self._compression)}')
+        
+        await self._stream_archive(['tar', 'cf', '-', *sources], archive_path)
+    
+    async def _backup_tar_incremental(self, dest: PathModel, dest_link: PathModel | None = None) -> None:
+        sources = self._gen_tar_sources()
+        prev_level = await self._get_archive_level(dest_link) if dest_link else None
+        
+        # a new chain starts when there is no usable previous archive or the chain reached full_every archives
+        if prev_level is None or prev_level + 1 >= self._full_every:
+            level = 0
+        else:
+            level = prev_level + 1
+        
+        self._logger.info(f'Creating level {level} archive')
+        
+        # tar updates the snapshot file in place, so it works on a copy on the source host
+        host_snar = f'/tmp/usbackup-{self._id}.snar'
+        self._cleanup.push(f'remove_snapshot_file_{self._id}', CmdExec.exec, ['rm', '-f', host_snar], host=self._host)
+        
+        # removed when the archive fails too, in daemon mode the process-wide cleanup only runs on exit
+        try:
+            if level:
+                with FsAdapter.open(dest_link.join('archive.snar'), 'rb') as f:
+                    await CmdExec.exec(['sh', '-c', 'cat > "$1"', 'sh', host_snar], host=self._host, stdin=f)
+            else:
+                await CmdExec.exec(['rm', '-f', host_snar], host=self._host)
             
-            stats = await RemoteSync.rsync(src, dest, options=options)
+            archive_path = dest.join(f'archive.{level}.tar{Compression.gen_extension(self._compression)}')
             
-            self._logger.debug(stats)
+            await self._stream_archive(['tar', 'cf', '-', f'--listed-incremental={host_snar}', *sources], archive_path)
             
-            end_time = datetime.datetime.now()
-            elapsed_time = end_time - start_time
-            elapsed_time_s = elapsed_time.total_seconds()
+            # the updated snapshot file is the base of the next archive in the chain
+            with FsAdapter.open(dest.join('archive.snar'), 'wb') as f:
+                await CmdExec.exec(['cat', host_snar], host=self._host, stdout=f)
+        finally:
+            await self._cleanup.consume(f'remove_snapshot_file_{self._id}')
+        
+        await self._record_checksum(dest.join('archive.snar'))
+        
+        if level:
+            self._add_dependency(dest_link)
+    
+    async def _get_archive_level(self, path: PathModel) -> int | None:
+        """
+        Return the level of the incremental archive stored at path (None if there is no usable archive).
+        """
+        if not await FsAdapter.exists(path.join('archive.snar'), 'f'):
+            return None
+        
+        for name in await FsAdapter.ls(path):
+            match = re.match(r'^archive\.(\d+)\.tar', name)
             
-            self._logger.info(f'Finished copying "{src}" in {elapsed_time_s:.2f} seconds')
+            if match:
+                return int(match.group(1))
+        
+        return None
     
-    async def _backup_tar(self, dest: PathModel) -> None:
+    def _gen_tar_sources(self) -> list[str]:
         sources = []
 
         for src in self._src_paths:
@@ -103,7 +682,36 @@ class FilesHandler(BackupHandler):
         if not sources:
             raise BackupHandlerError('No sources to archive', 1033)
         
-        with FsAdapter.open(dest.join('archive.tar.gz'), 'wb') as f:
-            self._logger.info(f'Streaming archive from "{self._host}" to "{dest.path}"')
+        return sources
+    
+    async def _stream_archive(self, tar_cmd: list, archive_path: PathModel) -> None:
+        # chunks of a compressed stream only repeat when the compressor resyncs on unchanged input
+        compress_cmd = Compression.gen_cmd(self._compression, level=self._compression_level, threads=self._compression_threads, rsyncable=self._chunked)
+        dest_dir = os.path.dirname(archive_path.path)
+        stages = []
+        
+        if not compress_cmd:
+            self._logger.info(f'Streaming uncompressed archive from "{self._host}" to "{dest_dir}"')
+            
+            producer = lambda f: RemoteCmd.exec(tar_cmd, self._host, stdout=f)
+        elif self._compression_location == 'remote':
+            self._logger.info(f'Streaming archive compressed with {self._compression} on "{self._host}" to "{dest_dir}"')
             
-            await RemoteCmd.exec(['tar', 'czf', '-', *sources], self._host, stdout=f)
\ No newline at end of file
+            # tar failures must not be hidden by the compressor exit status where the shell supports it
+            script = f'(set -o pipefail) 2>/dev/null && set -o pipefail; {shlex.join(tar_cmd)} | {shlex.join(compress_cmd)}'
+            
+            producer = lambda f: RemoteCmd.exec(['sh', '-c', script], self._host, stdout=f)
+        else:
+            self._logger.info(f'Streaming archive from "{self._host}" to "{dest_dir}" and compressing it locally with {self._compression}')
+            
+            producer = lambda f: CmdExec.exec(tar_cmd, host=self._host, stdout=f)
+            stages.append(CompressStage(self._compression, level=self._compression_level, threads=self._compression_threads, rsyncable=self._chunked))
+        
+        if self._bwlimit:
+            # bwlimit is in KB/s, like the rsync one. It caps the stream as it comes from the host (compressed
+            # or not, depending on the compression location), so it goes before any local stage
+            stages.insert(0, ThrottleStage(self._bwlimit * 1024))
+        
+        archive_size = await self._stream_to(archive_path, producer, stages=stages)
+        
+        self._stats.add(stream_bytes=archive_size, total_bytes=archive_size, total_files=1)
\ No newline at end of file
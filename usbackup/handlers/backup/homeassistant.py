@@ -1,17 +1,20 @@
 import json
 from usbackup.libraries.remote_cmd import RemoteCmd
-from usbackup.libraries.remote_sync import RemoteSync
+from usbackup.libraries.remote_fetch import RemoteFetch, RemoteFetchError
 from usbackup.models.path import PathModel
 from usbackup.handlers.backup import HandlerBaseModel, BackupHandler, BackupHandlerError
 
 class HomeassistantHandlerModel(HandlerBaseModel):
     handler: str = 'homeassistant'
+    chunked: bool = False
 
 class HomeassistantHandler(BackupHandler):
     handler: str = 'homeassistant'
 
     def __init__(self, model: HomeassistantHandlerModel, *args, **kwargs) -> None:
         super().__init__(model, *args, **kwargs)
+        
+        self._chunked: bool = model.chunked
 
     async def backup(self, dest: PathModel, dest_link: PathModel | None = None) -> None:
         self._logger.info(f'Generating backup archive on "{self._host}"')
@@ -33,11 +36,16 @@ class HomeassistantHandler(BackupHandler):
         self._cleanup.push(f'remove_backup_archive_{self._id}', RemoteCmd.exec, ['ha', 'backups', 'remove', slug], self._host)
 
         archive_path = PathModel(path=f'/root/backup/{slug}.tar', host=self._host)
-
-        self._logger.info(f'Copying "{archive_path}" to "{dest.path}"')
         
-        await RemoteSync.scp(archive_path, dest.join('archive.tar'))
+        self._logger.info(f'Streaming "{archive_path}" to "{dest.path}" and deleting it on "{self._host}"')
+        
+        # the archive is removed by the same remote invocation reading it (and chunked while it is read when chunked)
+        try:
+            archive_size = await self._stream_to(dest.join('archive.tar'), lambda f: RemoteFetch.stream(archive_path.path, self._host, f, cleanup=['ha', 'backups', 'remove', slug]))
+        except RemoteFetchError as e:
+            await self._cleanup.consume(f'remove_backup_archive_{self._id}')
+            raise BackupHandlerError(f'Failed to copy backup archive: {e}', 1023)
         
-        self._logger.info(f'Deleting backup archive on "{self._host}"')
+        self._cleanup.pop(f'remove_backup_archive_{self._id}')
         
-        await self._cleanup.consume(f'remove_backup_archive_{self._id}')
\ No newline at end of file
+        self._stats.add(stream_bytes=archive_size, total_bytes=archive_size, total_files=1)
\ No newline at end of file
@@ -1,5 +1,6 @@
+import os
 from usbackup.libraries.remote_cmd import RemoteCmd
-from usbackup.libraries.remote_sync import RemoteSync
+from usbackup.libraries.remote_fetch import RemoteFetch, RemoteFetchError
 from usbackup.models.path import PathModel
 from usbackup.handlers.backup import HandlerBaseModel, BackupHandler, BackupHandlerError
 
@@ -13,18 +14,21 @@ class OpenwrtHandler(BackupHandler):
         super().__init__(model, *args, **kwargs)
 
     async def backup(self, dest: PathModel, dest_link: PathModel | None = None) -> None:
-        self._logger.info(f'Generating backup archive "/tmp/archive.tar.gz" on "{self._host}"')
-
-        await RemoteCmd.exec(['sysupgrade', '-b', '/tmp/archive.tar.gz'], self._host)
-
         archive_path = PathModel(path='/tmp/archive.tar.gz', host=self._host)
 
-        self._cleanup.push(f'remove_backup_archive_{self._id}', RemoteCmd.exec, ['rm', archive_path.path], self._host)
+        # only needed when the connection drops before the remote command removes the archive itself
+        self._cleanup.push(f'remove_backup_archive_{self._id}', RemoteCmd.exec, ['rm', '-f', archive_path.path], self._host)
+        
+        self._logger.info(f'Generating backup archive "{archive_path.path}" on "{self._host}" and copying it to "{dest.path}"')
 
-        self._logger.info(f'Copying "{archive_path}" to "{dest.path}"')
+        # generate, copy and remove in one remote invocation
+        try:
+            stats = await RemoteFetch.fetch([archive_path.path], self._host, dest, generate=['sysupgrade', '-b', archive_path.path], cleanup=['rm', '-f', archive_path.path])
+        except RemoteFetchError as e:
+            await self._cleanup.consume(f'remove_backup_archive_{self._id}')
+            raise BackupHandlerError(f'Failed to copy backup archive: {e}', 1060)
 
-        await RemoteSync.scp(archive_path, dest)
+        self._cleanup.pop(f'remove_backup_archive_{self._id}')
 
-        self._logger.info(f'Deleting backup archive on "{self._host}"')
-        
-        await self._cleanup.consume(f'remove_backup_archive_{self._id}')
\ No newline at end of file
+        self._stats.add(stats)
+        await self._record_checksum(dest.join(os.path.basename(archive_path.path)))
\ No newline at end of file
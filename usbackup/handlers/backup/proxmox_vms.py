@@ -1,8 +1,18 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
 from typing import Literal
+from pydantic import Field, model_validator
 from usbackup.libraries.remote_cmd import RemoteCmd
-from usbackup.libraries.cmd_exec import CmdExec
+from usbackup.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from usbackup.libraries.chunk_store import ChunkStore
+from usbackup.libraries.compression import Compression, CompressionError
 from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.libraries.stream_pipeline import CompressStage
 from usbackup.models.path import PathModel
+from usbackup.models.transfer_stats import TransferStatsModel
 from usbackup.handlers.backup import HandlerBaseModel, BackupHandler, BackupHandlerError
 
 class ProxmoxVmsHandlerModel(HandlerBaseModel):
@@ -12,9 +22,41 @@ class ProxmoxVmsHandlerModel(HandlerBaseModel):
     bwlimit: int | None = None
     mode: Literal['snapshot', 'suspend', 'stop'] = 'snapshot'
     compress: Literal['zstd', 'gzip', 'lzo', 'none'] = 'zstd'
+    compression_location: Literal['remote', 'local'] = 'remote'
+    compression_level: int | None = None
+    compression_threads: int = Field(1, ge=0)
+    chunked: bool = False
+    parallel: int = Field(1, ge=1)
+    skip_unchanged: bool = False
+    
+    @model_validator(mode='after')
+    @classmethod
+    def validate_after(cls, values):
+        if values.compression_location == 'remote':
+            return values
+        
+        if values.compress == 'lzo':
+            raise ValueError('lzo dumps can only be compressed remotely')
+        
+        if values.compress != 'none':
+            try:
+                Compression.validate(ProxmoxVmsHandler.local_codecs[values.compress], values.compression_level)
+            except CompressionError as e:
+                raise ValueError(str(e))
+        
+        return values
 
 class ProxmoxVmsHandler(BackupHandler):
     handler: str = 'proxmox_vms'
+    # dumps of the version and the fingerprints of the stopped VMs they were taken from
+    _dumps_file: str = 'dumps.json'
+    # disks included in a vzdump (unused disks and cdroms are not)
+    _disk_key_pattern: re.Pattern = re.compile(r'^(ide|sata|scsi|virtio|efidisk|tpmstate)\d+$')
+    # codecs compressing dumps on the backup server (same formats and extensions as the vzdump ones)
+    local_codecs: dict[str, str] = {
+        'zstd': 'zstd',
+        'gzip': 'pigz',
+    }
     
     def __init__(self, model: ProxmoxVmsHandlerModel, *args, **kwargs) -> None:
         super().__init__(model, *args, **kwargs)
@@ -24,6 +66,12 @@ class ProxmoxVmsHandler(BackupHandler):
         self._bwlimit: int | None = model.bwlimit
         self._mode: str = model.mode
         self._compress: str = model.compress
+        self._chunked: bool = model.chunked
+        self._parallel: int = model.parallel
+        self._skip_unchanged: bool = model.skip_unchanged
+        self._compress_locally: bool = model.compression_location == 'local' and model.compress != 'none'
+        self._compression_level: int | None = model.compression_level
+        self._compression_threads: int = model.compression_threads
 
         self._compression_types = {
             'zstd': 'vma.zst',
@@ -57,15 +105,53 @@ class ProxmoxVmsHandler(BackupHandler):
             self._logger.info(f'No VMs left to backup after limit/exclude filters')
             return
         
+        if self._parallel > 1 and len(vms) > 1:
+            # largest first, so the longest dumps do not start last
+            vms = await self._sort_by_size(vms)
+        
         self._logger.info(f'Backing up VMs "{vms}"')
         
-        for vm in vms:
-            await self._backup_vm(vm, dest)
-            
-    async def _backup_vm(self, vm: int, dest: PathModel) -> None:
+        prev_dumps = await self._load_dumps(dest_link) if self._skip_unchanged and dest_link else {}
+        semaphore = asyncio.Semaphore(self._parallel)
+        
+        async def backup_vm(vm: int) -> dict:
+            async with semaphore:
+                return await self._backup_vm(vm, dest, dest_link, prev_dumps.get(str(vm)))
+        
+        results = await asyncio.gather(*[backup_vm(vm) for vm in vms], return_exceptions=True)
+        dumps = {}
+        errors = []
+        
+        for vm, result in zip(vms, results):
+            if isinstance(result, BaseException):
+                self._logger.error(f'Failed to backup VM {vm}: {result}')
+                errors.append(f'{vm}: {result}')
+            else:
+                dumps[str(vm)] = result
+        
+        if self._skip_unchanged:
+            # the fingerprints are recorded with the version, so the next run can compare with them
+            await FsAdapter.write(dest.join(self._dumps_file), json.dumps(dumps, indent=4))
+            await self._record_checksum(dest.join(self._dumps_file))
+        
+        if errors:
+            raise BackupHandlerError(f'Failed to backup {len(errors)} of {len(vms)} VMs. ' + '; '.join(errors), 1004)
+    
+    async def _sort_by_size(self, vms: list[int]) -> list[int]:
+        try:
+            exec_ret = await RemoteCmd.exec(['pvesh', 'get', '/nodes/localhost/qemu', '--output-format', 'json'], self._host)
+            sizes = {int(vm['vmid']): int(vm.get('maxdisk') or 0) for vm in json.loads(exec_ret)}
+        except Exception as e:
+            self._logger.warning(f'Failed to fetch VM disk sizes: {e}. Keeping the VM list order')
+            return vms
+        
+        return sorted(vms, key=lambda vm: sizes.get(vm, 0), reverse=True)
+    
+    async def _backup_vm(self, vm: int, dest: PathModel, dest_link: PathModel | None, prev_dump: dict | None) -> dict:
         cmd_options = [
             ('mode', self._mode),
-            ('compress', self._compress),
+            # locally compressed dumps leave the hypervisor raw
+            ('compress', 'none' if self._compress_locally else self._compress),
             ('notification-mode', 'legacy-sendmail'),
             # ('notification-policy', 'never'),
             'stdout',
@@ -77,8 +163,119 @@ class ProxmoxVmsHandler(BackupHandler):
         
         cmd_options = CmdExec.parse_cmd_options(cmd_options)
         file_name = f'vzdump-qemu-{vm}.{self._compression_types[self._compress]}'
+        stored_name = f'{file_name}{ChunkStore.index_suffix}' if self._chunked and self._chunk_store else file_name
+        fingerprint = await self._fingerprint_vm(vm) if self._skip_unchanged else None
+        
+        if fingerprint and prev_dump and prev_dump['fingerprint'] == fingerprint and prev_dump['file'] == stored_name:
+            if await self._link_dump(dest_link.join(stored_name), dest.join(stored_name)):
+                dump_size = await FsAdapter.size(dest.join(stored_name))
+                # chunked dumps are recorded under their stream name
+                await self._record_checksum(dest.join(file_name), file_name)
+                
+                self._logger.info(f'VM {vm} is stopped and unchanged. Linked dump from "{dest_link.path}"')
+                self._stats.add(TransferStatsModel(changes={'unchanged': 1}), total_bytes=dump_size, total_files=1)
+                
+                return {'file': stored_name, 'fingerprint': fingerprint}
 
-        with FsAdapter.open(dest.join(file_name), 'wb') as f:
+        vzdump_cmd = ['vzdump', str(vm), *cmd_options]
+        producer = lambda f: RemoteCmd.exec(vzdump_cmd, self._host, stdout=f)
+        stages = []
+        
+        if self._compress_locally:
+            self._logger.info(f'Streaming vzdump for VM {vm} from "{self._host}" to "{dest.path}" and compressing it locally with {self._compress}')
+            
+            # chunks of a compressed stream only repeat when the compressor resyncs on unchanged input
+            stages.append(CompressStage(self.local_codecs[self._compress], level=self._compression_level, threads=self._compression_threads, rsyncable=self._chunked))
+        else:
             self._logger.info(f'Streaming vzdump for VM {vm} from "{self._host}" to "{dest.path}"')
+        
+        start_time = time.monotonic()
+        
+        try:
+            dump_size = await self._stream_to(dest.join(file_name), producer, stages=stages)
+        except Exception:
+            # an incomplete dump can not be restored
+            await FsAdapter.rm(dest.join(file_name))
+            await FsAdapter.rm(dest.join(f'{file_name}{ChunkStore.index_suffix}'))
+            raise
+        
+        elapsed = time.monotonic() - start_time
+        
+        # per VM throughput, to compare remote and local compression
+        self._logger.info(f'Dumped VM {vm}: {dump_size / 1000 ** 2:.2f} MB in {elapsed:.2f} seconds ({dump_size / 1000 ** 2 / max(elapsed, 0.001):.2f} MB/s)')
+        self._stats.add(stream_bytes=dump_size, total_bytes=dump_size, total_files=1)
+        
+        return {'file': stored_name, 'fingerprint': fingerprint}
+    
+    async def _fingerprint_vm(self, vm: int) -> str | None:
+        """
+        Fingerprint a stopped VM from its config and the size / change markers of its disks.
+        Returns None for running VMs and disks that can not be fingerprinted.
+        """
+        try:
+            status = await RemoteCmd.exec(['qm', 'status', str(vm)], self._host)
+            
+            if status.split()[-1:] != ['stopped']:
+                return None
+            
+            config = await RemoteCmd.exec(['qm', 'config', str(vm)], self._host)
+            parts = [self._mode, self._compress, config]
             
-            await RemoteCmd.exec(['vzdump', str(vm), *cmd_options], self._host, stdout=f)
\ No newline at end of file
+            for line in config.splitlines():
+                key, _, value = line.partition(': ')
+                
+                if key == 'lock':
+                    return None
+                
+                if not self._disk_key_pattern.match(key) or 'media=cdrom' in value:
+                    continue
+                
+                volume = value.split(',')[0]
+                
+                if ':' not in volume:
+                    # passed through devices
+                    return None
+                
+                path = await RemoteCmd.exec(['pvesm', 'path', volume], self._host)
+                
+                if path.startswith('/dev/zvol/'):
+                    # writes change the space referenced by the zvol
+                    markers = await RemoteCmd.exec(['zfs', 'get', '-Hp', '-o', 'value', 'written,referenced,logicalreferenced', path[len('/dev/zvol/'):]], self._host)
+                elif path.startswith('/') and not path.startswith('/dev/'):
+                    markers = await RemoteCmd.exec(['stat', '-L', '-c', '%s %Y', path], self._host)
+                else:
+                    # block devices (lvm, ceph, ...) do not record changes
+                    return None
+                
+                parts.append(f'{volume} {" ".join(markers.split())}')
+        except Exception as e:
+            self._logger.warning(f'Failed to fingerprint VM {vm}: {e}')
+            return None
+        
+        return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+    
+    async def _link_dump(self, src: PathModel, dst: PathModel) -> bool:
+        if not await FsAdapter.exists(src, 'f'):
+            return False
+        
+        # hardlink, or a reflink copy when the versions are on different filesystems
+        for cmd in (['cp', '-l', src.path, dst.path], ['cp', '--reflink=auto', src.path, dst.path]):
+            try:
+                await CmdExec.exec(cmd)
+                return True
+            except CmdExecProcessError as e:
+                self._logger.debug(f'{" ".join(cmd[:2])} failed: {e}')
+        
+        return False
+    
+    async def _load_dumps(self, dest_link: PathModel) -> dict:
+        dumps_path = dest_link.join(self._dumps_file)
+        
+        if not await FsAdapter.exists(dumps_path, 'f'):
+            return {}
+        
+        try:
+            return json.loads(await FsAdapter.read(dumps_path))
+        except ValueError as e:
+            self._logger.warning(f'Failed to read "{dumps_path.path}": {e}')
+            return {}
\ No newline at end of file
@@ -1,4 +1,5 @@
-from usbackup.libraries.remote_sync import RemoteSync
+import os
+from usbackup.libraries.remote_fetch import RemoteFetch, RemoteFetchError
 from usbackup.models.path import PathModel
 from usbackup.handlers.backup import HandlerBaseModel, BackupHandler, BackupHandlerError
 
@@ -12,10 +13,15 @@ class TruenasHandler(BackupHandler):
         super().__init__(model, *args, **kwargs)
 
     async def backup(self, dest: PathModel, dest_link: PathModel | None = None) -> None:
+        config_files = ['/data/freenas-v1.db', '/data/pwenc_secret']
+        
         self._logger.info(f'Copying config files from "{self._host}" to "{dest.path}"')
         
-        db_path = PathModel(path='/data/freenas-v1.db', host=self._host)
-        secret_path = PathModel(path='/data/pwenc_secret', host=self._host)
+        try:
+            self._stats.add(await RemoteFetch.fetch(config_files, self._host, dest))
+        except RemoteFetchError as e:
+            raise BackupHandlerError(f'Failed to copy config files: {e}', 1050)
         
-        await RemoteSync.rsync(db_path, dest)
-        await RemoteSync.rsync(secret_path, dest)
\ No newline at end of file
+        # fetched files are stored under their base names
+        for config_file in config_files:
+            await self._record_checksum(dest.join(os.path.basename(config_file)))
\ No newline at end of file
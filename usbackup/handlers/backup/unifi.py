@@ -1,5 +1,9 @@
+import json
+import time
+import base64
+import asyncio
 import aiohttp
-from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.libraries.http_pool import HttpPool
 from usbackup.models.path import PathModel
 from usbackup.handlers.backup import HandlerBaseModel, BackupHandler, BackupHandlerError
 
@@ -10,6 +14,12 @@ class UnifiHandlerModel(HandlerBaseModel):
 
 class UnifiHandler(BackupHandler):
     handler: str = 'unifi'
+    probe_port: int | None = 443
+    # user@host -> (csrf token, cookie, expiry time) of the logins done by this process
+    _auth_cache: dict[str, tuple[str, str, float]] = {}
+    # lifetime assumed for tokens without an expiry claim
+    _token_lifetime: int = 3600
+    _chunk_size: int = 1024 * 1024
 
     def __init__(self, model: UnifiHandlerModel, *args, **kwargs) -> None:
         super().__init__(model, *args, **kwargs)
@@ -20,44 +30,95 @@ class UnifiHandler(BackupHandler):
     async def backup(self, dest: PathModel, dest_link: PathModel | None = None) -> None:
         self._logger.debug(f'Creating session for Unifi controller at "{self._host}"')
         
-        async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
-            login_url = f'https://{self._host}/api/auth/login'
-            login_data = {'username': self._user, 'password': self._password}
+        async with HttpPool.session(cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+            auth = self._auth_cache.get(self._gen_auth_key())
             
-            self._logger.info(f'Authenticating to Unifi controller at "{self._host}"')
-            
-            async with session.post(login_url, json=login_data, ssl=False) as resp:
-                if resp.status != 200:
-                    raise BackupHandlerError(f'Failed to authenticate to Unifi controller: {resp.status}', 1001)
-
-                self._logger.info('Authentication successful')
-                
-                # get csrf token
-                csrf_token = resp.headers.get('X-Csrf-Token')
-
-                if not csrf_token:
-                    raise BackupHandlerError('CSRF token not found in response headers', 1003)
+            if auth and auth[2] > time.time():
+                self._logger.info(f'Reusing cached authentication to Unifi controller at "{self._host}"')
                 
-                # get cookies from set-cookie headers
-                cookie = resp.headers.get('Set-Cookie', '').split(';')[0].strip()
-
-            backup_url = f'https://{self._host}/api/backup/download'
-            backup_headers = {
-                'X-Csrf-Token': csrf_token,
-                'Cookie': cookie,
-            }
-
-            self._logger.info(f'Getting backup file from Unifi controller at "{self._host}"')
-
-            # get backup file
-            async with session.get(backup_url, headers=backup_headers, ssl=False) as resp:
-                if resp.status != 200:
-                    raise BackupHandlerError(f'Failed to download backup: {resp.status}', 1002)
-
-                self._logger.info('Backup download successful')
+                # the cached token may have been revoked (eg. controller restart)
+                if await self._download(session, dest, auth):
+                    return
                 
-                # save backup file
-                with FsAdapter.open(dest.join('unifi_backup.unifi'), 'wb') as f:
-                    content = await resp.read()
-                    f.write(content)
-                    self._logger.info(f'Backup saved to "{dest.path}"')
\ No newline at end of file
+                self._logger.info('Cached authentication rejected')
+            
+            auth = await self._login(session)
+            
+            if not await self._download(session, dest, auth):
+                raise BackupHandlerError(f'Failed to download backup: authentication rejected', 1002)
+    
+    async def _login(self, session: aiohttp.ClientSession) -> tuple[str, str, float]:
+        login_url = f'https://{self._host}/api/auth/login'
+        login_data = {'username': self._user, 'password': self._password}
+        
+        self._logger.info(f'Authenticating to Unifi controller at "{self._host}"')
+        
+        async with session.post(login_url, json=login_data, ssl=False) as resp:
+            if resp.status != 200:
+                raise BackupHandlerError(f'Failed to authenticate to Unifi controller: {resp.status}', 1001)
+            
+            self._logger.info('Authentication successful')
+            
+            # get csrf token
+            csrf_token = resp.headers.get('X-Csrf-Token')
+            
+            if not csrf_token:
+                raise BackupHandlerError('CSRF token not found in response headers', 1003)
+            
+            # get cookies from set-cookie headers
+            cookie = resp.headers.get('Set-Cookie', '').split(';')[0].strip()
+        
+        auth = (csrf_token, cookie, self._gen_token_expiry(cookie))
+        
+        self._auth_cache[self._gen_auth_key()] = auth
+        
+        return auth
+    
+    async def _download(self, session: aiohttp.ClientSession, dest: PathModel, auth: tuple[str, str, float]) -> bool:
+        """
+        Download the backup file to dest. Returns False when the controller rejects the authentication.
+        """
+        backup_url = f'https://{self._host}/api/backup/download'
+        backup_headers = {
+            'X-Csrf-Token': auth[0],
+            'Cookie': auth[1],
+        }
+        
+        self._logger.info(f'Getting backup file from Unifi controller at "{self._host}"')
+        
+        # get backup file
+        async with session.get(backup_url, headers=backup_headers, ssl=False) as resp:
+            if resp.status in (401, 403):
+                self._auth_cache.pop(self._gen_auth_key(), None)
+                return False
+            
+            if resp.status != 200:
+                raise BackupHandlerError(f'Failed to download backup: {resp.status}', 1002)
+            
+            # streamed in chunks, written outside of the event loop
+            async def write_backup(f) -> None:
+                async for data in resp.content.iter_chunked(self._chunk_size):
+                    await asyncio.to_thread(f.write, data)
+            
+            backup_size = await self._stream_to(dest.join('unifi_backup.unifi'), write_backup)
+        
+        self._logger.info('Backup download successful')
+        
+        self._stats.add(stream_bytes=backup_size, total_bytes=backup_size, total_files=1)
+        self._logger.info(f'Backup saved to "{dest.path}"')
+        
+        return True
+    
+    def _gen_auth_key(self) -> str:
+        return f'{self._user or ""}@{self._host.host}:{self._host.port or 443}'
+    
+    def _gen_token_expiry(self, cookie: str) -> float:
+        # the session cookie holds a JWT, its "exp" claim tells how long the login lasts
+        try:
+            payload = cookie.partition('=')[2].split('.')[1]
+            expiry = float(json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp'])
+        except (IndexError, KeyError, TypeError, ValueError):
+            expiry = time.time() + self._token_lifetime
+        
+        # leave a margin, so the token doesn't expire during the download
+        return expiry - 60
\ No newline at end of file
@@ -1,5 +1,13 @@
-from usbackup.libraries.cmd_exec import CmdExec
+import os
+import json
+import shutil
+import asyncio
+from typing import Literal
+from pydantic import Field, model_validator
+from usbackup.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from usbackup.libraries.cow_fs import CowFs
 from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.libraries.zfs_recv import ZfsRecv
 from usbackup.models.path import PathModel
 from usbackup.handlers.backup import HandlerBaseModel, BackupHandler, BackupHandlerError
 
@@ -7,15 +15,49 @@ class ZfsDatasetsHandlerModel(HandlerBaseModel):
     handler: str = 'zfs_datasets'
     limit: list[str] = []
     exclude: list[str] = []
+    chunked: bool = False
+    mode: Literal['full', 'incremental'] = 'full'
+    full_every: int = Field(7, ge=1)
+    retain: Literal['snapshot', 'bookmark'] = 'snapshot'
+    parallel: int = Field(1, ge=1)
+    send_compressed: bool = False
+    send_raw: bool = False
+    buffer_size: str | None = Field(None, pattern=r'^\d+[kMG]?$')
+    destination: Literal['file', 'receive'] = 'file'
+    resume_attempts: int = Field(3, ge=0)
+
+    @model_validator(mode='after')
+    @classmethod
+    def validate_after(cls, values):
+        if values.destination == 'receive' and values.chunked:
+            raise ValueError('Received datasets can not be chunked')
+
+        return values
 
 class ZfsDatasetsHandler(BackupHandler):
     handler: str = 'zfs_datasets'
+    # streams of the version and the source snapshots / bookmarks they are based on
+    _streams_file: str = 'streams.json'
 
     def __init__(self, model: ZfsDatasetsHandlerModel, *args, **kwargs) -> None:
         super().__init__(model, *args, **kwargs)
 
         self._limit: list[str] = model.limit
         self._exclude: list[str] = model.exclude
+        self._chunked: bool = model.chunked
+        self._mode: str = model.mode
+        self._full_every: int = model.full_every
+        self._retain: str = model.retain
+        self._parallel: int = model.parallel
+        self._send_compressed: bool = model.send_compressed
+        self._send_raw: bool = model.send_raw
+        self._buffer_size: str | None = model.buffer_size
+        self._destination: str = model.destination
+        self._resume_attempts: int = model.resume_attempts
+        # received datasets are always updated incrementally (every received snapshot is complete on its own)
+        self._incremental: bool = model.mode == 'incremental' or model.destination == 'receive'
+        # (dataset, new snapshot, previous base) of the sent datasets, waiting for the version to complete
+        self._pending_bases: list[tuple[str, str, str | None]] = []
 
     async def backup(self, dest: PathModel, dest_link: PathModel | None = None) -> None:
         self._logger.info(f'Fetching datasets from "{self._host}"')
@@ -41,21 +83,352 @@ class ZfsDatasetsHandler(BackupHandler):
 
         self._logger.info(f'Backing up datasets "{datasets}"')
 
-        for dataset in datasets:
-            zfs_snapshot_name = f'{dataset}@backup-{self._id}'
-            # zfs dataset without /
-            file_name = dataset.replace('/', '_') + '.zfs'
+        prev_streams = await self._load_streams(dest_link) if self._incremental and dest_link else {}
+        bases = await self._list_bases(datasets) if prev_streams else set()
+
+        if self._buffer_size and not shutil.which('mbuffer'):
+            self._logger.warning('mbuffer not found. Streaming without buffer')
+
+        # one call per pool, so the snapshots of the datasets of a pool are taken atomically
+        await self._create_snapshots(datasets)
+
+        semaphore = asyncio.Semaphore(self._parallel)
+
+        if self._parallel > 1 and len(datasets) > 1:
+            self._logger.info(f'Streaming {len(datasets)} datasets with up to {self._parallel} parallel streams')
+
+        async def backup_dataset(dataset: str) -> dict:
+            async with semaphore:
+                return await self._backup_dataset(dataset, dest, prev_streams.get(dataset), bases)
+
+        results = await asyncio.gather(*[backup_dataset(dataset) for dataset in datasets], return_exceptions=True)
+        streams = {}
+        errors = []
+
+        for dataset, result in zip(datasets, results):
+            if isinstance(result, BaseException):
+                self._logger.error(f'Failed to stream dataset "{dataset}": {result}')
+                errors.append(f'"{dataset}": {result}')
+
+                # snapshots of failed datasets are not kept as bases
+                if self._cleanup.has_item(self._gen_cleanup_id(dataset)):
+                    await self._cleanup.consume(self._gen_cleanup_id(dataset))
+            else:
+                streams[dataset] = result
+
+        if errors:
+            raise BackupHandlerError(f'Failed to stream {len(errors)} of {len(datasets)} datasets. ' + '; '.join(errors), 1041)
 
-            self._logger.info(f'Creating snapshot "{zfs_snapshot_name}" on "{self._host}"')
+        if not self._incremental:
+            return
+
+        # the chain is recorded with the version, so the next run knows its base
+        await FsAdapter.write(dest.join(self._streams_file), json.dumps(streams, indent=4))
+        await self._record_checksum(dest.join(self._streams_file))
+
+        # received snapshots do not need the previous version
+        if self._destination == 'file' and any(stream['base'] for stream in streams.values()):
+            self._add_dependency(dest_link)
+
+    async def _backup_dataset(self, dataset: str, dest: PathModel, prev_stream: dict | None, bases: set[str]) -> dict:
+        zfs_snapshot_name = f'{dataset}@usbackup-{self._id}'
+        cleanup_id = self._gen_cleanup_id(dataset)
+        base = None
+        level = 0
 
-            await CmdExec.exec(['zfs', 'snapshot', zfs_snapshot_name], host=self._host)
-            self._cleanup.push(f'destroy_snapshot_{self._id}', CmdExec.exec, ['zfs', 'destroy', zfs_snapshot_name], host=self._host)
+        if prev_stream and (self._destination == 'receive' or prev_stream['level'] + 1 < self._full_every):
+            if prev_stream['retained'] in bases:
+                base = prev_stream['retained']
+                level = prev_stream['level'] + 1
+            else:
+                self._logger.warning(f'Base "{prev_stream["retained"]}" of dataset "{dataset}" is missing on "{self._host}". Sending a full stream')
 
-            with FsAdapter.open(dest.join(file_name), 'wb') as f:
-                self._logger.info(f'Streaming snapshot "{zfs_snapshot_name}" from "{self._host}" to "{dest.path}"')
+        if self._destination == 'receive':
+            stream = await self._receive_dataset(dataset, dest, zfs_snapshot_name, prev_stream, base)
 
-                await CmdExec.exec(['zfs', 'send', zfs_snapshot_name], host=self._host, stdout=f)
+            if not stream['base']:
+                level = 0
+        else:
+            stream = await self._send_dataset(dataset, dest, zfs_snapshot_name, base, level)
 
+        if not self._incremental:
             self._logger.info(f'Deleting snapshot "{zfs_snapshot_name}" on "{self._host}"')
 
-            await self._cleanup.consume(f'destroy_snapshot_{self._id}')
+            await self._cleanup.consume(cleanup_id)
+
+            return {**stream, 'snapshot': zfs_snapshot_name, 'base': None, 'level': 0, 'retained': None}
+
+        retained = zfs_snapshot_name if self._retain == 'snapshot' else zfs_snapshot_name.replace('@', '#', 1)
+        prev_base = prev_stream['retained'] if prev_stream and prev_stream['retained'] in bases else None
+
+        # the new snapshot / bookmark only replaces the previous base once the version is complete (see commit)
+        self._pending_bases.append((dataset, zfs_snapshot_name, prev_base))
+
+        return {'base': base, **stream, 'snapshot': zfs_snapshot_name, 'level': level, 'retained': retained}
+
+    async def commit(self) -> None:
+        for dataset, zfs_snapshot_name, prev_base in self._pending_bases:
+            try:
+                await self._retain_base(zfs_snapshot_name, self._gen_cleanup_id(dataset))
+            except CmdExecProcessError as e:
+                # the next run finds the base missing and sends a full stream
+                self._logger.warning(f'Failed to retain base of dataset "{dataset}": {e}')
+                await self._cleanup.consume(self._gen_cleanup_id(dataset))
+                continue
+
+            if prev_base:
+                await self._destroy_base(prev_base)
+
+        self._pending_bases = []
+
+    async def rollback(self) -> None:
+        # the previous bases stay the bases of the next run, the new snapshots are not needed
+        for dataset, zfs_snapshot_name, _ in self._pending_bases:
+            self._logger.info(f'Deleting snapshot "{zfs_snapshot_name}" on "{self._host}"')
+
+            await self._cleanup.consume(self._gen_cleanup_id(dataset))
+
+        self._pending_bases = []
+
+    async def _send_dataset(self, dataset: str, dest: PathModel, zfs_snapshot_name: str, base: str | None, level: int) -> dict:
+        # zfs dataset without /
+        if self._incremental:
+            file_name = f'{dataset.replace("/", "_")}.{level}.zfs'
+        else:
+            file_name = dataset.replace('/', '_') + '.zfs'
+
+        send_cmd = self._gen_send_cmd(zfs_snapshot_name, base)
+
+        if base:
+            self._logger.info(f'Streaming changes between "{base}" and "{zfs_snapshot_name}" from "{self._host}" to "{dest.path}"')
+        else:
+            self._logger.info(f'Streaming snapshot "{zfs_snapshot_name}" from "{self._host}" to "{dest.path}"')
+
+        stream_size = await self._stream_to(dest.join(file_name), lambda f: CmdExec.exec_pipeline(self._gen_pipeline(send_cmd), stdout=f))
+
+        self._stats.add(stream_bytes=stream_size, total_bytes=stream_size, total_files=1)
+
+        return {'file': file_name}
+
+    async def _receive_dataset(self, dataset: str, dest: PathModel, zfs_snapshot_name: str, prev_stream: dict | None, base: str | None) -> dict:
+        target = prev_stream.get('target') if prev_stream else None
+
+        if not target:
+            target = await self._gen_receive_target(dataset, dest)
+
+        # a crashed run may have left a partially received stream behind, which blocks new receives
+        await self._abort_receive(target)
+
+        if base and not await self._local_zfs_exists(prev_stream['received']):
+            self._logger.warning(f'Base "{prev_stream["received"]}" of dataset "{dataset}" is missing on the storage. Receiving a full stream')
+            base = None
+
+        if not base and await self._local_zfs_exists(target):
+            # a full stream can only be received into a new dataset
+            target = f'{target}-{self._id[:8]}'
+
+        received = f'{target}@{zfs_snapshot_name.partition("@")[2]}'
+        cmds = self._gen_pipeline(self._gen_send_cmd(zfs_snapshot_name, base), target)
+
+        self._logger.info(f'Receiving "{zfs_snapshot_name}" from "{self._host}" as "{received}"' + (f' (changes since "{base}")' if base else ''))
+
+        await self._exec_receive(cmds, target)
+
+        try:
+            written, referenced = (await CmdExec.exec(['zfs', 'get', '-Hp', '-o', 'value', 'written,referenced', received])).split()
+            mountpoint = await CmdExec.exec(['zfs', 'get', '-H', '-o', 'value', 'mountpoint', target])
+        except CmdExecProcessError as e:
+            raise BackupHandlerError(f'Failed to inspect received snapshot "{received}": {e}', 1043)
+
+        self._stats.add(stream_bytes=int(written), total_bytes=int(referenced), total_files=1)
+
+        # the version holds the snapshot (destroyed with the version) and a link to browse it
+        name = dataset.replace('/', '_')
+
+        await ZfsRecv.write_marker(dest.join(name), received)
+
+        if mountpoint.startswith('/'):
+            # an inplace / cloned run finds the link of the previous version there
+            await FsAdapter.symlink(os.path.join(mountpoint, '.zfs', 'snapshot', received.partition('@')[2]), dest.join(name))
+
+        return {'base': base, 'target': target, 'received': received}
+
+    async def _exec_receive(self, cmds: list, target: str) -> None:
+        attempt = 0
+
+        while True:
+            try:
+                await CmdExec.exec_pipeline(cmds)
+                return
+            except CmdExecProcessError as e:
+                error = e
+
+            token = await self._get_resume_token(target)
+
+            if not token or attempt >= self._resume_attempts:
+                await self._abort_receive(target)
+                raise BackupHandlerError(f'Failed to receive into "{target}": {error}', 1044)
+
+            attempt += 1
+
+            self._logger.warning(f'Receive into "{target}" interrupted ({error}). Resuming (attempt {attempt} of {self._resume_attempts})')
+
+            # the sender continues from where the receiver stopped
+            cmds = self._gen_pipeline(['zfs', 'send', '-t', token], target)
+
+    def _gen_pipeline(self, send_cmd: list, target: str | None = None) -> list:
+        cmds = [(send_cmd, self._host)]
+
+        if self._buffer_size and shutil.which('mbuffer'):
+            # the buffer keeps the sender streaming while the destination disk is busy (and the other way around)
+            cmds.append((['mbuffer', '-q', '-m', self._buffer_size], None))
+
+        if target:
+            # any change to the received dataset (even atime updates) makes the next incremental receive fail,
+            # it stays mounted read-only so the version links can still browse its snapshots
+            cmds.append((['zfs', 'receive', '-s', '-o', 'readonly=on', target], None))
+
+        return cmds
+
+    async def _gen_receive_target(self, dataset: str, dest: PathModel) -> str:
+        """
+        Generate the storage dataset receiving dataset. Received datasets are mounted in "<destination>/.zfs_datasets".
+        """
+        # dest is <destination>/<version>/<handler>
+        destination = os.path.dirname(os.path.dirname(os.path.normpath(dest.path)))
+        containing = await CowFs.zfs_containing_dataset(destination)
+
+        if not containing:
+            raise BackupHandlerError(f'Storage "{destination}" is not on ZFS. Receive destination not possible', 1045)
+
+        storage_dataset, mountpoint = containing
+        relative = os.path.relpath(destination, mountpoint)
+        parent = f'{storage_dataset}/{"" if relative == "." else relative.replace("/", "_") + "_"}zfs_datasets'
+
+        if not await self._local_zfs_exists(parent):
+            self._logger.info(f'Creating dataset "{parent}" for received datasets')
+
+            try:
+                await CmdExec.exec(['zfs', 'create', '-p', '-o', f'mountpoint={os.path.join(destination, ".zfs_datasets")}', parent])
+            except CmdExecProcessError as e:
+                raise BackupHandlerError(f'Failed to create dataset "{parent}": {e}', 1046)
+
+        return f'{parent}/{dataset.replace("/", "_")}'
+
+    async def _get_resume_token(self, target: str) -> str | None:
+        try:
+            token = await CmdExec.exec(['zfs', 'get', '-H', '-o', 'value', 'receive_resume_token', target])
+        except CmdExecProcessError:
+            return None
+
+        return token if token and token != '-' else None
+
+    async def _abort_receive(self, target: str) -> None:
+        if not await self._get_resume_token(target):
+            return
+
+        self._logger.info(f'Discarding partially received stream of "{target}"')
+
+        try:
+            await CmdExec.exec(['zfs', 'receive', '-A', target])
+        except CmdExecProcessError as e:
+            self._logger.warning(f'Failed to discard partially received stream of "{target}": {e}')
+
+    async def _local_zfs_exists(self, name: str) -> bool:
+        try:
+            await CmdExec.exec(['zfs', 'list', '-H', '-o', 'name', '-t', 'all', name])
+        except CmdExecProcessError:
+            return False
+
+        return True
+
+    async def _create_snapshots(self, datasets: list[str]) -> None:
+        pools = {}
+
+        # zfs only takes a batch of snapshots atomically within one pool (and rejects batches spanning pools)
+        for dataset in datasets:
+            pools.setdefault(dataset.split('/')[0], []).append(dataset)
+
+        for pool_datasets in pools.values():
+            snapshots = [f'{dataset}@usbackup-{self._id}' for dataset in pool_datasets]
+
+            self._logger.info(f'Creating snapshots "{snapshots}" on "{self._host}"')
+
+            try:
+                await CmdExec.exec(['zfs', 'snapshot', *snapshots], host=self._host)
+            except CmdExecProcessError as e:
+                raise BackupHandlerError(f'Failed to create snapshots: {e}', 1042)
+
+            for dataset, snapshot in zip(pool_datasets, snapshots):
+                self._cleanup.push(self._gen_cleanup_id(dataset), CmdExec.exec, ['zfs', 'destroy', snapshot], host=self._host)
+
+    def _gen_send_cmd(self, zfs_snapshot_name: str, base: str | None = None) -> list:
+        cmd = ['zfs', 'send']
+
+        # blocks are sent as stored on disk instead of being inflated on the wire
+        if self._send_raw:
+            cmd.append('-w')
+        elif self._send_compressed:
+            cmd.append('-c')
+
+        if base:
+            cmd += ['-i', base]
+
+        return [*cmd, zfs_snapshot_name]
+
+    def _gen_cleanup_id(self, dataset: str) -> str:
+        return f'destroy_snapshot_{self._id}_{dataset}'
+
+    async def _retain_base(self, zfs_snapshot_name: str, cleanup_id: str) -> str:
+        """
+        Keep the sent snapshot (or a bookmark of it) on the source as the base of the next incremental stream.
+        """
+        if self._retain == 'snapshot':
+            self._cleanup.pop(cleanup_id)
+
+            return zfs_snapshot_name
+
+        bookmark = zfs_snapshot_name.replace('@', '#', 1)
+
+        self._logger.info(f'Creating bookmark "{bookmark}" on "{self._host}"')
+
+        await CmdExec.exec(['zfs', 'bookmark', zfs_snapshot_name, bookmark], host=self._host)
+
+        self._logger.info(f'Deleting snapshot "{zfs_snapshot_name}" on "{self._host}"')
+
+        await self._cleanup.consume(cleanup_id)
+
+        return bookmark
+
+    async def _destroy_base(self, base: str) -> None:
+        self._logger.info(f'Deleting previous base "{base}" on "{self._host}"')
+
+        try:
+            await CmdExec.exec(['zfs', 'destroy', base], host=self._host)
+        except CmdExecProcessError as e:
+            self._logger.warning(f'Failed to delete previous base "{base}": {e}')
+
+    async def _list_bases(self, datasets: list[str]) -> set[str]:
+        """
+        List the snapshots and bookmarks of datasets present on the source.
+        """
+        try:
+            exec_ret = await CmdExec.exec(['zfs', 'list', '-H', '-o', 'name', '-t', 'snapshot,bookmark', '-d', '1', *datasets], host=self._host)
+        except CmdExecProcessError as e:
+            raise BackupHandlerError(f'Failed to list snapshots: {e}', 1040)
+
+        return {line.strip() for line in exec_ret.splitlines() if line.strip()}
+
+    async def _load_streams(self, path: PathModel) -> dict:
+        streams_path = path.join(self._streams_file)
+
+        if not await FsAdapter.exists(streams_path, 'f'):
+            return {}
+
+        try:
+            streams = json.loads(await FsAdapter.read(streams_path))
+
+            return {dataset: stream for dataset, stream in streams.items() if stream.get('retained')}
+        except (ValueError, AttributeError) as e:
+            self._logger.warning(f'Ignoring unusable stream list "{streams_path}": {e}')
+            return {}
\ No newline at end of file
@@ -47,12 +47,17 @@ class EmailHandler(NotificationHandler):
                     <td>{result.name}</td>
                     <td>{status_str}</td>
                     <td>{result.elapsed}</td>
+                    <td>{result.transferred_bytes / 1000 ** 2:.2f} MB</td>
+                    <td>{f'{result.throughput:.2f} MB/s' if result.throughput is not None else 'n/a'}</td>
                     <td>{result.dest}</td>
                 </tr>
             '''
             
+            stats_list = ''.join(f'<li>{handler}: {stats}</li>' for handler, stats in result.stats.items())
+            
             details += f'''
                 <h4>{result.name}</h4>
+                <ul>{stats_list}</ul>
                 <pre>{result.message}</pre>
             '''
         
@@ -67,6 +72,8 @@ class EmailHandler(NotificationHandler):
                             <th>Host</th>
                             <th>Status</th>
                             <th>Elapsed</th>
+                            <th>Transferred</th>
+                            <th>Throughput</th>
                             <th>Destination</th>
                         </tr>
                     </thead>
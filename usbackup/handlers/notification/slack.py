@@ -23,6 +23,7 @@ class SlackHandler(NotificationHandler):
     async def notify(self, status: str, results: list[ResultModel], *, elapsed: datetime.timedelta) -> None:
         details = [res.message for res in results if res.message]
         details = "\n".join(details)
+        summary = "\n".join(self._gen_summary_line(res) for res in results)
         file = details.encode("utf-8")
         filename = 'report.log'
 
@@ -58,10 +59,19 @@ class SlackHandler(NotificationHandler):
                 }
             ],
             "channels": self._slack_channel,
-            "initial_comment": f'*{self._type.capitalize()} job "{self._name}" status: {status} (Elapsed: {elapsed})*',
+            "initial_comment": f'*{self._type.capitalize()} job "{self._name}" status: {status} (Elapsed: {elapsed})*\n{summary}',
         }
 
         send_resp = await arequest_post(self._slack_complete_url, headers=headers, json=payload)
 
         if send_resp.status_code != 200 or not send_resp.json().get("ok"):
             raise NotificationHandlerError(f"Slack exception: code: {send_resp.status_code}, response: {send_resp.text}", 1003)
+    
+    def _gen_summary_line(self, result: ResultModel) -> str:
+        status = 'OK' if not result.error else 'Failed'
+        line = f'{result.name}: {status}, {result.transferred_bytes / 1000 ** 2:.2f} MB in {result.elapsed}'
+        
+        if result.throughput is not None:
+            line += f' ({result.throughput:.2f} MB/s)'
+        
+        return line
\ No newline at end of file
@@ -0,0 +1,290 @@
+import os
+import re
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from typing import Iterator
+from usbackup.libraries.chunk_store import ChunkStore, ChunkStoreError
+from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.models.path import PathModel
+
+__all__ = ['ChecksumManifest', 'ChecksumManifestWriter', 'ChecksumManifestIndex', 'ChecksumManifestError']
+
+class ChecksumManifestError(Exception):
+    """
+    Custom exception for checksum manifest errors.
+    """
+    pass
+
+class ChecksumManifest:
+    """
+    Checksums of the files of a version, recorded while the version is written, in "sha256sum" format
+    (paths relative to the version directory). Streams stored as chunk indexes are listed under their stream name.
+    Manifests are read and written line by line, so large trees are never held in memory.
+    """
+    algorithm: str = 'sha256'
+    # manifests are kept in this directory next to the version index, named after their version
+    dir_name: str = 'manifests'
+    suffix: str = '.sha256'
+    
+    _read_size: int = 4 * 1024 * 1024
+    _line_pattern: re.Pattern = re.compile(r'^(\\?)([0-9a-f]{64}) [ *](.*)$')
+    
+    def __init__(self, path: PathModel):
+        if not path.host.local:
+            raise ChecksumManifestError("Local manifests only")
+        
+        self._path: PathModel = path
+    
+    @property
+    def path(self) -> PathModel:
+        return self._path
+    
+    @classmethod
+    def for_version(cls, version_path: PathModel) -> 'ChecksumManifest':
+        """
+        Manifest of the version stored at version_path.
+        """
+        parent, version = os.path.split(version_path.path.rstrip('/'))
+        
+        return cls(PathModel(path=os.path.join(parent, cls.dir_name, f'{version}{cls.suffix}'), host=version_path.host))
+    
+    @classmethod
+    async def hash_file(cls, path: PathModel) -> str:
+        """
+        Hash a local file.
+        """
+        return await asyncio.to_thread(cls.hash_local_file, path.path)
+    
+    @classmethod
+    def hash_local_file(cls, path: str) -> str:
+        """
+        Blocking variant of hash_file, for callers already running in a thread.
+        """
+        sha = hashlib.new(cls.algorithm)
+        
+        with open(path, 'rb') as f:
+            while data := f.read(cls._read_size):
+                sha.update(data)
+        
+        return sha.hexdigest()
+    
+    @classmethod
+    def format_entry(cls, name: str, checksum: str) -> str:
+        # same escaping as sha256sum, so "sha256sum -c" can check the version too
+        if '\\' in name or '\n' in name:
+            return f'\\{checksum}  {cls._escape(name)}\n'
+        
+        return f'{checksum}  {name}\n'
+    
+    async def exists(self) -> bool:
+        return await FsAdapter.exists(self._path, 'f')
+    
+    def entries(self) -> Iterator[tuple[str, str]]:
+        """
+        Iterate over the (relative path, checksum) entries. Blocking, reads the manifest as it goes.
+        """
+        with open(self._path.path, 'r', encoding='utf-8', errors='surrogateescape', newline='\n') as f:
+            for line in f:
+                match = self._line_pattern.match(line.rstrip('\n'))
+                
+                if not match:
+                    raise ChecksumManifestError(f'Invalid line "{line.strip()}" in manifest "{self._path}"')
+                
+                name = match.group(3)
+                
+                if match.group(1):
+                    name = re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), name)
+                
+                yield name, match.group(2)
+    
+    async def copy(self, dest: 'ChecksumManifest') -> None:
+        """
+        Copy the manifest to dest (eg. along with a replicated version).
+        """
+        await asyncio.to_thread(self._copy, dest.path.path)
+    
+    async def remove(self) -> None:
+        if await FsAdapter.exists(self._path, 'f'):
+            await FsAdapter.rm(self._path)
+    
+    async def verify(self, root: PathModel) -> list[str]:
+        """
+        Check the files under root against the manifest. Returns the problems found.
+        """
+        if not await self.exists():
+            raise ChecksumManifestError(f'Manifest "{self._path}" is missing')
+        
+        errors = []
+        
+        for name, checksum in self.entries():
+            path = root.join(name)
+            index = PathModel(path=f'{path.path}{ChunkStore.index_suffix}', host=path.host)
+            
+            try:
+                try:
+                    actual = await self.hash_file(path)
+                except FileNotFoundError:
+                    if not await FsAdapter.exists(index, 'f'):
+                        raise
+                    
+                    actual = await self._hash_stream(index)
+            except FileNotFoundError:
+                errors.append(f'Missing file "{name}"')
+                continue
+            except (OSError, ChunkStoreError) as e:
+                errors.append(f'Failed to read "{name}": {e}')
+                continue
+            
+            if actual != checksum:
+                errors.append(f'Checksum mismatch for "{name}"')
+        
+        return errors
+    
+    def _copy(self, dest_path: str) -> None:
+        tmp_path = f'{dest_path}.tmp'
+        
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        shutil.copyfile(self._path.path, tmp_path)
+        os.replace(tmp_path, dest_path)
+    
+    async def _hash_stream(self, index: PathModel) -> str:
+        """
+        Hash the stream described by a chunk index, by reassembling it.
+        """
+        sha = hashlib.new(self.algorithm)
+        
+        class HashWriter:
+            def write(self, data: bytes) -> int:
+                sha.update(data)
+                return len(data)
+        
+        await ChunkStore(ChunkStore.find_pool(index)).restore(index, HashWriter())
+        
+        return sha.hexdigest()
+    
+    @classmethod
+    def _escape(cls, name: str) -> str:
+        return name.replace('\\', '\\\\').replace('\n', '\\n')
+
+class ChecksumManifestWriter:
+    """
+    Writes the entries of a manifest as they are produced to a temporary file next to it, which replaces
+    the manifest on commit. Entries are added by absolute path under root. add is thread safe.
+    """
+    def __init__(self, manifest: ChecksumManifest, root: PathModel):
+        self._manifest: ChecksumManifest = manifest
+        self._root: str = root.path
+        self._tmp_path: str = f'{manifest.path.path}.{uuid.uuid4().hex[:8]}.tmp'
+        self._lock: threading.Lock = threading.Lock()
+        self._count: int = 0
+        
+        os.makedirs(os.path.dirname(self._tmp_path), exist_ok=True)
+        
+        self._file = open(self._tmp_path, 'w', encoding='utf-8', errors='surrogateescape', newline='\n')
+    
+    @property
+    def manifest(self) -> ChecksumManifest:
+        return self._manifest
+    
+    @property
+    def count(self) -> int:
+        return self._count
+    
+    def add(self, path: str, checksum: str) -> None:
+        self.add_name(os.path.relpath(path, self._root), checksum)
+    
+    def add_name(self, name: str, checksum: str) -> None:
+        """
+        Add an entry by path relative to root.
+        """
+        line = ChecksumManifest.format_entry(name, checksum)
+        
+        with self._lock:
+            self._file.write(line)
+            self._count += 1
+    
+    async def commit(self) -> None:
+        self._file.close()
+        
+        await asyncio.to_thread(os.replace, self._tmp_path, self._manifest.path.path)
+    
+    async def discard(self) -> None:
+        self._file.close()
+        
+        if os.path.exists(self._tmp_path):
+            await asyncio.to_thread(os.remove, self._tmp_path)
+
+class ChecksumManifestIndex:
+    """
+    Manifest loaded into a temporary on-disk database for lookups by path, so carrying the checksums of a large
+    version forward does not need the manifest in memory. Lookups are thread safe.
+    """
+    _batch_size: int = 10000
+    
+    def __init__(self, manifest: ChecksumManifest):
+        self._manifest: ChecksumManifest = manifest
+        self._db_path: str = f'{manifest.path.path}.{uuid.uuid4().hex[:8]}.index'
+        self._lock: threading.Lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+    
+    @classmethod
+    async def load(cls, manifest: ChecksumManifest) -> 'ChecksumManifestIndex':
+        index = cls(manifest)
+        
+        try:
+            await asyncio.to_thread(index._load)
+        except sqlite3.Error as e:
+            await index.close()
+            raise ChecksumManifestError(f'Failed to index manifest "{manifest.path}": {e}')
+        except BaseException:
+            await index.close()
+            raise
+        
+        return index
+    
+    def get(self, name: str) -> str | None:
+        with self._lock:
+            row = self._db.execute('SELECT checksum FROM checksums WHERE name = ?', (name,)).fetchone()
+        
+        return row[0] if row else None
+    
+    def entries(self, prefix: str) -> Iterator[tuple[str, str]]:
+        """
+        Iterate over the entries with names starting with prefix (not empty), in batches.
+        """
+        # every name starting with prefix sorts between prefix and prefix with its last character incremented
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        last = ''
+        
+        while True:
+            with self._lock:
+                rows = self._db.execute('SELECT name, checksum FROM checksums WHERE name >= ? AND name < ? AND name > ? ORDER BY name LIMIT ?', (prefix, end, last, self._batch_size)).fetchall()
+            
+            if not rows:
+                return
+            
+            yield from rows
+            
+            last = rows[-1][0]
+    
+    async def close(self) -> None:
+        if self._db:
+            self._db.close()
+            self._db = None
+        
+        for path in (self._db_path, f'{self._db_path}-journal'):
+            if os.path.exists(path):
+                await asyncio.to_thread(os.remove, path)
+    
+    def _load(self) -> None:
+        self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+        # a throwaway copy of the manifest, durability is not needed
+        self._db.execute('PRAGMA journal_mode = OFF')
+        self._db.execute('PRAGMA synchronous = OFF')
+        self._db.execute('CREATE TABLE checksums (name TEXT PRIMARY KEY, checksum TEXT NOT NULL) WITHOUT ROWID')
+        self._db.executemany('INSERT OR REPLACE INTO checksums VALUES (?, ?)', self._manifest.entries())
+        self._db.commit()
\ No newline at end of file
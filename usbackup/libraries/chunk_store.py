@@ -0,0 +1,382 @@
+import os
+import glob
+import shutil
+import uuid
+import time
+import asyncio
+import hashlib
+import logging
+from typing import IO
+from usbackup.models.path import PathModel
+
+__all__ = ['ChunkStore', 'ChunkStoreError']
+
+class ChunkStoreError(Exception):
+    """
+    Custom exception for chunk store errors.
+    """
+    pass
+
+class ChunkStore:
+    """
+    Content-addressed pool of stream chunks shared by all versions of a storage.
+    Streams are split at content-defined boundaries, so data shifted by inserts still produces the same chunks.
+    Each stored stream is described by an index file listing its chunks.
+    """
+    format: int = 1
+    # name of the pool directory inside a storage and suffix of the stream indexes
+    pool_name: str = '.chunks'
+    index_suffix: str = '.chunks'
+    
+    _min_size: int = 512 * 1024
+    _max_size: int = 8 * 1024 * 1024
+    _read_size: int = 4 * 1024 * 1024
+    # a boundary follows 10 consecutive bytes mapped to 0 (a quarter of the byte values), ~2 MiB apart on random data
+    _table: bytes = bytes(0 if hashlib.sha256(bytes([b])).digest()[0] & 3 == 0 else 1 for b in range(256))
+    _marker: bytes = bytes(10)
+    _candidates_file: str = 'gc-candidates'
+    
+    def __init__(self, pool: PathModel):
+        if not pool.host.local:
+            raise ChunkStoreError("Local chunk pools only")
+        
+        self._pool: PathModel = pool
+    
+    @property
+    def pool(self) -> PathModel:
+        return self._pool
+    
+    @classmethod
+    def find_pool(cls, index: PathModel) -> PathModel:
+        """
+        Find the pool an index belongs to (the ".chunks" directory of the storage holding it).
+        """
+        path = os.path.dirname(os.path.abspath(index.path))
+        
+        while True:
+            if os.path.isdir(os.path.join(path, cls.pool_name)):
+                return PathModel(path=os.path.join(path, cls.pool_name), host=index.host)
+            
+            if path == '/':
+                raise ChunkStoreError(f'No chunk pool found for "{index}"')
+            
+            path = os.path.dirname(path)
+    
+    async def store(self, stream: IO[bytes], index: PathModel) -> tuple[int, int]:
+        """
+        Chunk stream into the pool, write its index and return the stream size and the number of new bytes stored.
+        The stream is closed when done.
+        """
+        return await asyncio.to_thread(self._store, stream, index.path)
+    
+    async def restore(self, index: PathModel, out: IO[bytes]) -> int:
+        """
+        Reassemble the stream described by index into out and return its size.
+        """
+        return await asyncio.to_thread(self._restore, index.path, out)
+    
+    async def verify(self, index: PathModel) -> list[str]:
+        """
+        Check that all chunks of index exist and match their digests. Returns the problems found.
+        """
+        return await asyncio.to_thread(self._verify, index.path)
+    
+    async def replicate(self, path: PathModel, dest: 'ChunkStore') -> int:
+        """
+        Copy the chunks referenced by the indexes of the version at path that are missing from the dest pool.
+        Returns the number of bytes copied.
+        """
+        return await asyncio.to_thread(self._replicate, path.path, dest)
+    
+    async def add_gc_candidates(self, path: PathModel) -> int:
+        """
+        Record the chunks referenced by the indexes of the version (or trash entry) at path as garbage collection
+        candidates. Must be called before the version is removed.
+        """
+        return await asyncio.to_thread(self._add_gc_candidates, path.path)
+    
+    async def collect_garbage(self) -> tuple[int, int]:
+        """
+        Remove the candidate chunks no longer referenced by any index. Returns the number of chunks and bytes removed.
+        """
+        return await asyncio.to_thread(self._collect_garbage)
+    
+    def _store(self, stream: IO[bytes], index_path: str) -> tuple[int, int]:
+        size = 0
+        new_bytes = 0
+        stream_hash = hashlib.sha256()
+        buffer = bytearray()
+        eof = False
+        
+        os.makedirs(self._pool.path, exist_ok=True)
+        
+        # the index is written while the stream is chunked, so chunks are referenced as soon as possible
+        with stream, open(index_path, 'w') as index:
+            index.write(f'usbackup-chunks {self.format}\n')
+            
+            while True:
+                while not eof and len(buffer) < self._max_size:
+                    data = stream.read(self._read_size)
+                    
+                    if not data:
+                        eof = True
+                        break
+                    
+                    buffer += data
+                
+                if not buffer:
+                    break
+                
+                cut = self._find_boundary(buffer)
+                chunk = bytes(buffer[:cut])
+                del buffer[:cut]
+                
+                digest = hashlib.sha256(chunk).hexdigest()
+                stream_hash.update(chunk)
+                
+                if self._write_chunk(digest, chunk):
+                    new_bytes += len(chunk)
+                
+                size += len(chunk)
+                
+                index.write(f'{digest} {len(chunk)}\n')
+                index.flush()
+            
+            # the trailer marks a complete stream
+            index.write(f'end {size} {stream_hash.hexdigest()}\n')
+            index.flush()
+            os.fsync(index.fileno())
+        
+        return size, new_bytes
+    
+    def _find_boundary(self, buffer: bytearray) -> int:
+        if len(buffer) <= self._min_size:
+            return len(buffer)
+        
+        window = buffer[self._min_size:self._max_size].translate(self._table)
+        pos = window.find(self._marker)
+        
+        if pos < 0:
+            return min(len(buffer), self._max_size)
+        
+        return self._min_size + pos + len(self._marker)
+    
+    def _write_chunk(self, digest: str, chunk: bytes) -> bool:
+        chunk_path = self._gen_chunk_path(digest)
+        
+        if os.path.exists(chunk_path):
+            # mark the chunk as used, so a concurrent garbage collection keeps it
+            os.utime(chunk_path, None)
+            return False
+        
+        os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+        
+        tmp_path = f'{chunk_path}.{uuid.uuid4().hex[:8]}.tmp'
+        
+        with open(tmp_path, 'wb') as f:
+            f.write(chunk)
+        
+        os.replace(tmp_path, chunk_path)
+        
+        return True
+    
+    def _restore(self, index_path: str, out: IO[bytes]) -> int:
+        size = 0
+        stream_hash = hashlib.sha256()
+        chunks, expected_size, expected_digest = self._read_index(index_path)
+        
+        for digest, chunk_size in chunks:
+            try:
+                with open(self._gen_chunk_path(digest), 'rb') as f:
+                    chunk = f.read()
+            except FileNotFoundError:
+                raise ChunkStoreError(f'Missing chunk {digest}')
+            
+            if len(chunk) != chunk_size or hashlib.sha256(chunk).hexdigest() != digest:
+                raise ChunkStoreError(f'Corrupt chunk {digest}')
+            
+            stream_hash.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+        
+        if size != expected_size or stream_hash.hexdigest() != expected_digest:
+            raise ChunkStoreError(f'Reassembled stream does not match index "{index_path}"')
+        
+        return size
+    
+    def _verify(self, index_path: str) -> list[str]:
+        errors = []
+        
+        try:
+            chunks, expected_size, _ = self._read_index(index_path)
+        except ChunkStoreError as e:
+            return [str(e)]
+        
+        for digest, chunk_size in chunks:
+            sha = hashlib.sha256()
+            length = 0
+            
+            try:
+                with open(self._gen_chunk_path(digest), 'rb') as f:
+                    while data := f.read(self._read_size):
+                        sha.update(data)
+                        length += len(data)
+            except FileNotFoundError:
+                errors.append(f'Missing chunk {digest}')
+                continue
+            
+            if length != chunk_size or sha.hexdigest() != digest:
+                errors.append(f'Corrupt chunk {digest}')
+        
+        if sum(chunk_size for _, chunk_size in chunks) != expected_size:
+            errors.append(f'Index size mismatch')
+        
+        return errors
+    
+    def _read_index(self, index_path: str) -> tuple[list[tuple[str, int]], int, str]:
+        chunks = []
+        trailer = None
+        
+        try:
+            with open(index_path, 'r') as f:
+                header = f.readline().split()
+                
+                if header != ['usbackup-chunks', str(self.format)]:
+                    raise ChunkStoreError(f'"{index_path}" is not a chunk index')
+                
+                for line in f:
+                    fields = line.split()
+                    
+                    if fields[0] == 'end':
+                        trailer = (int(fields[1]), fields[2])
+                        break
+                    
+                    chunks.append((fields[0], int(fields[1])))
+        except OSError as e:
+            raise ChunkStoreError(f'Failed to read "{index_path}": {e}')
+        except (IndexError, ValueError):
+            raise ChunkStoreError(f'Malformed chunk index "{index_path}"')
+        
+        if trailer is None:
+            raise ChunkStoreError(f'Incomplete chunk index "{index_path}"')
+        
+        return chunks, *trailer
+    
+    def _read_digests(self, index_path: str) -> set[str]:
+        # tolerant reader used for garbage collection (incomplete indexes of running backups included)
+        digests = set()
+        
+        try:
+            with open(index_path, 'r') as f:
+                for line in f:
+                    fields = line.split()
+                    
+                    if fields and len(fields[0]) == 64:
+                        digests.add(fields[0])
+        except OSError as e:
+            logging.warning(f'Failed to read chunk index "{index_path}": {e}')
+        
+        return digests
+    
+    def _list_version_digests(self, path: str) -> set[str]:
+        digests = set()
+        
+        # stream handlers write their indexes at the top of the handler directory
+        for index_path in glob.glob(os.path.join(glob.escape(path), '*', f'*{self.index_suffix}')):
+            digests |= self._read_digests(index_path)
+        
+        return digests
+    
+    def _replicate(self, path: str, dest: 'ChunkStore') -> int:
+        copied = 0
+        
+        for digest in self._list_version_digests(path):
+            dest_path = dest._gen_chunk_path(digest)
+            
+            if os.path.exists(dest_path):
+                os.utime(dest_path, None)
+                continue
+            
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            
+            tmp_path = f'{dest_path}.{uuid.uuid4().hex[:8]}.tmp'
+            
+            try:
+                shutil.copyfile(self._gen_chunk_path(digest), tmp_path)
+            except FileNotFoundError:
+                raise ChunkStoreError(f'Missing chunk {digest}')
+            
+            os.replace(tmp_path, dest_path)
+            copied += os.path.getsize(dest_path)
+        
+        return copied
+    
+    def _add_gc_candidates(self, path: str) -> int:
+        digests = self._list_version_digests(path)
+        
+        if not digests:
+            return 0
+        
+        os.makedirs(self._pool.path, exist_ok=True)
+        
+        with open(os.path.join(self._pool.path, self._candidates_file), 'a') as f:
+            f.write(''.join(f'{digest}\n' for digest in digests))
+        
+        return len(digests)
+    
+    def _collect_garbage(self) -> tuple[int, int]:
+        candidates_path = os.path.join(self._pool.path, self._candidates_file)
+        
+        if os.path.exists(candidates_path):
+            # candidates recorded from now on go to a new file
+            os.rename(candidates_path, f'{candidates_path}.{uuid.uuid4().hex[:8]}')
+        
+        batches = glob.glob(f'{glob.escape(candidates_path)}.*')
+        
+        if not batches:
+            return 0, 0
+        
+        start_time = time.time()
+        candidates = set()
+        
+        for batch in batches:
+            candidates |= self._read_digests(batch)
+        
+        live = set()
+        storage = os.path.dirname(self._pool.path.rstrip('/'))
+        
+        # <storage>/<source>/<version>/<handler>/<stream>.chunks (dot directories like .trash are skipped)
+        for index_path in glob.glob(os.path.join(glob.escape(storage), '*', '*', '*', f'*{self.index_suffix}')):
+            live |= self._read_digests(index_path)
+        
+        removed = 0
+        removed_bytes = 0
+        
+        for digest in candidates - live:
+            chunk_path = self._gen_chunk_path(digest)
+            
+            try:
+                stat = os.stat(chunk_path)
+                
+                # stored again after the collection started
+                if stat.st_mtime >= start_time:
+                    continue
+                
+                os.remove(chunk_path)
+            except FileNotFoundError:
+                continue
+            
+            removed += 1
+            removed_bytes += stat.st_size
+        
+        for batch in batches:
+            try:
+                os.remove(batch)
+            except FileNotFoundError:
+                # processed by a concurrent collection
+                pass
+        
+        return removed, removed_bytes
+    
+    def _gen_chunk_path(self, digest: str) -> str:
+        return os.path.join(self._pool.path, digest[:2], digest)
\ No newline at end of file
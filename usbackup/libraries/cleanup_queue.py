@@ -14,9 +14,12 @@ class CleanupQueue:
 
     def has_items(self) -> bool:
         return bool(self._queue)
+    
+    def has_item(self, id: str) -> bool:
+        return self._get_index(id) is not None
 
     def push(self, id: str, handler: Callable, *args, **kwargs) -> None:
-        if self._get_index(id):
+        if self._get_index(id) is not None:
             raise ValueError(f"Job with id {id} already exists")
         
         self._queue.append((id, handler, args, kwargs))
@@ -26,7 +29,7 @@ class CleanupQueue:
     def pop(self, id: str) -> None:
         index = self._get_index(id)
         
-        if not index:
+        if index is None:
             raise ValueError(f"Job with id {id} not found")
         
         self._queue.pop(index)
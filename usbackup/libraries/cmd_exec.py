@@ -1,8 +1,12 @@
+import os
+import signal
 import logging
 import asyncio
 import shlex
+import collections
+from usbackup.libraries.ssh_mux import SshMux
 from usbackup.models.host import HostModel
-from typing import IO, Any
+from typing import IO, Any, AsyncIterator
 
 __all__ = ['CmdExec', 'CmdExecError', 'CmdExecProcessError']
 
@@ -27,7 +31,7 @@ class CmdExec:
         stderr: int | IO[Any] | None = asyncio.subprocess.PIPE
     ) -> str:
         if host and not host.local:
-            cmd = cls.gen_ssh_cmd(cmd, host)
+            cmd = cls.gen_ssh_cmd(cmd, host, ssh_opts=await SshMux.ensure(host))
         
         logging.debug(f'Executing command: {[*cmd]}')
         
@@ -53,13 +57,141 @@ class CmdExec:
         return result
     
     @classmethod
-    async def is_host_reachable(cls, host: HostModel) -> bool:
+    async def exec_lines(
+        cls, cmd: list,
+        *,
+        host: HostModel | None = None,
+        env=None,
+        stdin: int | IO[Any] | None = asyncio.subprocess.DEVNULL,
+        stderr_tail: int = 50,
+        line_limit: int = 1024 * 1024
+    ) -> AsyncIterator[str]:
+        """
+        Execute a command and yield its decoded stdout lines as they are produced.
+        Only the last stderr_tail lines of stderr are kept (for the error raised on failure).
+        """
+        if host and not host.local:
+            cmd = cls.gen_ssh_cmd(cmd, host, ssh_opts=await SshMux.ensure(host))
+        
+        logging.debug(f'Executing command: {[*cmd]}')
+        
+        if not env:
+            env = None
+        
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            limit=line_limit,
+        )
+        
+        err_lines = collections.deque(maxlen=stderr_tail)
+        err_task = asyncio.create_task(cls._collect_lines(process.stderr, err_lines))
+        
         try:
-            await cls.exec(['ping', '-c', '1', host.host])
-        except CmdExecProcessError:
-            return False
+            while True:
+                try:
+                    line = await process.stdout.readline()
+                except ValueError:
+                    # line longer than line_limit, the reader already discarded it
+                    continue
+                
+                if not line:
+                    break
+                
+                yield line.decode('utf-8', errors='replace').rstrip('\n')
+            
+            await err_task
+            await process.wait()
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            
+            if not err_task.done():
+                err_task.cancel()
         
-        return True
+        if process.returncode != 0:
+            raise CmdExecProcessError('\n'.join(err_lines).strip(), process.returncode)
+    
+    @classmethod
+    async def exec_pipeline(
+        cls, cmds: list[tuple[list, HostModel | None]],
+        *,
+        env=None,
+        stdout: int | IO[Any] | None = asyncio.subprocess.PIPE
+    ) -> str:
+        """
+        Execute a list of (command, host) pairs, connecting the stdout of each one to the stdin of the next.
+        The output of the last command goes to stdout. Fails if any of the commands fails.
+        """
+        if not cmds:
+            raise CmdExecError("No commands specified")
+        
+        if not env:
+            env = None
+        
+        processes = []
+        stdin = asyncio.subprocess.DEVNULL
+        
+        try:
+            for i, (cmd, host) in enumerate(cmds):
+                if host and not host.local:
+                    cmd = cls.gen_ssh_cmd(cmd, host, ssh_opts=await SshMux.ensure(host))
+                
+                logging.debug(f'Executing pipeline command: {[*cmd]}')
+                
+                if i < len(cmds) - 1:
+                    read_fd, write_fd = os.pipe()
+                else:
+                    read_fd, write_fd = None, stdout
+                
+                try:
+                    process = await asyncio.create_subprocess_exec(*cmd, stdin=stdin, stdout=write_fd, stderr=asyncio.subprocess.PIPE, env=env)
+                finally:
+                    # the child processes hold their own copies of the pipe ends
+                    if isinstance(stdin, int) and stdin >= 0:
+                        os.close(stdin)
+                    
+                    if read_fd is not None:
+                        os.close(write_fd)
+                
+                processes.append(process)
+                stdin = read_fd
+            
+            results = await asyncio.gather(*[process.communicate() for process in processes])
+        except BaseException:
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+            
+            raise
+        
+        failed = [(process, err) for process, (_, err) in zip(processes, results) if process.returncode != 0]
+        
+        if failed:
+            # a command killed by SIGPIPE only reports that a later command failed
+            process, err = next((item for item in failed if item[0].returncode not in (-signal.SIGPIPE, 128 + signal.SIGPIPE)), failed[0])
+            raise CmdExecProcessError(err.decode('utf-8', errors='replace').strip(), process.returncode)
+        
+        out = results[-1][0]
+        
+        return out.decode('utf-8').strip() if out else ''
+    
+    @classmethod
+    async def _collect_lines(cls, stream: asyncio.StreamReader, lines: collections.deque) -> None:
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                continue
+            
+            if not line:
+                break
+            
+            lines.append(line.decode('utf-8', errors='replace').rstrip('\n'))
     
     @classmethod
     def parse_cmd_options(cls, options: list, *, arg_separator: str = ''):
@@ -78,25 +210,18 @@ class CmdExec:
         return cmd_options
     
     @classmethod
-    def gen_ssh_cmd(cls, cmd: list, host: HostModel) -> list:
+    def gen_ssh_cmd(cls, cmd: list, host: HostModel, *, ssh_opts: list | None = None) -> list:
         if not cmd or not host:
             raise CmdExecError("Command or host not specified")
 
-        cmd_prefix = []
-        ssh_opts = []
+        cmd_prefix, host_ssh_opts = SshMux.gen_ssh_opts(host)
 
         if host.password:
-            cmd_prefix += ['sshpass', '-p', str(host.password)]
             logging.warning('Using password in plain is insecure. Consider using ssh keys instead')
-        else:
-            ssh_opts += ['-o', 'PasswordAuthentication=No', '-o', 'BatchMode=yes']
-
-        if host.port:
-            ssh_opts += ['-p', str(host.port)]
  
         remote = host.host
         
         if host.user is not None:
             remote = f"{host.user}@{remote}"
             
-        return [*cmd_prefix, 'ssh', *ssh_opts, remote, 'exec', shlex.join(cmd)]
\ No newline at end of file
+        return [*cmd_prefix, 'ssh', *host_ssh_opts, *(ssh_opts or []), remote, 'exec', shlex.join(cmd)]
\ No newline at end of file
@@ -0,0 +1,85 @@
+from typing import Literal
+
+__all__ = ['Compression', 'CompressionError', 'CompressionCodec']
+
+CompressionCodec = Literal['gzip', 'pigz', 'zstd', 'xz', 'none']
+
+class CompressionError(Exception):
+    """
+    Custom exception for compression errors.
+    """
+    pass
+
+class Compression:
+    # file extension appended for each codec
+    _extensions: dict[str, str] = {
+        'gzip': '.gz',
+        'pigz': '.gz',
+        'zstd': '.zst',
+        'xz': '.xz',
+        'none': '',
+    }
+    
+    # supported compression levels (inclusive)
+    _levels: dict[str, tuple[int, int]] = {
+        'gzip': (1, 9),
+        'pigz': (1, 9),
+        'zstd': (1, 19),
+        'xz': (0, 9),
+    }
+    
+    @classmethod
+    def gen_cmd(cls, codec: str, *, level: int | None = None, threads: int = 1, rsyncable: bool = False) -> list | None:
+        """
+        Return the command compressing stdin to stdout with codec, or None for "none".
+        A threads value of 0 uses all cores (ignored by gzip).
+        Rsyncable output keeps unchanged input regions identical in the compressed stream (ignored by xz).
+        """
+        cls.validate(codec, level)
+        
+        if codec == 'none':
+            return None
+        
+        cmd = [codec, '-c']
+        
+        if level is not None:
+            cmd.append(f'-{level}')
+        
+        if codec == 'pigz' and threads:
+            cmd += ['-p', str(threads)]
+        elif codec in ('zstd', 'xz'):
+            cmd.append(f'-T{threads}')
+        
+        if codec == 'zstd':
+            cmd.append('-q')
+        
+        if rsyncable and codec in ('gzip', 'pigz', 'zstd'):
+            cmd.append('--rsyncable')
+        
+        return cmd
+    
+    @classmethod
+    def gen_extension(cls, codec: str) -> str:
+        """
+        Return the file extension of codec ("" for "none").
+        """
+        if codec not in cls._extensions:
+            raise CompressionError(f'Unknown compression codec "{codec}"')
+        
+        return cls._extensions[codec]
+    
+    @classmethod
+    def validate(cls, codec: str, level: int | None = None) -> None:
+        if codec not in cls._extensions:
+            raise CompressionError(f'Unknown compression codec "{codec}"')
+        
+        if level is None:
+            return
+        
+        if codec not in cls._levels:
+            raise CompressionError(f'Codec "{codec}" does not support compression levels')
+        
+        min_level, max_level = cls._levels[codec]
+        
+        if not min_level <= level <= max_level:
+            raise CompressionError(f'Invalid compression level {level} for "{codec}". Allowed levels: {min_level}-{max_level}')
\ No newline at end of file
@@ -0,0 +1,233 @@
+import os
+import uuid
+import logging
+from typing import Literal
+from usbackup.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.models.path import PathModel
+
+__all__ = ['CowFs', 'CowFsError', 'CowFsType']
+
+CowFsType = Literal['btrfs', 'zfs', 'reflink']
+
+class CowFsError(Exception):
+    """
+    Custom exception for copy-on-write filesystem errors.
+    """
+    pass
+
+class CowFs:
+    """
+    Version directories backed by copy-on-write volumes (btrfs subvolumes, ZFS datasets or reflink copies),
+    so a new version can be a cheap clone of the previous one and removing a version is a volume destroy.
+    """
+    # storage path -> detected filesystem (None when copy-on-write is not available)
+    _detected: dict[str, CowFsType | None] = {}
+    
+    @classmethod
+    async def detect(cls, path: PathModel) -> CowFsType | None:
+        """
+        Detect the copy-on-write capabilities of the filesystem holding path. Results are cached per path.
+        """
+        if not path.host.local:
+            return None
+        
+        if path.path in cls._detected:
+            return cls._detected[path.path]
+        
+        fs = None
+        
+        try:
+            fs_type = await CmdExec.exec(['stat', '-f', '-c', '%T', path.path])
+        except CmdExecProcessError as e:
+            logging.debug(f'Failed to detect filesystem of "{path}": {e}')
+            fs_type = ''
+        
+        if fs_type == 'btrfs':
+            fs = 'btrfs'
+        elif fs_type == 'zfs' and await cls.zfs_containing_dataset(path.path):
+            fs = 'zfs'
+        elif fs_type and await cls._supports_reflink(path):
+            fs = 'reflink'
+        
+        logging.debug(f'Copy-on-write support of "{path}" ({fs_type}): {fs or "none"}')
+        
+        cls._detected[path.path] = fs
+        
+        return fs
+    
+    @classmethod
+    async def create(cls, path: PathModel, fs: CowFsType) -> None:
+        """
+        Create an empty volume at path.
+        """
+        if fs == 'btrfs':
+            await cls._exec(['btrfs', 'subvolume', 'create', path.path])
+        elif fs == 'zfs':
+            await cls._exec(['zfs', 'create', '-o', f'mountpoint={path.path}', await cls._zfs_gen_dataset(path.path)])
+        else:
+            await FsAdapter.mkdir(path)
+    
+    @classmethod
+    async def clone(cls, src: PathModel, dst: PathModel, fs: CowFsType) -> None:
+        """
+        Create the volume dst as a copy-on-write clone of the volume src.
+        """
+        if fs == 'btrfs':
+            await cls._exec(['btrfs', 'subvolume', 'snapshot', src.path, dst.path])
+        elif fs == 'zfs':
+            src_dataset = await cls._zfs_dataset(src.path)
+            
+            if not src_dataset:
+                raise CowFsError(f'"{src}" is not a ZFS dataset')
+            
+            snapshot = f'{src_dataset}@usbackup-{uuid.uuid4().hex[:8]}'
+            
+            await cls._exec(['zfs', 'snapshot', snapshot])
+            
+            try:
+                await cls._exec(['zfs', 'clone', '-o', f'mountpoint={dst.path}', snapshot, await cls._zfs_gen_dataset(dst.path)])
+            except CowFsError:
+                await cls._exec(['zfs', 'destroy', snapshot])
+                raise
+        else:
+            await FsAdapter.mkdir(dst)
+            
+            try:
+                await cls._exec(['cp', '-a', '--reflink=always', f'{src.path}/.', dst.path])
+            except CowFsError:
+                await FsAdapter.rm(dst)
+                raise
+    
+    @classmethod
+    async def is_volume(cls, path: PathModel, fs: CowFsType) -> bool:
+        """
+        Check if path is a btrfs subvolume / ZFS dataset (reflink copies are plain directories).
+        """
+        if fs == 'btrfs':
+            # the root directory of a subvolume always has inode number 256
+            try:
+                return await CmdExec.exec(['stat', '-c', '%i', path.path]) == '256'
+            except CmdExecProcessError:
+                return False
+        elif fs == 'zfs':
+            return await cls._zfs_dataset(path.path) is not None
+        else:
+            return False
+    
+    @classmethod
+    async def remove(cls, path: PathModel, fs: CowFsType) -> None:
+        """
+        Destroy the volume at path.
+        """
+        if fs == 'btrfs':
+            await cls._exec(['btrfs', 'subvolume', 'delete', path.path])
+        elif fs == 'zfs':
+            await cls._zfs_remove(path.path)
+        else:
+            await FsAdapter.rm(path)
+    
+    @classmethod
+    async def zfs_containing_dataset(cls, path: str) -> tuple[str, str] | None:
+        """
+        Return the ZFS dataset holding path and its mountpoint (None when path is not on ZFS).
+        """
+        try:
+            mounts = await cls._zfs_list_mounts()
+        except CowFsError:
+            return None
+        
+        path = os.path.normpath(path)
+        
+        # longest mountpoint containing path
+        while True:
+            if path in mounts:
+                return mounts[path], path
+            
+            if path == '/':
+                return None
+            
+            path = os.path.dirname(path)
+    
+    @classmethod
+    async def _zfs_remove(cls, path: str) -> None:
+        dataset = await cls._zfs_dataset(path)
+        
+        if not dataset:
+            raise CowFsError(f'"{path}" is not a ZFS dataset')
+        
+        snapshots = await cls._exec(['zfs', 'list', '-H', '-o', 'name,clones', '-t', 'snapshot', '-d', '1', dataset])
+        
+        # newer versions cloned from this one take over its snapshots, so it can be destroyed
+        for line in snapshots.splitlines():
+            _, _, clones = line.partition('\t')
+            clones = [clone for clone in clones.split(',') if clone and clone != '-']
+            
+            if clones:
+                await cls._exec(['zfs', 'promote', clones[0]])
+        
+        origin = await cls._exec(['zfs', 'get', '-H', '-o', 'value', 'origin', dataset])
+        
+        await cls._exec(['zfs', 'destroy', '-r', dataset])
+        
+        if origin and origin != '-':
+            try:
+                await cls._exec(['zfs', 'destroy', origin])
+            except CowFsError as e:
+                # still used by another clone
+                logging.debug(f'Keeping snapshot "{origin}": {e}')
+    
+    @classmethod
+    async def _zfs_list_mounts(cls) -> dict[str, str]:
+        exec_ret = await cls._exec(['zfs', 'list', '-H', '-o', 'name,mountpoint', '-t', 'filesystem'])
+        mounts = {}
+        
+        for line in exec_ret.splitlines():
+            name, _, mountpoint = line.partition('\t')
+            
+            if mountpoint.startswith('/'):
+                mounts[mountpoint] = name
+        
+        return mounts
+    
+    @classmethod
+    async def _zfs_dataset(cls, path: str) -> str | None:
+        try:
+            return (await cls._zfs_list_mounts()).get(os.path.normpath(path))
+        except CowFsError:
+            return None
+    
+    @classmethod
+    async def _zfs_gen_dataset(cls, path: str) -> str:
+        containing = await cls.zfs_containing_dataset(os.path.dirname(os.path.normpath(path)))
+        
+        if not containing:
+            raise CowFsError(f'"{path}" is not inside a ZFS dataset')
+        
+        dataset, mountpoint = containing
+        
+        # a flat name with an explicit mountpoint, so no intermediate datasets are mounted over existing directories
+        return f'{dataset}/{os.path.relpath(path, mountpoint).replace("/", "_")}'
+    
+    @classmethod
+    async def _supports_reflink(cls, path: PathModel) -> bool:
+        probe = path.join(f'.usbackup-reflink-{uuid.uuid4().hex[:8]}')
+        probe_copy = PathModel(path=f'{probe.path}.copy', host=path.host)
+        
+        try:
+            await FsAdapter.touch(probe)
+            await CmdExec.exec(['cp', '--reflink=always', probe.path, probe_copy.path])
+        except Exception:
+            return False
+        finally:
+            await FsAdapter.rm(probe)
+            await FsAdapter.rm(probe_copy)
+        
+        return True
+    
+    @classmethod
+    async def _exec(cls, cmd: list) -> str:
+        try:
+            return await CmdExec.exec(cmd)
+        except (CmdExecProcessError, OSError) as e:
+            raise CowFsError(f'{cmd[0]} {cmd[1]} failed: {e}') from e
\ No newline at end of file
@@ -1,5 +1,10 @@
+import os
+import uuid
+import shutil
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Literal, IO, Any, Generator
+from typing import Literal, IO, Any, Callable, Generator
 from usbackup.libraries.cmd_exec import CmdExec, CmdExecProcessError
 from usbackup.models.path import PathModel
 
@@ -12,6 +17,28 @@ class FsAdapterError(Exception):
     pass
 
 class FsAdapter:
+    # "native" runs os/shutil calls in a bounded thread pool, "subprocess" spawns coreutils (fallback)
+    _backend: Literal['native', 'subprocess'] = 'native'
+    _max_workers: int = 8
+    _executor: ThreadPoolExecutor | None = None
+    
+    @classmethod
+    def set_backend(cls, backend: Literal['native', 'subprocess'], *, max_workers: int | None = None) -> None:
+        """
+        Select the backend used for filesystem operations.
+        """
+        if backend not in ('native', 'subprocess'):
+            raise FsAdapterError(f'Invalid backend "{backend}"')
+        
+        cls._backend = backend
+        
+        if max_workers is not None and max_workers != cls._max_workers:
+            if max_workers < 1:
+                raise FsAdapterError('max_workers must be greater than 0')
+            
+            cls._max_workers = max_workers
+            cls._shutdown_executor()
+    
     @classmethod
     async def mkdir(cls, path: PathModel) -> None:
         """
@@ -20,7 +47,11 @@ class FsAdapter:
         if not path.host.local:
             raise FsAdapterError("Local files only")
         
-        await CmdExec.exec(["mkdir", "-p", path.path])
+        if cls._backend == 'subprocess':
+            await cls._exec(["mkdir", "-p", path.path])
+            return
+        
+        await cls._run(os.makedirs, path.path, exist_ok=True)
     
     @classmethod
     async def ls(cls, path: PathModel) -> list[str]:
@@ -30,12 +61,15 @@ class FsAdapter:
         if not path.host.local:
             raise FsAdapterError("Local files only")
         
-        try:
-            list = await CmdExec.exec(["ls", path.path])
-        except CmdExecProcessError as e:
-            list = ''
+        if cls._backend == 'subprocess':
+            try:
+                list = await CmdExec.exec(["ls", path.path])
+            except CmdExecProcessError as e:
+                list = ''
+            
+            return list.splitlines()
         
-        return list.splitlines()
+        return await cls._run(cls._native_ls, path.path)
     
     @classmethod
     async def rm(cls, path: PathModel) -> None:
@@ -45,8 +79,40 @@ class FsAdapter:
         if not path.host.local:
             raise FsAdapterError("Local files only")
         
-        await CmdExec.exec(["rm", "-rf", path.path])
+        if cls._backend == 'subprocess':
+            await cls._exec(["rm", "-rf", path.path])
+            return
         
+        await cls._run(cls._native_rm, path.path)
+    
+    @classmethod
+    async def rename(cls, src: PathModel, dst: PathModel) -> None:
+        """
+        Atomically rename a file or directory (both paths must be on the same filesystem).
+        """
+        if not src.host.local or not dst.host.local:
+            raise FsAdapterError("Local files only")
+        
+        if cls._backend == 'subprocess':
+            await cls._exec(["mv", "-T", src.path, dst.path])
+            return
+        
+        await cls._run(os.rename, src.path, dst.path)
+    
+    @classmethod
+    async def symlink(cls, target: str, path: PathModel) -> None:
+        """
+        Create a symbolic link to target at the specified path, replacing an existing link.
+        """
+        if not path.host.local:
+            raise FsAdapterError("Local files only")
+        
+        if cls._backend == 'subprocess':
+            await cls._exec(["ln", "-sfn", target, path.path])
+            return
+        
+        await cls._run(cls._native_symlink, target, path.path)
+    
     @classmethod
     async def touch(cls, path: PathModel) -> None:
         """
@@ -55,7 +121,11 @@ class FsAdapter:
         if not path.host.local:
             raise FsAdapterError("Local files only")
 
-        await CmdExec.exec(["touch", path.path])
+        if cls._backend == 'subprocess':
+            await cls._exec(["touch", path.path])
+            return
+        
+        await cls._run(cls._native_touch, path.path)
 
     @classmethod
     async def exists(cls, path: PathModel, type: str | None = None) -> bool:
@@ -65,17 +135,25 @@ class FsAdapter:
         if not path.host.local:
             raise FsAdapterError("Local files only")
         
-        try:
-            if type == 'd':
-                await CmdExec.exec(["test", "-d", path.path])
-            elif type == 'f':
-                await CmdExec.exec(["test", "-f", path.path])
-            else:
-                await CmdExec.exec(["test", "-e", path.path])
-        except CmdExecProcessError as e:
-            return False
+        if cls._backend == 'subprocess':
+            try:
+                if type == 'd':
+                    await CmdExec.exec(["test", "-d", path.path])
+                elif type == 'f':
+                    await CmdExec.exec(["test", "-f", path.path])
+                else:
+                    await CmdExec.exec(["test", "-e", path.path])
+            except CmdExecProcessError as e:
+                return False
+            
+            return True
         
-        return True
+        if type == 'd':
+            return await cls._run(os.path.isdir, path.path)
+        elif type == 'f':
+            return await cls._run(os.path.isfile, path.path)
+        else:
+            return await cls._run(os.path.exists, path.path)
     
     @classmethod
     @contextmanager
@@ -92,4 +170,163 @@ class FsAdapter:
         try:
             yield f
         finally:
-            f.close()
\ No newline at end of file
+            f.close()
+    
+    @classmethod
+    async def read(cls, path: PathModel) -> str:
+        """
+        Read the contents of a text file at the specified path.
+        """
+        if not path.host.local:
+            raise FsAdapterError("Local files only")
+        
+        return await cls._run(cls._native_read, path.path)
+    
+    @classmethod
+    async def write(cls, path: PathModel, data: str) -> None:
+        """
+        Atomically replace the contents of a text file at the specified path.
+        """
+        if not path.host.local:
+            raise FsAdapterError("Local files only")
+        
+        await cls._run(cls._native_write, path.path, data)
+    
+    @classmethod
+    async def size(cls, path: PathModel) -> int:
+        """
+        Return the size in bytes of the file at the specified path.
+        """
+        if not path.host.local:
+            raise FsAdapterError("Local files only")
+        
+        if cls._backend == 'subprocess':
+            return int(await cls._exec(["stat", "-c", "%s", path.path]))
+        
+        return await cls._run(os.path.getsize, path.path)
+    
+    @classmethod
+    async def usage(cls, path: PathModel) -> tuple[int, int]:
+        """
+        Return the apparent size in bytes and the number of files below the specified path.
+        """
+        if not path.host.local:
+            raise FsAdapterError("Local files only")
+        
+        return await cls._run(cls._native_usage, path.path)
+    
+    @classmethod
+    async def _exec(cls, cmd: list) -> str:
+        # both backends raise FsAdapterError
+        try:
+            return await CmdExec.exec(cmd)
+        except CmdExecProcessError as e:
+            raise FsAdapterError(str(e)) from e
+    
+    @classmethod
+    async def _run(cls, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        
+        try:
+            return await loop.run_in_executor(cls._get_executor(), lambda: func(*args, **kwargs))
+        except OSError as e:
+            raise FsAdapterError(f'{e.strerror or e}: {e.filename}' if e.filename else str(e)) from e
+    
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(max_workers=cls._max_workers, thread_name_prefix='fs_adapter')
+        
+        return cls._executor
+    
+    @classmethod
+    def _shutdown_executor(cls) -> None:
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False)
+            cls._executor = None
+    
+    @staticmethod
+    def _native_ls(path: str) -> list[str]:
+        # mimic `ls`: sorted names without dotfiles, a file lists itself and errors yield an empty list
+        try:
+            if not os.path.isdir(path):
+                return [path] if os.path.lexists(path) else []
+            
+            return sorted(name for name in os.listdir(path) if not name.startswith('.'))
+        except OSError:
+            return []
+    
+    @staticmethod
+    def _native_rm(path: str) -> None:
+        # mimic `rm -rf`: never follow symlinks and ignore missing paths
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+    
+    @staticmethod
+    def _native_symlink(target: str, path: str) -> None:
+        # mimic `ln -sfn`, but swap the link atomically. The temporary name is unique, concurrent writers of path
+        # never touch each other's link
+        tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        
+        os.symlink(target, tmp_path)
+        
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+    
+    @staticmethod
+    def _native_touch(path: str) -> None:
+        with open(path, 'a'):
+            os.utime(path, None)
+    
+    @staticmethod
+    def _native_read(path: str) -> str:
+        with open(path, 'r') as f:
+            return f.read()
+    
+    @staticmethod
+    def _native_write(path: str, data: str) -> None:
+        # unique temporary name, so concurrent writers of path don't replace each other's file
+        tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        
+        try:
+            with open(tmp_path, 'x') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            
+            raise
+    
+    @staticmethod
+    def _native_usage(path: str) -> tuple[int, int]:
+        size = 0
+        files = 0
+        stack = [path]
+        
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            size += entry.stat(follow_symlinks=False).st_size
+                            files += 1
+            except OSError:
+                continue
+        
+        return size, files
\ No newline at end of file
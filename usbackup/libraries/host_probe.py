@@ -0,0 +1,66 @@
+import time
+import asyncio
+import logging
+from usbackup.models.host import HostModel
+
+__all__ = ['HostProbe']
+
+class HostProbe:
+    """
+    Checks host reachability with a TCP connect to the service port (works where ICMP is filtered).
+    Results are cached for a short time so hosts shared by several sources are probed once.
+    """
+    _ttl: int = 30
+    # (host, port) -> (monotonic time the probe started, probe). Probes are cached while running,
+    # so concurrent callers wait for the same one
+    _cache: dict[tuple[str, int], tuple[float, asyncio.Task]] = {}
+    
+    @classmethod
+    async def is_reachable(cls, host: HostModel, port: int | None = None, *, timeout: float = 5) -> bool:
+        """
+        Check if a TCP connection to host can be established. Port defaults to the host ssh port.
+        """
+        if host.local:
+            return True
+        
+        key = (host.host, port or host.port or 22)
+        cached = cls._cache.get(key)
+        
+        if not cls._is_usable(cached):
+            cached = (time.monotonic(), asyncio.create_task(cls._connect(*key, timeout=timeout)))
+            cls._cache[key] = cached
+        
+        # a cancelled caller doesn't cancel the probe the others wait for
+        return await asyncio.shield(cached[1])
+    
+    @classmethod
+    def _is_usable(cls, cached: tuple[float, asyncio.Task] | None) -> bool:
+        if cached is None or time.monotonic() - cached[0] >= cls._ttl:
+            return False
+        
+        probe = cached[1]
+        
+        # probes cancelled or left running by a loop that is gone (eg. a previous asyncio.run)
+        if probe.done():
+            return not probe.cancelled()
+        
+        return probe.get_loop() is asyncio.get_running_loop()
+    
+    @classmethod
+    async def _connect(cls, host: str, port: int, *, timeout: float) -> bool:
+        logging.debug(f'Probing "{host}:{port}"')
+        
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.debug(f'Probe of "{host}:{port}" failed: {e or type(e).__name__}')
+            return False
+        
+        writer.close()
+        
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        
+        return True
\ No newline at end of file
@@ -0,0 +1,43 @@
+import aiohttp
+
+__all__ = ['HttpPool']
+
+class HttpPool:
+    """
+    Shares one aiohttp connector (a connection pool with keep-alive) between the HTTP handlers of the running jobs.
+    Jobs hold a reference to the pool while they run and the connector is closed when the last one finishes.
+    """
+    _limit: int = 32
+    _limit_per_host: int = 4
+    _keepalive_timeout: float = 30
+    
+    _connector: aiohttp.TCPConnector | None = None
+    _refs: int = 0
+    
+    @classmethod
+    def acquire(cls) -> None:
+        cls._refs += 1
+    
+    @classmethod
+    async def release(cls) -> None:
+        cls._refs = max(cls._refs - 1, 0)
+        
+        if cls._refs or cls._connector is None:
+            return
+        
+        await cls._connector.close()
+        cls._connector = None
+    
+    @classmethod
+    def session(cls, **kwargs) -> aiohttp.ClientSession:
+        """
+        Create a client session using the shared connector (or a private one when no job holds the pool).
+        Closing the session leaves the shared connector open.
+        """
+        if not cls._refs:
+            return aiohttp.ClientSession(**kwargs)
+        
+        if cls._connector is None or cls._connector.closed:
+            cls._connector = aiohttp.TCPConnector(limit=cls._limit, limit_per_host=cls._limit_per_host, keepalive_timeout=cls._keepalive_timeout)
+        
+        return aiohttp.ClientSession(connector=cls._connector, connector_owner=False, **kwargs)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import os
+import shlex
+from typing import IO, Any
+from usbackup.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.models.host import HostModel
+from usbackup.models.path import PathModel
+from usbackup.models.transfer_stats import TransferStatsModel
+
+__all__ = ['RemoteFetch', 'RemoteFetchError']
+
+class RemoteFetchError(Exception):
+    """
+    Custom exception for remote fetch errors.
+    """
+    pass
+
+class RemoteFetch:
+    """
+    Fetches remote files with a single remote command (one ssh round trip), optionally generating them first
+    and removing them afterwards in the same invocation.
+    """
+    @classmethod
+    async def fetch(cls, paths: list[str], host: HostModel, dest: PathModel, *, generate: list | None = None, cleanup: list | None = None) -> TransferStatsModel:
+        """
+        Fetch the files at paths as one tar stream into the local directory dest, where they are stored under
+        their base names. generate runs on host before the files are read, cleanup runs after (even on failure).
+        """
+        if not dest.host.local:
+            raise RemoteFetchError("Local destinations only")
+        
+        names = [os.path.basename(path) for path in paths]
+        
+        if len(set(names)) != len(names):
+            raise RemoteFetchError(f'Files with the same name can not be fetched together: {paths}')
+        
+        # paths are relative to / so busybox tar accepts them too
+        script = cls._gen_script(['tar', '-cf', '-', '-C', '/', *[path.lstrip('/') for path in paths]], generate=generate, cleanup=cleanup)
+        
+        try:
+            await CmdExec.exec_pipeline([
+                (['sh', '-c', script], host),
+                (['tar', '-xf', '-', '-C', dest.path, '--no-same-owner', '--transform', 's|.*/||'], None),
+            ])
+        except CmdExecProcessError as e:
+            raise RemoteFetchError(f'Failed to fetch {paths} from "{host}": {e}') from e
+        
+        size = 0
+        
+        for name in names:
+            size += await FsAdapter.size(dest.join(name))
+        
+        return TransferStatsModel(stream_bytes=size, total_bytes=size, total_files=len(names))
+    
+    @classmethod
+    async def stream(cls, path: str, host: HostModel, stdout: IO[Any], *, generate: list | None = None, cleanup: list | None = None) -> None:
+        """
+        Write the contents of the file at path to stdout, with the same generate / cleanup handling as fetch.
+        """
+        script = cls._gen_script(['cat', path], generate=generate, cleanup=cleanup)
+        
+        try:
+            await CmdExec.exec(['sh', '-c', script], host=host, stdout=stdout)
+        except CmdExecProcessError as e:
+            raise RemoteFetchError(f'Failed to stream "{path}" from "{host}": {e}') from e
+    
+    @classmethod
+    def _gen_script(cls, read_cmd: list, *, generate: list | None = None, cleanup: list | None = None) -> str:
+        # stdout carries the data, so everything else goes to stderr
+        script = ['set -e']
+        
+        if cleanup:
+            script.append(f'trap {shlex.quote(shlex.join(cleanup) + " >&2")} EXIT')
+        
+        if generate:
+            script.append(f'{shlex.join(generate)} >&2')
+        
+        script.append(shlex.join(read_cmd))
+        
+        return '\n'.join(script)
\ No newline at end of file
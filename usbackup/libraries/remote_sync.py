@@ -1,5 +1,12 @@
+import re
+import logging
+import datetime
+import collections
+from typing import Callable
 from usbackup.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from usbackup.libraries.ssh_mux import SshMux
 from usbackup.models.path import PathModel
+from usbackup.models.transfer_stats import TransferStatsModel
 
 __all__ = ['RemoteSync', 'RemoteSyncError']
 
@@ -10,10 +17,30 @@ class RemoteSyncError(Exception):
     pass
 
 class RemoteSync:
+    # matches the "%t %i %f" out-format: date, time, itemized changes (11 characters, unchanged attributes may be spaces), file name
+    _itemize_pattern: re.Pattern = re.compile(r'^\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2} (\S.{10}) (.*)$')
+    # characters rsync can not print are written as "\#ooo" (octal)
+    _escape_pattern: re.Pattern = re.compile(r'\\#([0-7]{3})')
+    # "--stats" lines mapped to transfer counters
+    _stats_pattern: re.Pattern = re.compile(r'^(Number of files|Number of regular files transferred|Number of files transferred|Total file size|Literal data|Matched data|Total bytes sent|Total bytes received): ([\d,.]+)')
+    _stats_counters: dict[str, str] = {
+        'Number of files': 'files_scanned',
+        'Number of regular files transferred': 'files_transferred',
+        'Number of files transferred': 'files_transferred',
+        'Total file size': 'total_bytes',
+        'Literal data': 'literal_bytes',
+        'Matched data': 'matched_bytes',
+        'Total bytes sent': 'bytes_sent',
+        'Total bytes received': 'bytes_received',
+    }
+    _reg_files_pattern: re.Pattern = re.compile(r'\breg: ([\d,.]+)')
+    
     @classmethod
-    async def rsync(cls, src: PathModel, dst: PathModel, *, options: list = []) -> str:
+    async def rsync(cls, src: PathModel, dst: PathModel, *, options: list = [], on_item: Callable[[str, str], None] | None = None) -> TransferStatsModel:
         """
-        Copy a file or directory from src to dst using rsync.
+        Copy a file or directory from src to dst using rsync and return the transfer statistics.
+        on_item is called with the itemized changes and the name (relative to dst) of every item rsync reports
+        (before the transfer of the item, the file may not be in place yet).
         """
         if not src.host.local and not dst.host.local:
             raise RemoteSyncError("Cannot copy from remote to remote")
@@ -34,22 +61,78 @@ class RemoteSync:
             remote = dst.host
 
         if remote:
-            ssh_opts = []
-            
-            if remote.password:
-                cmd_prefix += ['sshpass', '-p', str(remote.password)]
-            else:
-                ssh_opts += ['-o', 'PasswordAuthentication=No', '-o', 'BatchMode=yes']
-                
-            if remote.port:
-                ssh_opts += ['-p', str(remote.port)]
+            cmd_prefix, ssh_opts = SshMux.gen_ssh_opts(remote)
+            ssh_opts += await SshMux.ensure(remote)
 
             if ssh_opts:
                 cmd_options += ['--rsh', f'ssh {" ".join(ssh_opts)}']
                 
         cmd_options += ['--out-format', "%t %i %f", "--stats"]
-
-        return await CmdExec.exec([*cmd_prefix, "rsync", *cmd_options, src_path, dst_path])
+        
+        # one line per file is printed, so only aggregate them instead of keeping the output around
+        changes = collections.Counter()
+        output = collections.deque(maxlen=100)
+        start_time = datetime.datetime.now()
+        
+        async for line in CmdExec.exec_lines([*cmd_prefix, "rsync", *cmd_options, src_path, dst_path]):
+            match = cls._itemize_pattern.match(line)
+            
+            if match:
+                changes[cls._classify_change(match.group(1).rstrip())] += 1
+                
+                if on_item:
+                    on_item(match.group(1), cls._unescape_name(match.group(2)))
+            elif line:
+                output.append(line)
+        
+        summary = ', '.join(f'{change}: {count}' for change, count in sorted(changes.items()))
+        
+        logging.debug('\n'.join([f'Itemized changes: {summary or "none"}', *output]))
+        
+        return TransferStatsModel(
+            elapsed=datetime.datetime.now() - start_time,
+            changes=dict(changes),
+            **cls._parse_stats(output),
+        )
+    
+    @classmethod
+    def _parse_stats(cls, lines: collections.deque) -> dict[str, int]:
+        counters = {}
+        
+        for line in lines:
+            match = cls._stats_pattern.match(line)
+            
+            if not match:
+                continue
+            
+            # numbers are printed with locale dependent thousands separators
+            counters[cls._stats_counters[match.group(1)]] = int(re.sub(r'[,.]', '', match.group(2)))
+            
+            if match.group(1) == 'Number of files':
+                reg_files = cls._reg_files_pattern.search(line)
+                counters['total_files'] = int(re.sub(r'[,.]', '', reg_files.group(1))) if reg_files else counters['files_scanned']
+        
+        return counters
+    
+    @classmethod
+    def _unescape_name(cls, name: str) -> str:
+        return cls._escape_pattern.sub(lambda match: chr(int(match.group(1), 8)), name).lstrip('/')
+    
+    @classmethod
+    def _classify_change(cls, itemized: str) -> str:
+        if itemized.startswith('*'):
+            # "*deleting" and other messages
+            return itemized[1:]
+        
+        update_types = {
+            '<': 'sent',
+            '>': 'received',
+            'c': 'created',
+            'h': 'hardlinked',
+            '.': 'unchanged',
+        }
+        
+        return update_types.get(itemized[0], 'other')
     
     @classmethod
     async def scp(cls, src: PathModel, dst: PathModel) -> str:
@@ -79,12 +162,7 @@ class RemoteSync:
             remote = dst.host
         
         if remote:
-            if remote.password:
-                cmd_prefix += ['sshpass', '-p', str(remote.password)]
-            else:
-                cmd_options += ['-o', 'PasswordAuthentication=No', '-o', 'BatchMode=yes']
-                
-            if remote.port:
-                cmd_options += ['-P', str(remote.port)]
+            cmd_prefix, cmd_options = SshMux.gen_ssh_opts(remote, port_flag='-P')
+            cmd_options += await SshMux.ensure(remote)
                 
         return await CmdExec.exec([*cmd_prefix, "scp", *cmd_options, src_path, dst_path])
\ No newline at end of file
@@ -0,0 +1,178 @@
+import os
+import time
+import logging
+import asyncio
+import weakref
+import tempfile
+from usbackup.libraries.cleanup_queue import CleanupQueue
+from usbackup.models.host import HostModel
+
+__all__ = ['SshMux']
+
+class SshMux:
+    """
+    Shares one persistent ssh ControlMaster connection per host between all remote commands,
+    rsync and scp invocations of a run.
+    """
+    _enabled: bool = False
+    _idle_timeout: int = 60
+    _socket_dir: str | None = None
+    _cleanup: CleanupQueue | None = None
+    
+    # host key -> monotonic time of last use
+    _masters: dict[str, float] = {}
+    # host key -> monotonic time of a failed master start (those hosts connect directly for a while)
+    _disabled: dict[str, float] = {}
+    # asyncio locks belong to one loop, so they are kept per loop and only while in use
+    _locks: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, weakref.WeakValueDictionary[str, asyncio.Lock]] = weakref.WeakKeyDictionary()
+    
+    @classmethod
+    def setup(cls, *, cleanup: CleanupQueue, idle_timeout: int = 60) -> None:
+        """
+        Enable connection multiplexing. Masters exit after idle_timeout seconds without clients
+        and are closed through the cleanup queue when the run ends.
+        """
+        cls._cleanup = cleanup
+        cls._idle_timeout = idle_timeout
+        cls._socket_dir = os.path.join(tempfile.gettempdir(), f'usbackup-ssh-{os.getuid()}')
+        
+        os.makedirs(cls._socket_dir, mode=0o700, exist_ok=True)
+        
+        cls._enabled = True
+    
+    @classmethod
+    def gen_ssh_opts(cls, host: HostModel, *, port_flag: str = '-p') -> tuple[list, list]:
+        """
+        Return the command prefix (sshpass) and the ssh options needed to connect to host.
+        """
+        cmd_prefix = []
+        ssh_opts = []
+        
+        if host.password:
+            cmd_prefix += ['sshpass', '-p', str(host.password)]
+        else:
+            ssh_opts += ['-o', 'PasswordAuthentication=No', '-o', 'BatchMode=yes']
+        
+        if host.port:
+            ssh_opts += [port_flag, str(host.port)]
+        
+        return cmd_prefix, ssh_opts
+    
+    @classmethod
+    async def ensure(cls, host: HostModel) -> list:
+        """
+        Make sure a master connection to host is running and return the ssh options that reuse it.
+        An empty list is returned when multiplexing is not available (commands connect directly).
+        """
+        if not cls._enabled or host.local:
+            return []
+        
+        key = cls._gen_key(host)
+        
+        if key in cls._disabled and time.monotonic() - cls._disabled[key] < cls._idle_timeout:
+            return []
+        
+        if cls._is_fresh(key):
+            cls._masters[key] = time.monotonic()
+            return cls._gen_client_opts()
+        
+        locks = cls._locks.setdefault(asyncio.get_running_loop(), weakref.WeakValueDictionary())
+        lock = locks.setdefault(key, asyncio.Lock())
+        
+        async with lock:
+            # another task may have started the master while we were waiting
+            if cls._is_fresh(key):
+                cls._masters[key] = time.monotonic()
+                return cls._gen_client_opts()
+            
+            if not await cls._control(host, 'check') and not await cls._start(host):
+                logging.warning(f'Failed to start ssh master connection to "{host}". Using direct connections')
+                cls._disabled[key] = time.monotonic()
+                return []
+            
+            cls._disabled.pop(key, None)
+            cls._masters[key] = time.monotonic()
+            
+            if cls._cleanup and not cls._cleanup.has_item(f'ssh_mux_exit_{key}'):
+                cls._cleanup.push(f'ssh_mux_exit_{key}', cls.close, host)
+        
+        return cls._gen_client_opts()
+    
+    @classmethod
+    async def close(cls, host: HostModel) -> None:
+        """
+        Stop the master connection to host. Never raises.
+        """
+        key = cls._gen_key(host)
+        
+        cls._masters.pop(key, None)
+        
+        if cls._socket_dir is None:
+            return
+        
+        await cls._control(host, 'exit')
+    
+    @classmethod
+    def _is_fresh(cls, key: str) -> bool:
+        last_use = cls._masters.get(key)
+        
+        # leave some margin so we don't race the master's ControlPersist expiry
+        return last_use is not None and time.monotonic() - last_use < cls._idle_timeout * 0.8
+    
+    @classmethod
+    def _gen_key(cls, host: HostModel) -> str:
+        return f'{host.user or ""}@{host.host}:{host.port or 22}'
+    
+    @classmethod
+    def _gen_control_path(cls) -> str:
+        # %C is a hash of the connection parameters, keeping the socket path short
+        return os.path.join(cls._socket_dir or tempfile.gettempdir(), '%C')
+    
+    @classmethod
+    def _gen_client_opts(cls) -> list:
+        return ['-o', f'ControlPath={cls._gen_control_path()}', '-o', 'ControlMaster=no']
+    
+    @classmethod
+    def _gen_remote(cls, host: HostModel) -> str:
+        return f'{host.user}@{host.host}' if host.user is not None else host.host
+    
+    @classmethod
+    async def _start(cls, host: HostModel) -> bool:
+        cmd_prefix, ssh_opts = cls.gen_ssh_opts(host)
+        
+        cmd = [
+            *cmd_prefix, 'ssh', *ssh_opts,
+            '-o', 'ControlMaster=yes',
+            '-o', f'ControlPath={cls._gen_control_path()}',
+            '-o', f'ControlPersist={cls._idle_timeout}',
+            '-f', '-N',
+            cls._gen_remote(host),
+        ]
+        
+        logging.debug(f'Starting ssh master connection: {cmd}')
+        
+        # the forked master keeps inherited pipes open, so don't capture its output
+        return await cls._run(cmd)
+    
+    @classmethod
+    async def _control(cls, host: HostModel, command: str) -> bool:
+        _, ssh_opts = cls.gen_ssh_opts(host)
+        
+        cmd = ['ssh', *ssh_opts, '-o', f'ControlPath={cls._gen_control_path()}', '-O', command, cls._gen_remote(host)]
+        
+        return await cls._run(cmd)
+    
+    @classmethod
+    async def _run(cls, cmd: list) -> bool:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            
+            return await process.wait() == 0
+        except OSError as e:
+            logging.debug(f'Failed to execute {cmd[0]}: {e}')
+            return False
\ No newline at end of file
@@ -0,0 +1,374 @@
+import os
+import time
+import errno
+import signal
+import asyncio
+import hashlib
+import threading
+import concurrent.futures
+from typing import IO, Awaitable, Callable
+from usbackup.libraries.compression import Compression
+
+__all__ = ['StreamPipeline', 'StreamPipelineError', 'StreamStage', 'StreamStageStats', 'HashStage', 'ThrottleStage', 'CommandStage', 'CompressStage']
+
+class StreamPipelineError(Exception):
+    """
+    Custom exception for stream pipeline errors.
+    """
+    pass
+
+class StreamStage:
+    """
+    In-process transform of a stream. Stages that only need the amount of data passing through (needs_data False)
+    are relayed with splice, without copying the data through userspace.
+    """
+    name: str = 'stage'
+    needs_data: bool = True
+    
+    def process(self, data: bytes) -> bytes:
+        return data
+    
+    def account(self, size: int) -> None:
+        pass
+    
+    def finish(self) -> bytes:
+        """
+        Called at the end of the stream. Returns the data still held by the stage.
+        """
+        return b''
+
+class HashStage(StreamStage):
+    """
+    Digest of the stream passing through.
+    """
+    name: str = 'hash'
+    
+    def __init__(self, algorithm: str = 'sha256'):
+        self._hash = hashlib.new(algorithm)
+    
+    def process(self, data: bytes) -> bytes:
+        self._hash.update(data)
+        return data
+    
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+class ThrottleStage(StreamStage):
+    """
+    Limits the stream to bytes_per_second.
+    """
+    name: str = 'throttle'
+    needs_data: bool = False
+    
+    def __init__(self, bytes_per_second: int):
+        if bytes_per_second <= 0:
+            raise StreamPipelineError('Throttle rate must be positive')
+        
+        self._rate: int = bytes_per_second
+        self._total: int = 0
+        self._start: float | None = None
+    
+    def account(self, size: int) -> None:
+        if self._start is None:
+            self._start = time.monotonic()
+        
+        self._total += size
+        ahead = self._total / self._rate - (time.monotonic() - self._start)
+        
+        # stages run in their own threads, sleeping only holds back this stream
+        if ahead > 0:
+            time.sleep(ahead)
+
+class CommandStage:
+    """
+    Transform done by a local command reading the stream on stdin and writing the result on stdout.
+    The command is connected to the other stages with pipes, so the data never passes through python.
+    """
+    def __init__(self, cmd: list, *, name: str | None = None):
+        self.cmd: list = cmd
+        self.name: str = name or cmd[0]
+
+class CompressStage(CommandStage):
+    """
+    Compression of the stream with a local compressor (see Compression.gen_cmd).
+    """
+    def __init__(self, codec: str, *, level: int | None = None, threads: int = 1, rsyncable: bool = False):
+        cmd = Compression.gen_cmd(codec, level=level, threads=threads, rsyncable=rsyncable)
+        
+        if not cmd:
+            raise StreamPipelineError(f'Codec "{codec}" does not compress')
+        
+        super().__init__(cmd, name=codec)
+
+class StreamStageStats:
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.bytes_out: int = 0
+        # time spent processing data (in-process stages only)
+        self.busy: float | None = None
+        self.elapsed: float = 0
+    
+    @property
+    def throughput(self) -> float | None:
+        """Output rate in MB/s"""
+        if not self.elapsed:
+            return None
+        
+        return self.bytes_out / self.elapsed / 1000 ** 2
+    
+    def __str__(self) -> str:
+        summary = f'{self.name} {self.bytes_out / 1000 ** 2:.2f} MB'
+        
+        if self.throughput is not None:
+            summary += f' ({self.throughput:.2f} MB/s'
+            summary += f', {self.busy / self.elapsed:.0%} busy)' if self.busy is not None else ')'
+        
+        return summary
+
+class _PipeEnds:
+    """
+    Pipe ends created by a pipeline run. A segment takes over its ends when it starts and closes them,
+    the ends no segment took over are closed when the run ends.
+    """
+    def __init__(self) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self._free: set[int] = set()
+    
+    def pipe(self) -> tuple[int, int]:
+        read_fd, write_fd = os.pipe()
+        
+        with self._lock:
+            self._free.update((read_fd, write_fd))
+        
+        return read_fd, write_fd
+    
+    def take(self, *fds: int) -> None:
+        with self._lock:
+            if not self._free.issuperset(fds):
+                raise StreamPipelineError('Pipeline stopped before the stage started')
+            
+            self._free.difference_update(fds)
+    
+    def close(self) -> None:
+        with self._lock:
+            fds, self._free = self._free, set()
+        
+        for fd in fds:
+            os.close(fd)
+
+class StreamPipeline:
+    """
+    Passes a stream through a chain of stages in one pass, on its way to its destination.
+    Stages are connected with pipes (bounded by the pipe capacity and one buffer per stage) and run concurrently,
+    in-process stages in their own threads and command stages as processes.
+    """
+    _buffer_size: int = 1024 * 1024
+    _splice: bool = hasattr(os, 'splice')
+    
+    def __init__(self, stages: list[StreamStage | CommandStage], *, buffer_size: int | None = None):
+        self._stages: list[StreamStage | CommandStage] = stages
+        self._buffer_size: int = buffer_size or self._buffer_size
+        self._stats: list[StreamStageStats] = []
+    
+    @property
+    def stats(self) -> list[StreamStageStats]:
+        """
+        Stats of the source (the producer), of each stage and of the final write.
+        """
+        return self._stats
+    
+    def format_stats(self) -> str:
+        return ', '.join(str(stats) for stats in self._stats)
+    
+    async def run(self, producer: Callable[[IO[bytes]], Awaitable], out: IO[bytes]) -> int:
+        """
+        Run producer (called with the file object to write to) and store the transformed stream in out.
+        Returns the number of bytes written to out.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        self._stats = [StreamStageStats('source'), *[StreamStageStats(stage.name) for stage in self._stages], StreamStageStats('write')]
+        
+        out.flush()
+        
+        # dedicated threads, so relays never wait for a free worker of the default executor
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self._stages) * 2 + 1)
+        ends = _PipeEnds()
+        segments = []
+        results = None
+        
+        try:
+            read_fd, producer_fd = ends.pipe()
+            
+            for i, stage in enumerate([*self._stages, None]):
+                # only in-process stages count their output, the others are counted by the relay reading it
+                counted = i > 0 and not isinstance(self._stages[i - 1], CommandStage)
+                
+                if isinstance(stage, CommandStage) and not counted:
+                    # a splice relay between two processes, so the data passed between them is counted
+                    next_read_fd, write_fd = ends.pipe()
+                    segments.append(loop.run_in_executor(executor, self._relay, ends, None, read_fd, write_fd, None, self._stats[i], start, True))
+                    read_fd = next_read_fd
+                    counted = True
+                
+                if stage is None:
+                    next_read_fd, write_fd = None, out.fileno()
+                else:
+                    next_read_fd, write_fd = ends.pipe()
+                
+                if isinstance(stage, CommandStage):
+                    segments.append(asyncio.create_task(self._run_command(ends, stage, read_fd, write_fd, self._stats[i + 1], start)))
+                else:
+                    # the final write goes to the destination, which belongs to the caller
+                    segments.append(loop.run_in_executor(executor, self._relay, ends, stage, read_fd, write_fd, None if counted else self._stats[i], self._stats[i + 1], start, stage is not None))
+                
+                read_fd = next_read_fd
+            
+            segments.insert(0, asyncio.create_task(self._run_producer(ends, producer, producer_fd, self._stats[0], start)))
+            results = await asyncio.gather(*segments, return_exceptions=True)
+        finally:
+            if results is None:
+                await self._stop(segments, ends, executor)
+            
+            executor.shutdown(wait=True)
+        
+        # the most downstream failure is the cause of the broken pipes before it
+        for result in reversed(results):
+            if isinstance(result, BaseException) and not self._is_broken_pipe(result):
+                raise result
+        
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        
+        return self._stats[-1].bytes_out
+    
+    async def _stop(self, segments: list[asyncio.Future], ends: _PipeEnds, executor: concurrent.futures.ThreadPoolExecutor) -> None:
+        """
+        Stop the segments of a run that failed to start or was cancelled.
+        """
+        for segment in segments:
+            segment.cancel()
+        
+        # the started segments see the end of their input or a broken pipe once the ends nobody took over are closed
+        ends.close()
+        
+        await asyncio.gather(*segments, return_exceptions=True)
+        # relays can't be cancelled once started, join them without blocking the loop
+        await asyncio.get_running_loop().run_in_executor(None, lambda: executor.shutdown(wait=True, cancel_futures=True))
+    
+    async def _run_producer(self, ends: _PipeEnds, producer: Callable[[IO[bytes]], Awaitable], write_fd: int, stats: StreamStageStats, start: float) -> None:
+        ends.take(write_fd)
+        
+        try:
+            with os.fdopen(write_fd, 'wb') as f:
+                await producer(f)
+        finally:
+            stats.elapsed = time.monotonic() - start
+    
+    async def _run_command(self, ends: _PipeEnds, stage: CommandStage, read_fd: int, write_fd: int, stats: StreamStageStats, start: float) -> None:
+        ends.take(read_fd, write_fd)
+        
+        try:
+            process = await asyncio.create_subprocess_exec(*stage.cmd, stdin=read_fd, stdout=write_fd, stderr=asyncio.subprocess.PIPE)
+        finally:
+            # the process holds its own copies
+            os.close(read_fd)
+            os.close(write_fd)
+        
+        try:
+            _, err = await process.communicate()
+        except asyncio.CancelledError:
+            # a command left running would hold its pipes open
+            process.kill()
+            await process.wait()
+            raise
+        
+        stats.elapsed = time.monotonic() - start
+        
+        if process.returncode in (-signal.SIGPIPE, 128 + signal.SIGPIPE):
+            raise BrokenPipeError(errno.EPIPE, f'{stage.name} stopped by a broken pipe')
+        
+        if process.returncode != 0:
+            raise StreamPipelineError(f'{stage.name} failed ({process.returncode}): {err.decode("utf-8", errors="replace").strip()}')
+    
+    def _relay(self, ends: _PipeEnds, stage: StreamStage | None, read_fd: int, write_fd: int, in_stats: StreamStageStats | None, stats: StreamStageStats, start: float, close_write: bool) -> None:
+        ends.take(read_fd, *([write_fd] if close_write else []))
+        
+        splice = self._splice and (stage is None or not stage.needs_data)
+        
+        if stage is not None:
+            stats.busy = 0
+        
+        try:
+            while True:
+                if splice:
+                    try:
+                        size = os.splice(read_fd, write_fd, self._buffer_size)
+                    except OSError as e:
+                        if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                            raise
+                        
+                        # destination not supported by splice (eg. a file opened with O_APPEND)
+                        splice = False
+                        continue
+                    
+                    if not size:
+                        break
+                    
+                    if in_stats:
+                        in_stats.bytes_out += size
+                    
+                    stats.bytes_out += size
+                    
+                    if stage is not None:
+                        busy_start = time.monotonic()
+                        stage.account(size)
+                        stats.busy += time.monotonic() - busy_start
+                    
+                    continue
+                
+                data = os.read(read_fd, self._buffer_size)
+                
+                if not data:
+                    break
+                
+                if in_stats:
+                    in_stats.bytes_out += len(data)
+                
+                if stage is not None:
+                    busy_start = time.monotonic()
+                    
+                    if stage.needs_data:
+                        data = stage.process(data)
+                    else:
+                        stage.account(len(data))
+                    
+                    stats.busy += time.monotonic() - busy_start
+                
+                self._write(write_fd, data, stats)
+            
+            if stage is not None:
+                self._write(write_fd, stage.finish(), stats)
+        finally:
+            stats.elapsed = time.monotonic() - start
+            
+            os.close(read_fd)
+            
+            if close_write:
+                os.close(write_fd)
+    
+    def _write(self, fd: int, data: bytes, stats: StreamStageStats) -> None:
+        view = memoryview(data)
+        
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+            stats.bytes_out += written
+    
+    def _is_broken_pipe(self, e: BaseException) -> bool:
+        if isinstance(e, BrokenPipeError):
+            return True
+        
+        # commands writing to a closed pipe are killed by SIGPIPE
+        return getattr(e, 'code', None) in (-signal.SIGPIPE, 128 + signal.SIGPIPE)
\ No newline at end of file
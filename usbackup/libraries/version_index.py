@@ -0,0 +1,77 @@
+import json
+import asyncio
+import weakref
+from typing import Callable
+from usbackup.libraries.fs_adapter import FsAdapter, FsAdapterError
+from usbackup.models.path import PathModel
+
+__all__ = ['VersionIndex', 'VersionIndexError']
+
+class VersionIndexError(Exception):
+    """
+    Custom exception for version index errors.
+    """
+    pass
+
+class VersionIndex:
+    format: int = 1
+    # serializes read-modify-write cycles of this process (kept outside instances so they stay picklable).
+    # asyncio locks belong to one loop, so they are kept per loop and only while in use
+    _locks: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, weakref.WeakValueDictionary[str, asyncio.Lock]] = weakref.WeakKeyDictionary()
+    
+    def __init__(self, path: PathModel):
+        self._path: PathModel = path
+    
+    @property
+    def path(self) -> PathModel:
+        return self._path
+    
+    async def load(self) -> list[dict] | None:
+        """
+        Load the version entries. Returns None if the index is missing or corrupt.
+        """
+        if not await FsAdapter.exists(self._path, 'f'):
+            return None
+        
+        try:
+            data = json.loads(await FsAdapter.read(self._path))
+        except (FsAdapterError, ValueError):
+            return None
+        
+        if not isinstance(data, dict) or data.get('format') != self.format or not isinstance(data.get('versions'), list):
+            return None
+        
+        for entry in data['versions']:
+            if not isinstance(entry, dict) or 'version' not in entry or 'date' not in entry:
+                return None
+        
+        return data['versions']
+    
+    async def save(self, entries: list[dict]) -> None:
+        """
+        Atomically replace the index with the given entries.
+        """
+        data = {
+            'format': self.format,
+            'versions': sorted(entries, key=lambda x: x['date']),
+        }
+        
+        await FsAdapter.write(self._path, json.dumps(data, indent=1))
+    
+    async def update(self, mutator: Callable[[list[dict]], list[dict]], *, fallback: list[dict] | None = None) -> None:
+        """
+        Apply mutator to the entries stored on disk (or to fallback if the index is unusable) and save the result.
+        """
+        locks = self._locks.setdefault(asyncio.get_running_loop(), weakref.WeakValueDictionary())
+        lock = locks.setdefault(self._path.path, asyncio.Lock())
+        
+        async with lock:
+            entries = await self.load()
+            
+            if entries is None:
+                if fallback is None:
+                    raise VersionIndexError(f'Version index "{self._path}" is missing or corrupt')
+                
+                entries = fallback
+            
+            await self.save(mutator(entries))
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+import logging
+from usbackup.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.models.path import PathModel
+
+__all__ = ['ZfsRecv', 'ZfsRecvError']
+
+class ZfsRecvError(Exception):
+    """
+    Custom exception for received ZFS snapshot errors.
+    """
+    pass
+
+class ZfsRecv:
+    """
+    Snapshots received into local datasets of a storage. A version refers to its snapshots through marker files
+    in its handler directories, so removing the version can destroy them.
+    """
+    marker_suffix: str = '.zfsrecv'
+    
+    @classmethod
+    async def write_marker(cls, path: PathModel, snapshot: str) -> None:
+        """
+        Record that the version owning path holds snapshot.
+        """
+        await FsAdapter.write(PathModel(path=f'{path.path}{cls.marker_suffix}', host=path.host), f'{snapshot}\n')
+    
+    @classmethod
+    async def list_markers(cls, version_path: PathModel) -> list[str]:
+        """
+        Return the snapshots referenced by the markers of the version at version_path.
+        """
+        snapshots = []
+        
+        if not await FsAdapter.exists(version_path, 'd'):
+            return snapshots
+        
+        for handler in await FsAdapter.ls(version_path):
+            handler_path = version_path.join(handler)
+            
+            if not await FsAdapter.exists(handler_path, 'd'):
+                continue
+            
+            for name in await FsAdapter.ls(handler_path):
+                if name.endswith(cls.marker_suffix):
+                    snapshots.append((await FsAdapter.read(handler_path.join(name))).strip())
+        
+        return snapshots
+    
+    @classmethod
+    async def release(cls, version_path: PathModel, owner: PathModel) -> list[str]:
+        """
+        Destroy the snapshots referenced by the version at version_path and return them. Datasets left without
+        snapshots are destroyed too. Snapshots of datasets not mounted below owner (eg. markers copied to another
+        storage by replication) are left alone.
+        """
+        destroyed = []
+        
+        for snapshot in await cls.list_markers(version_path):
+            dataset = snapshot.partition('@')[0]
+            
+            try:
+                mountpoint = await cls._exec(['zfs', 'get', '-H', '-o', 'value', 'mountpoint', dataset])
+            except ZfsRecvError as e:
+                logging.debug(f'Skipping snapshot "{snapshot}": {e}')
+                continue
+            
+            if not os.path.normpath(mountpoint).startswith(os.path.normpath(owner.path) + '/'):
+                logging.debug(f'Skipping snapshot "{snapshot}" received outside of "{owner}"')
+                continue
+            
+            await cls._exec(['zfs', 'destroy', snapshot])
+            destroyed.append(snapshot)
+            
+            if not await cls._exec(['zfs', 'list', '-H', '-o', 'name', '-t', 'snapshot', '-d', '1', dataset]):
+                # nothing left to restore from (eg. the first version of a new chain failed)
+                await cls._exec(['zfs', 'destroy', dataset])
+        
+        return destroyed
+    
+    @classmethod
+    async def _exec(cls, cmd: list) -> str:
+        try:
+            return await CmdExec.exec(cmd)
+        except (CmdExecProcessError, OSError) as e:
+            raise ZfsRecvError(f'{cmd[0]} {cmd[1]} failed: {e}') from e
\ No newline at end of file
@@ -9,11 +9,16 @@ import json
 import re
 from logging.handlers import TimedRotatingFileHandler
 from dotenv import dotenv_values
+from usbackup.libraries.checksum_manifest import ChecksumManifest, ChecksumManifestError
+from usbackup.libraries.chunk_store import ChunkStore, ChunkStoreError
 from usbackup.libraries.cleanup_queue import CleanupQueue
 from usbackup.libraries.datastore import Datastore
+from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.libraries.ssh_mux import SshMux
 from usbackup.models.usbackup import UsBackupModel
 from usbackup.models.job import JobModel
 from usbackup.models.handler_base import HandlerBaseModel
+from usbackup.models.path import PathModel
 from usbackup.services.job import JobService
 from usbackup.services.notifier import NotifierService
 from usbackup.exceptions import UsBackupRuntimeError, GracefulExit
@@ -29,6 +34,9 @@ class UsBackupManager:
         self._model: UsBackupModel = UsBackupModel(**self._load_config(config_file=config_file, alt_job=alt_job))
         self._datastore: Datastore = Datastore(self._get_datastore_filepath())
         self._cleanup: CleanupQueue = CleanupQueue(datastore=self._datastore)
+        
+        # reuse one ssh connection per host for all remote commands of a run
+        SshMux.setup(cleanup=self._cleanup)
 
     def run_once(self) -> None:
         """ Run the backup job once, without scheduling."""
@@ -42,6 +50,18 @@ class UsBackupManager:
         """ Get the current stats of the backup service."""
         return self._run_main(self._get_stats, format=format)
     
+    def restore_stream(self, index: str, output: str) -> bool:
+        """ Reassemble a chunked stream output from its index."""
+        return self._run_main(self._restore_stream, index=index, output=output)
+    
+    def verify_stream(self, index: str) -> list[str] | None:
+        """ Verify the chunks of a chunked stream output."""
+        return self._run_main(self._verify_stream, index=index)
+    
+    def verify_version(self, version: str) -> list[str] | None:
+        """ Verify the files of a backup version against its checksum manifest."""
+        return self._run_main(self._verify_version, version=version)
+    
     def _load_config(self, *, config_file: str | None = None, alt_job: dict | None = None) -> dict:
         if not config_file:
             default_config_paths = [
@@ -328,6 +348,26 @@ class UsBackupManager:
                 'elapsed': str(backup.elapsed),
                 'error': str(backup.error) if backup.error else None,
                 'dest': str(backup.dest),
+                'transferred_bytes': backup.transferred_bytes,
+                'throughput': round(backup.throughput, 2) if backup.throughput is not None else None,
+                'handlers': {handler: stats.to_dict() for handler, stats in backup.stats.items()},
+            }
+        
+        trash_stats = self._datastore.get('trash', {})
+        trash = {}
+        
+        for storage in self._model.storages:
+            if not storage.path.host.local:
+                continue
+            
+            trash_path = storage.path.join('.trash')
+            pending = await FsAdapter.ls(trash_path) if await FsAdapter.exists(trash_path, 'd') else []
+            storage_stats = trash_stats.get(storage.name, {})
+            
+            trash[storage.name] = {
+                'pending': len(pending),
+                'reclaimed': storage_stats.get('reclaimed', 0),
+                'last_reclaimed': str(storage_stats.get('last_reclaimed') or ''),
             }
         
         stats = {
@@ -335,10 +375,48 @@ class UsBackupManager:
             'last_manual_run': str(self._datastore.get('last_manual_run', '')),
             'last_scheduled_run': str(self._datastore.get('last_scheduled_run', '')),
             'backups': backups,
+            'trash': trash,
         }
         
         return self._format_stats(stats, format)
     
+    async def _restore_stream(self, index: str, output: str) -> bool:
+        index_path = PathModel.model_validate(os.path.abspath(index))
+        chunk_store = ChunkStore(ChunkStore.find_pool(index_path))
+        
+        self._logger.info(f'Restoring "{index_path}" to "{output}"')
+        
+        if output == '-':
+            size = await chunk_store.restore(index_path, sys.stdout.buffer)
+        else:
+            with open(output, 'xb') as f:
+                size = await chunk_store.restore(index_path, f)
+        
+        self._logger.info(f'Restored {size} bytes')
+        
+        return True
+    
+    async def _verify_stream(self, index: str) -> list[str]:
+        index_path = PathModel.model_validate(os.path.abspath(index))
+        
+        try:
+            chunk_store = ChunkStore(ChunkStore.find_pool(index_path))
+        except ChunkStoreError as e:
+            return [str(e)]
+        
+        return await chunk_store.verify(index_path)
+    
+    async def _verify_version(self, version: str) -> list[str]:
+        version_path = PathModel.model_validate(os.path.abspath(version))
+        manifest = ChecksumManifest.for_version(version_path)
+        
+        self._logger.info(f'Verifying "{version_path}" against "{manifest.path}"')
+        
+        try:
+            return await manifest.verify(version_path)
+        except ChecksumManifestError as e:
+            return [str(e)]
+    
     async def _run_due_jobs(self, jobs: list[JobService]) -> None:
         tasks = []
             
@@ -384,6 +462,7 @@ class UsBackupManager:
                 'last_manual_run': 'Last manual run',
                 'last_scheduled_run': 'Last scheduled run',
                 'backups': 'Backups',
+                'trash': 'Trash',
             }
             
             output = []
@@ -398,6 +477,25 @@ class UsBackupManager:
                 output.append(f"    elapsed: {backup['elapsed']}")
                 output.append(f"    error: {backup['error']}")
                 output.append(f"    dest: {backup['dest']}")
+                output.append(f"    transferred: {backup['transferred_bytes'] / 1000 ** 2:.2f} MB")
+                output.append(f"    throughput: {self._format_throughput(backup['throughput'])}")
+                for handler, handler_stats in backup['handlers'].items():
+                    output.append(f"    {handler}:")
+                    output.append(f"      files: {handler_stats['files_transferred']} transferred / {handler_stats['files_scanned']} scanned")
+                    output.append(f"      bytes: {handler_stats['bytes_sent']} sent / {handler_stats['bytes_received']} received / {handler_stats['stream_bytes']} streamed")
+                    output.append(f"      data: {handler_stats['literal_bytes']} literal / {handler_stats['matched_bytes']} matched")
+                    output.append(f"      elapsed: {handler_stats['elapsed']}")
+                    output.append(f"      throughput: {self._format_throughput(handler_stats['throughput'])}")
+            output.append(f"{dictionary['trash']}:")
+            output.append('  ' + '-' * 20)
+            for name, trash in stats['trash'].items():
+                output.append(f"  {name}:")
+                output.append(f"    pending: {trash['pending']}")
+                output.append(f"    reclaimed: {trash['reclaimed']}")
+                output.append(f"    last reclaimed: {trash['last_reclaimed']}")
             return '\n'.join(output)
         
-        raise UsBackupRuntimeError(f"Unknown format {format}")
\ No newline at end of file
+        raise UsBackupRuntimeError(f"Unknown format {format}")
+    
+    def _format_throughput(self, throughput: float | None) -> str:
+        return f'{throughput:.2f} MB/s' if throughput is not None else 'n/a'
\ No newline at end of file
@@ -1,14 +1,17 @@
 import datetime
 from usbackup.models.path import PathModel
+from usbackup.models.transfer_stats import TransferStatsModel
 from usbackup.services.context import ContextService
 
 class ResultModel:
-    def __init__(self, context: ContextService, *, message: str | None = None, error: Exception | None = None, elapsed: datetime.timedelta | None = None) -> None:
+    def __init__(self, context: ContextService, *, message: str | None = None, error: Exception | None = None, elapsed: datetime.timedelta | None = None, stats: dict[str, TransferStatsModel] | None = None) -> None:
         self._context: ContextService = context
         
         self._message: str | None = message
         self._error: Exception | None = error
         self._elapsed: datetime.timedelta | None = elapsed
+        # transfer statistics per handler
+        self._stats: dict[str, TransferStatsModel] = stats or {}
         
         self._date: datetime.datetime = datetime.datetime.now()
     
@@ -28,6 +31,23 @@ class ResultModel:
     def elapsed(self) -> datetime.timedelta | None:
         return self._elapsed
     
+    @property
+    def stats(self) -> dict[str, TransferStatsModel]:
+        # results stored by older versions have no stats
+        return getattr(self, '_stats', {})
+    
+    @property
+    def transferred_bytes(self) -> int:
+        return sum(stats.transferred_bytes for stats in self.stats.values())
+    
+    @property
+    def throughput(self) -> float | None:
+        """Overall transfer rate in MB/s"""
+        if not self.stats or not self._elapsed or not self._elapsed.total_seconds():
+            return None
+        
+        return self.transferred_bytes / self._elapsed.total_seconds() / 1000 ** 2
+    
     @property
     def dest(self) -> PathModel:
         return self._context.destination
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, ConfigDict, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from usbackup.handlers import handler_model_factory
 from usbackup.models.host import HostModel
 
@@ -6,6 +6,8 @@ class SourceModel(BaseModel):
     name: str
     host: HostModel
     handlers: list
+    parallel_handlers: int = Field(1, ge=1)
+    checksums: bool = False
     
     model_config = ConfigDict(extra='forbid')
     
@@ -1,8 +1,12 @@
-from pydantic import BaseModel, ConfigDict
+from typing import Literal
+from pydantic import BaseModel, ConfigDict, Field
 from usbackup.models.path import PathModel
 
 class StorageModel(BaseModel):
     name: str
     path: PathModel
+    prune_concurrency: int = Field(2, ge=1)
+    prune_ionice: Literal['idle', 'best-effort', 'none'] = 'idle'
+    cow: Literal['auto', 'off'] = 'auto'
     
     model_config = ConfigDict(extra='forbid')
\ No newline at end of file
@@ -0,0 +1,119 @@
+import datetime
+
+class TransferStatsModel:
+    counters: tuple = (
+        'files_scanned',
+        'files_transferred',
+        'total_files',
+        'total_bytes',
+        'bytes_sent',
+        'bytes_received',
+        'literal_bytes',
+        'matched_bytes',
+        'stream_bytes',
+    )
+    
+    def __init__(self, *, elapsed: datetime.timedelta | None = None, changes: dict[str, int] | None = None, **counters: int) -> None:
+        for counter in counters:
+            if counter not in self.counters:
+                raise ValueError(f'Unknown transfer counter "{counter}"')
+        
+        self._counters: dict[str, int] = {counter: counters.get(counter, 0) for counter in self.counters}
+        self._changes: dict[str, int] = dict(changes or {})
+        self._elapsed: datetime.timedelta | None = elapsed
+    
+    @property
+    def files_scanned(self) -> int:
+        return self._counters['files_scanned']
+    
+    @property
+    def files_transferred(self) -> int:
+        return self._counters['files_transferred']
+    
+    @property
+    def total_files(self) -> int:
+        return self._counters['total_files']
+    
+    @property
+    def total_bytes(self) -> int:
+        return self._counters['total_bytes']
+    
+    @property
+    def bytes_sent(self) -> int:
+        return self._counters['bytes_sent']
+    
+    @property
+    def bytes_received(self) -> int:
+        return self._counters['bytes_received']
+    
+    @property
+    def literal_bytes(self) -> int:
+        return self._counters['literal_bytes']
+    
+    @property
+    def matched_bytes(self) -> int:
+        return self._counters['matched_bytes']
+    
+    @property
+    def stream_bytes(self) -> int:
+        return self._counters['stream_bytes']
+    
+    @property
+    def changes(self) -> dict[str, int]:
+        return self._changes
+    
+    @property
+    def elapsed(self) -> datetime.timedelta | None:
+        return self._elapsed
+    
+    @property
+    def transferred_bytes(self) -> int:
+        return self.bytes_sent + self.bytes_received + self.stream_bytes
+    
+    @property
+    def throughput(self) -> float | None:
+        """Transfer rate in MB/s"""
+        if not self._elapsed or not self._elapsed.total_seconds():
+            return None
+        
+        return self.transferred_bytes / self._elapsed.total_seconds() / 1000 ** 2
+    
+    def add(self, other: 'TransferStatsModel | None' = None, **counters: int) -> None:
+        """Accumulate the counters of another stats object and / or the given counters"""
+        if other is not None:
+            for counter in self.counters:
+                self._counters[counter] += other._counters[counter]
+            
+            for change, count in other._changes.items():
+                self._changes[change] = self._changes.get(change, 0) + count
+        
+        for counter, value in counters.items():
+            if counter not in self.counters:
+                raise ValueError(f'Unknown transfer counter "{counter}"')
+            
+            self._counters[counter] += value
+    
+    def set_elapsed(self, elapsed: datetime.timedelta) -> None:
+        self._elapsed = elapsed
+    
+    def to_dict(self) -> dict:
+        throughput = self.throughput
+        
+        return {
+            **self._counters,
+            'changes': self._changes,
+            'elapsed': self._elapsed.total_seconds() if self._elapsed is not None else None,
+            'throughput': round(throughput, 2) if throughput is not None else None,
+        }
+    
+    def __str__(self) -> str:
+        throughput = self.throughput
+        summary = f'{self.transferred_bytes / 1000 ** 2:.2f} MB transferred'
+        
+        if self._elapsed is not None:
+            summary += f' in {self._elapsed.total_seconds():.2f} seconds'
+        
+        if throughput is not None:
+            summary += f' ({throughput:.2f} MB/s)'
+        
+        return summary
\ No newline at end of file
@@ -2,11 +2,35 @@ import datetime
 from usbackup.models.path import PathModel
 
 class BackupVersionModel():
-    def __init__(self, version: str, path: PathModel, date: datetime.datetime) -> None:
+    def __init__(
+        self,
+        version: str,
+        path: PathModel,
+        date: datetime.datetime,
+        *,
+        status: str | None = None,
+        handlers: list[str] | None = None,
+        bytes: int | None = None,
+        files: int | None = None,
+        elapsed: float | None = None,
+        depends_on: list[str] | None = None,
+        clone_of: str | None = None
+    ) -> None:
         self._version: str = version
         self._path: PathModel = path
         self._date: datetime.datetime = date
         
+        # metadata kept in the version index (None for versions made before it was kept)
+        self._status: str | None = status
+        self._handlers: list[str] | None = handlers
+        self._bytes: int | None = bytes
+        self._files: int | None = files
+        self._elapsed: float | None = elapsed
+        # versions that must be kept as long as this one is (eg. the bases of incremental archives)
+        self._depends_on: list[str] | None = depends_on
+        # version this one was cloned from on copy-on-write storages
+        self._clone_of: str | None = clone_of
+    
     @property
     def version(self) -> str:
         return self._version
@@ -19,5 +43,33 @@ class BackupVersionModel():
     def date(self) -> datetime.datetime:
         return self._date
     
+    @property
+    def status(self) -> str | None:
+        return self._status
+    
+    @property
+    def handlers(self) -> list[str] | None:
+        return self._handlers
+    
+    @property
+    def bytes(self) -> int | None:
+        return self._bytes
+    
+    @property
+    def files(self) -> int | None:
+        return self._files
+    
+    @property
+    def elapsed(self) -> float | None:
+        return self._elapsed
+    
+    @property
+    def depends_on(self) -> list[str] | None:
+        return self._depends_on
+    
+    @property
+    def clone_of(self) -> str | None:
+        return self._clone_of
+    
     def __str__(self) -> str:
         return self._version
\ No newline at end of file
@@ -1,6 +1,7 @@
 import logging
+import asyncio
 import datetime
-from usbackup.libraries.cmd_exec import CmdExec
+from usbackup.libraries.checksum_manifest import ChecksumManifestWriter, ChecksumManifestIndex, ChecksumManifestError
 from usbackup.libraries.fs_adapter import FsAdapter
 from usbackup.libraries.cleanup_queue import CleanupQueue
 from usbackup.models.version import BackupVersionModel
@@ -11,6 +12,7 @@ from usbackup.services.runner import Runner
 from usbackup.services.context import ContextService
 from usbackup.exceptions import UsBackupRuntimeError
 from usbackup.handlers import handler_factory
+from usbackup.handlers.backup import BackupHandler
 
 __all__ = ['Runner']
 
@@ -21,10 +23,6 @@ class BackupRunner(Runner):
     async def run(self) -> ResultModel:
         if await self._context.lock_file_exists():
             raise UsBackupRuntimeError(f'Backup already running')
-        
-        # test connection to host
-        if not await CmdExec.is_host_reachable(self._context.host):
-            raise UsBackupRuntimeError(f'Host "{self._context.host}" is not reachable')
 
         run_time = datetime.datetime.now()
         
@@ -33,7 +31,7 @@ class BackupRunner(Runner):
         await self._context.ensure_destination()
         
         latest_version = await self._context.get_latest_version()
-        version = await self._context.generate_version()
+        version = await self._context.generate_version(base=latest_version)
             
         await self._context.create_lock_file()
         self._cleanup.push(f'remove_lock_{self._id}', self._context.remove_lock_file)
@@ -41,18 +39,56 @@ class BackupRunner(Runner):
         dest = version.path
         dest_link = latest_version.path if latest_version else None
         error = None
+        handlers = []
+        manifest = None
+        base_manifest = None
 
         # Add cleanup task for removing inconsistent version in case something goes wrong
         self._cleanup.push(f'remove_inconsistent_version_{self._id}', self._remove_inconsistent_version, version)
 
         try:
-            await self._run_backup_handlers(dest, dest_link)
+            if self._context.checksums and (version_manifest := self._context.get_manifest(version)):
+                # handlers record the checksums of what they stored, so the version doesn't have to be read again
+                manifest = ChecksumManifestWriter(version_manifest, dest)
+                base_manifest = await self._load_base_manifest(latest_version)
+            
+            await self._run_backup_handlers(dest, dest_link, handlers=handlers, inplace=version.clone_of is not None, base_date=latest_version.date if latest_version else None, manifest=manifest, base_manifest=base_manifest)
+            
+            if manifest:
+                await manifest.commit()
+                
+                self._logger.info(f'Recorded checksums of {manifest.count} files in "{manifest.manifest.path}"')
+            
+            # handlers report the size of what they stored, so the version doesn't have to be walked
+            size = sum(handler.stats.total_bytes for handler in handlers)
+            files = sum(handler.stats.total_files for handler in handlers)
+            elapsed_s = (datetime.datetime.now() - run_time).total_seconds()
+            depends_on = sorted({dependency for handler in handlers for dependency in handler.depends_on})
+            
+            version = await self._context.complete_version(version, bytes=size, files=files, elapsed=elapsed_s, depends_on=depends_on or None)
             # remove cleanup task for removing inconsistent version
             self._cleanup.pop(f'remove_inconsistent_version_{self._id}')
         except Exception as e:
             self._logger.exception(e)
             await self._cleanup.consume(f'remove_inconsistent_version_{self._id}')
             error = e
+        finally:
+            if base_manifest:
+                await base_manifest.close()
+            
+            # nothing left to discard once committed
+            if manifest:
+                await manifest.discard()
+        
+        # changes handlers made outside of the version only stick when the version does
+        for handler in handlers:
+            try:
+                if error:
+                    await handler.rollback()
+                else:
+                    await handler.commit()
+            except Exception as e:
+                self._logger.exception(f'Failed to finalize "{handler.handler}" handler. {e}')
         
         if not error:
             try:
@@ -70,28 +106,133 @@ class BackupRunner(Runner):
 
         self._logger.info(f'Backup finished at {finish_time}. Elapsed time: {elapsed_s:.2f} seconds')
         
-        return ResultModel(self._context, error=error, elapsed=elapsed)
+        stats = {handler.handler: handler.stats for handler in handlers}
+        
+        return ResultModel(self._context, error=error, elapsed=elapsed, stats=stats)
     
-    async def _run_backup_handlers(self, dest: PathModel, dest_link: PathModel | None = None) -> None:
+    async def _run_backup_handlers(
+        self,
+        dest: PathModel,
+        dest_link: PathModel | None = None,
+        *,
+        handlers: list[BackupHandler],
+        inplace: bool = False,
+        base_date: datetime.datetime | None = None,
+        manifest: ChecksumManifestWriter | None = None,
+        base_manifest: ChecksumManifestIndex | None = None
+    ) -> None:
+        if inplace:
+            await self._remove_stale_handler_dirs(dest)
+        
+        jobs = []
+        
         for handler_model in self._context.handlers:
             handler_logger = self._logger.getChild(handler_model.handler)
             
             handler = handler_factory('backup', handler_model.handler, handler_model, self._context.host, cleanup=self._cleanup, logger=handler_logger)
+            
+            if handler.chunked:
+                if not self._context.chunk_store:
+                    raise UsBackupRuntimeError(f'Handler "{handler.handler}" is chunked but the storage is not local')
+                
+                handler.set_chunk_store(self._context.chunk_store)
+            
+            if base_date:
+                handler.set_base_date(base_date)
+            
+            if manifest:
+                handler.set_checksums(manifest, base_manifest)
            
             handler_dest = dest.join(handler.handler)
             handler_dest_link = None
             
-            if dest_link:
+            if inplace and handler.cow_capable:
+                self._logger.info(f'Updating cloned data of "{handler.handler}" handler in place')
+                handler.set_inplace()
+            elif dest_link:
                 self._logger.info(f'Using "{dest_link}" as dest link for "{handler.handler}" handler')
                 handler_dest_link = dest_link.join(handler.handler)
+            
+            if inplace and not handler.cow_capable and await FsAdapter.exists(handler_dest, 'd'):
+                # the handler writes a fresh copy, cloned files would only linger around
+                self._logger.info(f'Clearing cloned handler directory "{handler_dest}"')
+                await FsAdapter.rm(handler_dest)
                 
             if not await FsAdapter.exists(handler_dest, 'd'):
                 self._logger.info(f'Creating handler directory "{handler_dest}"')
                 await FsAdapter.mkdir(handler_dest)
             
-            self._logger.info(f'Performing backup via "{handler.handler}" handler')
-            await handler.backup(handler_dest, handler_dest_link)
+            jobs.append((handler, handler_dest, handler_dest_link))
+        
+        if self._context.parallel_handlers == 1:
+            for job in jobs:
+                await self._run_backup_handler(*job, handlers=handlers)
+            
+            return
+        
+        self._logger.info(f'Running {len(jobs)} handlers with up to {self._context.parallel_handlers} in parallel')
+        
+        semaphore = asyncio.Semaphore(self._context.parallel_handlers)
+        
+        async def run_backup_handler(job: tuple) -> None:
+            async with semaphore:
+                await self._run_backup_handler(*job, handlers=handlers)
+        
+        # every handler runs to its end, so the version is only cleaned up once all of them finished
+        results = await asyncio.gather(*[run_backup_handler(job) for job in jobs], return_exceptions=True)
+        errors = []
+        
+        for (handler, _, _), result in zip(jobs, results):
+            if isinstance(result, BaseException):
+                self._logger.error(f'Handler "{handler.handler}" failed: {result}')
+                errors.append((handler, result))
+        
+        if len(errors) == 1:
+            raise errors[0][1]
+        
+        if errors:
+            raise UsBackupRuntimeError(f'{len(errors)} handlers failed. ' + '; '.join(f'"{handler.handler}": {error}' for handler, error in errors))
+    
+    async def _run_backup_handler(self, handler: BackupHandler, dest: PathModel, dest_link: PathModel | None, *, handlers: list[BackupHandler]) -> None:
+        self._logger.info(f'Performing backup via "{handler.handler}" handler')
+        start_time = datetime.datetime.now()
+        
+        # handlers are collected even when they fail half way (for their stats)
+        handlers.append(handler)
+        
+        await handler.backup(dest, dest_link)
+        
+        handler.stats.set_elapsed(datetime.datetime.now() - start_time)
+        
+        self._logger.info(f'Handler "{handler.handler}" finished. {handler.stats}')
 
+    async def _load_base_manifest(self, latest_version: BackupVersionModel | None) -> ChecksumManifestIndex | None:
+        if not latest_version:
+            return None
+        
+        manifest = self._context.get_manifest(latest_version)
+        
+        if not await manifest.exists():
+            self._logger.info(f'No checksum manifest found for "{latest_version}". Unchanged files are hashed again')
+            return None
+        
+        try:
+            return await ChecksumManifestIndex.load(manifest)
+        except (ChecksumManifestError, OSError) as e:
+            self._logger.warning(f'Ignoring unusable checksum manifest "{manifest.path}": {e}. Unchanged files are hashed again')
+            return None
+    
+    async def _remove_stale_handler_dirs(self, dest: PathModel) -> None:
+        handler_names = [handler_model.handler for handler_model in self._context.handlers]
+        
+        for name in await FsAdapter.ls(dest):
+            if name == self._context.version_file:
+                # metadata of the cloned version, the version gets its own once complete
+                await FsAdapter.rm(dest.join(name))
+            elif name not in handler_names:
+                self._logger.info(f'Removing cloned directory "{name}" of a handler no longer configured')
+                await FsAdapter.rm(dest.join(name))
+    
     async def _remove_inconsistent_version(self, version: BackupVersionModel) -> None:
         self._logger.warning(f'Deleting inconsistent backup version')
 
@@ -1,6 +1,16 @@
+import os
+import re
+import json
 import logging
 import datetime
-from usbackup.libraries.fs_adapter import FsAdapter
+import uuid
+from typing import Callable
+from usbackup.libraries.checksum_manifest import ChecksumManifest, ChecksumManifestError
+from usbackup.libraries.chunk_store import ChunkStore, ChunkStoreError
+from usbackup.libraries.fs_adapter import FsAdapter, FsAdapterError
+from usbackup.libraries.cow_fs import CowFs, CowFsError, CowFsType
+from usbackup.libraries.version_index import VersionIndex
+from usbackup.libraries.zfs_recv import ZfsRecv, ZfsRecvError
 from usbackup.models.source import SourceModel
 from usbackup.models.storage import StorageModel
 from usbackup.models.host import HostModel
@@ -17,8 +27,18 @@ class ContextService:
         self._name: str = source.name
         self._host: HostModel = source.host
         self._handlers: list[HandlerBaseModel] = source.handlers
+        self._parallel_handlers: int = source.parallel_handlers
+        self._checksums: bool = source.checksums
         self._destination: PathModel = storage.path.join(source.name)
+        self._trash: PathModel = storage.path.join('.trash')
+        self._storage_path: PathModel = storage.path
+        self._cow: str = storage.cow
+        # pool shared by the chunked stream outputs of all sources of the storage
+        self._chunk_store: ChunkStore | None = ChunkStore(storage.path.join(ChunkStore.pool_name)) if storage.path.host.local else None
+        self._index: VersionIndex = VersionIndex(self._destination.join('index.json'))
         self._version_format: str = '%Y_%m_%d-%H_%M_%S'
+        # copy of the index entry kept inside the version directory, so the index can be rebuilt from a directory scan
+        self._version_file: str = 'version.json'
         self._versions: list[BackupVersionModel] = []
         self._cache_generated: bool = False
     
@@ -34,9 +54,25 @@ class ContextService:
     def handlers(self) -> list[HandlerBaseModel]:
         return self._handlers
     
+    @property
+    def parallel_handlers(self) -> int:
+        return self._parallel_handlers
+    
+    @property
+    def checksums(self) -> bool:
+        return self._checksums
+    
+    @property
+    def version_file(self) -> str:
+        return self._version_file
+    
     @property
     def destination(self) -> PathModel:
         return self._destination
+    
+    @property
+    def chunk_store(self) -> ChunkStore | None:
+        return self._chunk_store
         
     async def get_versions(self) -> list[BackupVersionModel]:
         await self._ensure_versions_cache()
@@ -46,42 +82,180 @@ class ContextService:
     async def get_latest_version(self) -> BackupVersionModel | None:
         await self._ensure_versions_cache()
         
-        if not self._versions:
+        # versions that are still being written can not be used as base / replicated
+        versions = [version for version in self._versions if version.status != 'running']
+        
+        if not versions:
             return None
         
         # get the latest version
-        return self._versions[-1]
+        return versions[-1]
     
-    async def generate_version(self) -> BackupVersionModel:
+    async def generate_version(self, *, base: BackupVersionModel | None = None) -> BackupVersionModel:
+        """
+        Create a new version. On copy-on-write storages the version is a clone of base (when possible).
+        """
         await self._ensure_versions_cache()
         
         version_date = datetime.datetime.now()
         version = version_date.strftime(self._version_format)
         version_path = self._destination.join(version)
+        fs = await self._get_cow_fs()
+        clone_of = None
         
-        # create backup directory
-        self._logger.info(f'Creating version directory {version_path}')
-        await FsAdapter.mkdir(version_path)
+        if fs and base and (fs == 'reflink' or await CowFs.is_volume(base.path, fs)):
+            self._logger.info(f'Cloning version "{base}" to {version_path} ({fs})')
             
-        version_model = BackupVersionModel(version, version_path, version_date)
+            try:
+                await CowFs.clone(base.path, version_path, fs)
+                clone_of = base.version
+            except CowFsError as e:
+                self._logger.warning(f'Failed to clone version "{base}": {e}')
+        
+        if not clone_of:
+            # create backup directory
+            self._logger.info(f'Creating version directory {version_path}')
+            
+            if not fs:
+                await FsAdapter.mkdir(version_path)
+            else:
+                try:
+                    await CowFs.create(version_path, fs)
+                except CowFsError as e:
+                    self._logger.warning(f'Failed to create {fs} volume: {e}. Using a plain directory')
+                    await FsAdapter.mkdir(version_path)
+        
+        version_model = BackupVersionModel(version, version_path, version_date, status='running', handlers=[handler.handler for handler in self._handlers], clone_of=clone_of)
         
         self._versions.append(version_model)
         
+        await self._update_index(lambda entries: [*self._drop_entry(entries, version_model), self._gen_entry(version_model)])
+        
+        return version_model
+    
+    async def complete_version(
+        self,
+        version: BackupVersionModel,
+        *,
+        status: str = 'complete',
+        bytes: int | None = None,
+        files: int | None = None,
+        elapsed: float | None = None,
+        depends_on: list[str] | None = None
+    ) -> BackupVersionModel:
+        await self._ensure_versions_cache()
+        
+        version_model = BackupVersionModel(
+            version.version,
+            version.path,
+            version.date,
+            status=status,
+            handlers=version.handlers,
+            bytes=bytes,
+            files=files,
+            elapsed=elapsed,
+            depends_on=depends_on,
+            clone_of=version.clone_of,
+        )
+        
+        self._replace_cached_version(version_model)
+        
+        await self._update_index(lambda entries: [*self._drop_entry(entries, version), self._gen_entry(version_model)])
+        await self._write_version_file(version_model)
+        
+        return version_model
+    
+    async def register_version(self, version: BackupVersionModel) -> BackupVersionModel:
+        """Record a version that was copied into this destination (eg. by replication)"""
+        await self._ensure_versions_cache()
+        
+        version_model = BackupVersionModel(
+            version.version,
+            self._destination.join(version.version),
+            version.date,
+            status=version.status or 'complete',
+            handlers=version.handlers,
+            bytes=version.bytes,
+            files=version.files,
+            elapsed=version.elapsed,
+            depends_on=version.depends_on,
+            clone_of=version.clone_of,
+        )
+        
+        self._replace_cached_version(version_model)
+        
+        await self._update_index(lambda entries: [*self._drop_entry(entries, version), self._gen_entry(version_model)])
+        await self._write_version_file(version_model)
+        
         return version_model
     
+    def get_manifest(self, version: BackupVersionModel) -> ChecksumManifest | None:
+        """
+        Checksum manifest of version (None when the destination is not local).
+        """
+        if not self._destination.host.local:
+            return None
+        
+        return ChecksumManifest.for_version(self._destination.join(version.version))
+    
     async def remove_version(self, version: BackupVersionModel) -> None:
         await self._ensure_versions_cache()
         
         if not await FsAdapter.exists(version.path, 'd'):
             self._logger.warning(f'Version "{version}" does not exist')
+            await self._forget_version(version)
             return
         
-        self._versions.remove(version)
+        await self._forget_version(version)
+        await self._release_version_data(version)
+        
+        fs = await self._get_volume_fs(version)
+        
+        if fs:
+            try:
+                await CowFs.remove(version.path, fs)
+                self._logger.info(f'Destroyed {fs} volume "{version.path}"')
+                return
+            except CowFsError as e:
+                self._logger.warning(f'Failed to destroy {fs} volume "{version.path}": {e}. Removing its contents')
         
         await FsAdapter.rm(version.path)
         
         self._logger.info(f'Removed version path "{version.path}"')
         
+    async def trash_version(self, version: BackupVersionModel) -> None:
+        await self._ensure_versions_cache()
+        
+        if not await FsAdapter.exists(version.path, 'd'):
+            self._logger.warning(f'Version "{version}" does not exist')
+            await self._forget_version(version)
+            return
+        
+        # destroying a subvolume / dataset is cheap, there is nothing to defer
+        if await self._get_volume_fs(version):
+            await self.remove_version(version)
+            return
+        
+        if not await FsAdapter.exists(self._trash, 'd'):
+            await FsAdapter.mkdir(self._trash)
+        
+        # trashed indexes are not live anymore, their chunks are collected once the trash is reclaimed
+        await self._release_version_data(version)
+        
+        # the name keeps entries from different sources / retries apart inside the shared trash
+        trash_path = self._trash.join(f'{self._name}.{version}.{uuid.uuid4().hex[:8]}')
+        
+        try:
+            await FsAdapter.rename(version.path, trash_path)
+        except FsAdapterError as e:
+            self._logger.warning(f'Failed to move version "{version}" to trash ({e}). Removing it in place')
+            await self.remove_version(version)
+            return
+        
+        await self._forget_version(version)
+        
+        self._logger.info(f'Moved version path "{version.path}" to trash')
+    
     async def lock_file_exists(self) -> bool:
         lock_file = self._destination.join('backup.lock')
 
@@ -106,7 +280,22 @@ class ContextService:
         if self._cache_generated:
             return
         
+        entries = await self._index.load()
+        
+        if entries is not None:
+            try:
+                self._versions = [self._gen_version_model(entry) for entry in entries]
+                self._cache_generated = True
+                return
+            except (KeyError, TypeError, ValueError):
+                pass
+        
+        # index missing or corrupt, fall back to a directory scan
+        self._logger.debug(f'Version index "{self._index.path}" unusable. Scanning "{self._destination}"')
+        
         versions = []
+        # versions made before the metadata was kept
+        legacy = set()
         
         # get all backup directories
         for version in await FsAdapter.ls(self._destination):
@@ -116,15 +305,152 @@ class ContextService:
                 continue
             
             version_path = self._destination.join(version)
-            versions.append(BackupVersionModel(version, version_path, version_date))
+            entry = await self._read_version_file(version_path)
+            
+            if entry:
+                versions.append(self._gen_version_model({**entry, 'version': version}))
+            else:
+                versions.append(BackupVersionModel(version, version_path, version_date, status='complete'))
+                legacy.add(version)
             
-        if not versions:
-            self._cache_generated = True
-            self._versions = []
-            return
-        
         # sort the directories by date asc
         versions.sort(key=lambda x: x.date)
         
+        for i, version in enumerate(versions):
+            if i and version.version in legacy and await self._has_incremental_data(version.path):
+                # the base of an incremental archive / stream is not recorded, the previous version is kept with it
+                versions[i] = BackupVersionModel(version.version, version.path, version.date, status='complete', depends_on=[versions[i - 1].version])
+        
         self._cache_generated = True
-        self._versions = versions
\ No newline at end of file
+        self._versions = versions
+        
+        # rebuild the index so the next context does not need to scan again
+        if await FsAdapter.exists(self._destination, 'd'):
+            await self._update_index(lambda entries: entries)
+    
+    async def _get_cow_fs(self) -> CowFsType | None:
+        if self._cow == 'off':
+            return None
+        
+        return await CowFs.detect(self._storage_path)
+    
+    async def _get_volume_fs(self, version: BackupVersionModel) -> CowFsType | None:
+        """
+        Return the filesystem of version if it is a btrfs subvolume / ZFS dataset.
+        """
+        # volumes are detected even with cow off, so they are still destroyed properly
+        fs = await CowFs.detect(self._storage_path)
+        
+        if fs in ('btrfs', 'zfs') and await CowFs.is_volume(version.path, fs):
+            return fs
+        
+        return None
+    
+    async def _release_version_data(self, version: BackupVersionModel) -> None:
+        """
+        Release the data version keeps outside of its directory: chunks go to the garbage collection of the pool
+        and received ZFS snapshots are destroyed.
+        """
+        if not self._destination.host.local:
+            return
+        
+        if self._chunk_store and await FsAdapter.exists(self._chunk_store.pool, 'd'):
+            try:
+                await self._chunk_store.add_gc_candidates(version.path)
+            except (ChunkStoreError, OSError) as e:
+                self._logger.warning(f'Failed to release chunks of version "{version}": {e}')
+        
+        try:
+            for snapshot in await ZfsRecv.release(version.path, self._destination):
+                self._logger.info(f'Destroyed received snapshot "{snapshot}"')
+        except (ZfsRecvError, FsAdapterError, OSError) as e:
+            self._logger.warning(f'Failed to destroy received snapshots of version "{version}": {e}')
+    
+    async def _has_incremental_data(self, version_path: PathModel) -> bool:
+        for handler in await FsAdapter.ls(version_path):
+            for name in await FsAdapter.ls(version_path.join(handler)):
+                # tar snapshot files of incremental archives, zfs streams above level 0
+                if name == 'archive.snar' or re.search(r'\.[1-9][0-9]*\.zfs$', name):
+                    return True
+        
+        return False
+    
+    async def _write_version_file(self, version: BackupVersionModel) -> None:
+        try:
+            await FsAdapter.write(version.path.join(self._version_file), json.dumps(self._gen_entry(version), indent=1))
+        except FsAdapterError as e:
+            self._logger.warning(f'Failed to write metadata of version "{version}": {e}')
+    
+    async def _read_version_file(self, version_path: PathModel) -> dict | None:
+        version_file = version_path.join(self._version_file)
+        
+        if not await FsAdapter.exists(version_file, 'f'):
+            return None
+        
+        try:
+            entry = json.loads(await FsAdapter.read(version_file))
+            
+            # checked the same way as the index entries
+            self._gen_version_model({**entry, 'version': os.path.basename(version_path.path)})
+        except (FsAdapterError, ValueError, KeyError, TypeError) as e:
+            self._logger.warning(f'Ignoring unusable metadata of version "{version_path}": {e}')
+            return None
+        
+        return entry
+    
+    async def _update_index(self, mutator: Callable[[list[dict]], list[dict]]) -> None:
+        # the cache is used to rebuild the index when the file on disk is unusable
+        fallback = [self._gen_entry(version) for version in self._versions]
+        
+        try:
+            await self._index.update(mutator, fallback=fallback)
+        except FsAdapterError as e:
+            self._logger.warning(f'Failed to update version index "{self._index.path}": {e}')
+    
+    async def _forget_version(self, version: BackupVersionModel) -> None:
+        self._versions = [cached for cached in self._versions if cached.version != version.version]
+        
+        await self._update_index(lambda entries: self._drop_entry(entries, version))
+        
+        if not self._destination.host.local:
+            return
+        
+        try:
+            await ChecksumManifest.for_version(self._destination.join(version.version)).remove()
+        except (ChecksumManifestError, FsAdapterError, OSError) as e:
+            self._logger.warning(f'Failed to remove checksum manifest of version "{version}": {e}')
+    
+    def _replace_cached_version(self, version: BackupVersionModel) -> None:
+        self._versions = [cached for cached in self._versions if cached.version != version.version]
+        self._versions.append(version)
+        self._versions.sort(key=lambda x: x.date)
+    
+    def _drop_entry(self, entries: list[dict], version: BackupVersionModel) -> list[dict]:
+        return [entry for entry in entries if entry['version'] != version.version]
+    
+    def _gen_entry(self, version: BackupVersionModel) -> dict:
+        return {
+            'version': version.version,
+            'date': version.date.isoformat(),
+            'status': version.status,
+            'handlers': version.handlers,
+            'bytes': version.bytes,
+            'files': version.files,
+            'elapsed': version.elapsed,
+            'depends_on': version.depends_on,
+            'clone_of': version.clone_of,
+        }
+    
+    def _gen_version_model(self, entry: dict) -> BackupVersionModel:
+        return BackupVersionModel(
+            entry['version'],
+            self._destination.join(entry['version']),
+            datetime.datetime.fromisoformat(entry['date']),
+            status=entry.get('status'),
+            handlers=entry.get('handlers'),
+            bytes=entry.get('bytes'),
+            files=entry.get('files'),
+            elapsed=entry.get('elapsed'),
+            depends_on=entry.get('depends_on'),
+            clone_of=entry.get('clone_of'),
+        )
\ No newline at end of file
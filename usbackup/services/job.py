@@ -5,6 +5,8 @@ import io
 from usbackup.libraries.cmd_exec import CmdExec
 from usbackup.libraries.cleanup_queue import CleanupQueue
 from usbackup.libraries.datastore import Datastore
+from usbackup.libraries.host_probe import HostProbe
+from usbackup.libraries.http_pool import HttpPool
 from usbackup.models.job import JobModel
 from usbackup.models.retention_policy import RetentionPolicyModel
 from usbackup.models.result import ResultModel
@@ -14,7 +16,9 @@ from usbackup.services.context import ContextService
 from usbackup.services.backup_runner import BackupRunner
 from usbackup.services.replication_runner import ReplicationRunner
 from usbackup.services.notifier import NotifierService
+from usbackup.services.pruner import PrunerService
 from usbackup.exceptions import UsBackupRuntimeError
+from usbackup.handlers import dynamic_loader
 from usbackup.utils.logging import NoExceptionFormatter
 
 __all__ = ['JobService']
@@ -35,8 +39,11 @@ class JobService:
         self._schedule: str = job.schedule
         self._retention_policy: RetentionPolicyModel | None = job.retention_policy
         self._concurrency: int = job.concurrency
+        self._probe_timeout: float = job.probe_timeout
         self._pre_run_cmd: list | None = job.pre_run_cmd
         self._post_run_cmd: list | None = job.post_run_cmd
+        
+        self._pruner: PrunerService = PrunerService(dest, datastore=datastore, logger=logger.getChild('pruner'))
 
     @property
     def name(self) -> str:
@@ -54,13 +61,35 @@ class JobService:
             self._logger.info(f"Running pre run command")
             await CmdExec.exec(self._pre_run_cmd)
         
-        semaphore = asyncio.Semaphore((self._concurrency))
+        # reclaims trashed versions (including leftovers from a crashed run) while sources are processed
+        self._pruner.start()
+        # HTTP handlers of all sources share the connections of the pool
+        HttpPool.acquire()
         
-        for source in self._sources:
-            tasks.append(asyncio.create_task(self._semaphore_task_runner(source, semaphore), name=source.name))
-                
-        # wait for all tasks to finish
-        await asyncio.gather(*tasks, return_exceptions=True)
+        # released even when the job fails or is cancelled (eg. on daemon shutdown)
+        try:
+            semaphore = asyncio.Semaphore((self._concurrency))
+            
+            # probe all sources up front so unreachable hosts don't occupy a concurrency slot
+            unreachable = await self._probe_sources()
+            
+            for source in self._sources:
+                if source.name in unreachable:
+                    error = UsBackupRuntimeError(f'Host "{source.host}" is not reachable')
+                    tasks.append(asyncio.create_task(self._task_runner(source, error=error), name=source.name))
+                else:
+                    tasks.append(asyncio.create_task(self._semaphore_task_runner(source, semaphore), name=source.name))
+                    
+            # wait for all tasks to finish
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            # no-op for finished tasks, the others must not keep using the pool
+            for task in tasks:
+                task.cancel()
+            
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await HttpPool.release()
+            await self._pruner.stop()
         
         for task in tasks:
             if isinstance(task.exception(), Exception):
@@ -83,48 +112,91 @@ class JobService:
         # handle reporting
         await self._notifier.notify(results, elapsed=elapsed)
     
+    async def _probe_sources(self) -> set[str]:
+        """
+        Concurrently probe the hosts of all sources and return the names of the unreachable ones.
+        """
+        # replication jobs only access storages
+        if self._type != 'backup':
+            return set()
+        
+        sources = [source for source in self._sources if not source.host.local]
+        
+        if not sources:
+            return set()
+        
+        self._logger.info(f'Probing {len(sources)} sources')
+        
+        results = await asyncio.gather(*[self._probe_source(source) for source in sources])
+        unreachable = {source.name for source, reachable in zip(sources, results) if not reachable}
+        
+        for name in unreachable:
+            self._logger.warning(f'Source "{name}" is not reachable. Skipping it')
+        
+        return unreachable
+    
+    async def _probe_source(self, source: SourceModel) -> bool:
+        ports = set()
+        
+        for handler_model in source.handlers:
+            ports.add(dynamic_loader('backup', handler_model.handler).probe_port)
+        
+        probes = [HostProbe.is_reachable(source.host, port, timeout=self._probe_timeout) for port in ports]
+        
+        return all(await asyncio.gather(*probes))
+    
     async def _semaphore_task_runner(self, source: SourceModel, semaphore: asyncio.Semaphore) -> ResultModel:
         async with semaphore:
-            logger = self._logger.getChild(source.name)
-            
-            log_stream = io.StringIO()
-            # bind stream to logger
-            stream_handler = logging.StreamHandler(log_stream)
-            stream_handler.setFormatter(NoExceptionFormatter('%(asctime)s - %(message)s'))
-            
-            logger.addHandler(stream_handler)
-            
-            context = ContextService(source, self._dest, logger=logger)
-            
-            try:
-                if self._type == 'backup':
-                    runner = BackupRunner(context, self._retention_policy, cleanup=self._cleanup, logger=logger)
-                    
-                    result = await runner.run()
-                elif self._type == 'replication':
-                    runner = ReplicationRunner(context, self._retention_policy, cleanup=self._cleanup, logger=logger)
-                    
-                    if not self._replication_src:
-                        raise UsBackupRuntimeError(f"Replication source is not set for job {self._name}")
-                    
-                    replicate_context = ContextService(source, self._replication_src, logger=logger)
-                    result = await runner.run(replicate_context)
-            except Exception as e:
-                self._logger.exception(e)
-                result = ResultModel(context, error=e)
+            return await self._task_runner(source)
+    
+    async def _task_runner(self, source: SourceModel, *, error: Exception | None = None) -> ResultModel:
+        logger = self._logger.getChild(source.name)
+        
+        log_stream = io.StringIO()
+        # bind stream to logger
+        stream_handler = logging.StreamHandler(log_stream)
+        stream_handler.setFormatter(NoExceptionFormatter('%(asctime)s - %(message)s'))
+        
+        logger.addHandler(stream_handler)
+        
+        context = ContextService(source, self._dest, logger=logger)
+        
+        try:
+            # failed pre-flight checks are reported like any other source error
+            if error:
+                raise error
             
             if self._type == 'backup':
-                backups = self._datastore.get('backups', {})
-                backups[context.name] = result
+                runner = BackupRunner(context, self._retention_policy, cleanup=self._cleanup, logger=logger)
                 
-                self._datastore.set('backups', backups)
+                result = await runner.run()
+            elif self._type == 'replication':
+                runner = ReplicationRunner(context, self._retention_policy, cleanup=self._cleanup, logger=logger)
                 
-            result.set_message(log_stream.getvalue())
+                if not self._replication_src:
+                    raise UsBackupRuntimeError(f"Replication source is not set for job {self._name}")
                 
-            logger.removeHandler(stream_handler)
-            log_stream.close()
+                replicate_context = ContextService(source, self._replication_src, logger=logger)
+                result = await runner.run(replicate_context)
+        except Exception as e:
+            self._logger.exception(e)
+            result = ResultModel(context, error=e)
+        
+        # retention may have trashed versions
+        self._pruner.notify()
+        
+        if self._type == 'backup':
+            backups = self._datastore.get('backups', {})
+            backups[context.name] = result
             
-            return result
+            self._datastore.set('backups', backups)
+        
+        result.set_message(log_stream.getvalue())
+        
+        logger.removeHandler(stream_handler)
+        log_stream.close()
+        
+        return result
     
     def is_job_due(self) -> bool:
         cron_schedule = self._schedule
@@ -0,0 +1,171 @@
+import logging
+import asyncio
+import datetime
+from usbackup.libraries.chunk_store import ChunkStore, ChunkStoreError
+from usbackup.libraries.cmd_exec import CmdExec
+from usbackup.libraries.fs_adapter import FsAdapter
+from usbackup.libraries.datastore import Datastore
+from usbackup.models.storage import StorageModel
+from usbackup.models.path import PathModel
+
+__all__ = ['PrunerService']
+
+class PrunerService:
+    # trash entries being deleted and the running pruners, per trash path (jobs can share a storage)
+    _claimed: dict[str, set[str]] = {}
+    _running: dict[str, set['PrunerService']] = {}
+    
+    def __init__(self, storage: StorageModel, *, datastore: Datastore, logger: logging.Logger):
+        self._datastore: Datastore = datastore
+        self._logger: logging.Logger = logger
+        
+        self._name: str = storage.name
+        self._trash: PathModel = storage.path.join('.trash')
+        self._chunk_pool: PathModel = storage.path.join(ChunkStore.pool_name)
+        self._concurrency: int = storage.prune_concurrency
+        self._ionice: str = storage.prune_ionice
+        
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+    
+    @property
+    def trash(self) -> PathModel:
+        return self._trash
+    
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        
+        if not self._trash.host.local:
+            self._logger.warning(f'Trash "{self._trash}" is not local. Background pruning disabled')
+            return
+        
+        self._running.setdefault(self._trash.path, set()).add(self)
+        self._task = asyncio.create_task(self._worker(), name=f'pruner-{self._name}')
+    
+    def notify(self) -> None:
+        self._wakeup.set()
+    
+    async def stop(self) -> None:
+        """
+        Stop the worker without waiting for the trash to be emptied. What is left is reclaimed by the next run
+        or by the other pruners of the storage.
+        """
+        if self._task is None:
+            return
+        
+        self._task.cancel()
+        
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self._logger.exception(f'Pruner failed: {e}')
+        finally:
+            self._task = None
+            
+            running = self._running.get(self._trash.path, set())
+            running.discard(self)
+            
+            if not running:
+                self._running.pop(self._trash.path, None)
+        
+        # the entries this worker gave up are taken over by the pruners still running on the storage
+        for pruner in self._running.get(self._trash.path, set()):
+            pruner.notify()
+    
+    async def pending(self) -> list[str]:
+        if not await FsAdapter.exists(self._trash, 'd'):
+            return []
+        
+        return await FsAdapter.ls(self._trash)
+    
+    async def _worker(self) -> None:
+        semaphore = asyncio.Semaphore(self._concurrency)
+        # entries that failed are retried on the next run only
+        failed = set()
+        claimed = self._claimed.setdefault(self._trash.path, set())
+        
+        while True:
+            self._wakeup.clear()
+            
+            entries = [entry for entry in await self.pending() if entry not in failed and entry not in claimed]
+            
+            if entries:
+                self._logger.info(f'Reclaiming {len(entries)} trashed version(s) from storage "{self._name}"')
+                
+                tasks = [asyncio.create_task(self._reclaim(entry, semaphore)) for entry in entries]
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                
+                reclaimed = 0
+                
+                for entry, result in zip(entries, results):
+                    if isinstance(result, Exception):
+                        self._logger.error(f'Failed to reclaim trash entry "{entry}": {result}')
+                        failed.add(entry)
+                    elif result:
+                        reclaimed += 1
+                
+                await self._update_stats(reclaimed)
+                
+                # entries may have been trashed while we were deleting
+                continue
+            
+            # chunks released by removed versions (trashed or destroyed in place)
+            await self._collect_chunks()
+            
+            await self._wakeup.wait()
+    
+    async def _reclaim(self, entry: str, semaphore: asyncio.Semaphore) -> bool:
+        path = self._trash.join(entry)
+        claimed = self._claimed.setdefault(self._trash.path, set())
+        
+        async with semaphore:
+            # removed by another worker, not counted twice
+            if entry in claimed:
+                return False
+            
+            claimed.add(entry)
+            
+            try:
+                start_time = datetime.datetime.now()
+                
+                if self._ionice == 'idle':
+                    await CmdExec.exec(['ionice', '-c', '3', 'rm', '-rf', path.path])
+                elif self._ionice == 'best-effort':
+                    await CmdExec.exec(['ionice', '-c', '2', '-n', '7', 'rm', '-rf', path.path])
+                else:
+                    await FsAdapter.rm(path)
+                
+                elapsed_s = (datetime.datetime.now() - start_time).total_seconds()
+                
+                self._logger.info(f'Reclaimed trash entry "{entry}" in {elapsed_s:.2f} seconds')
+                
+                return True
+            finally:
+                claimed.discard(entry)
+    
+    async def _collect_chunks(self) -> None:
+        if not await FsAdapter.exists(self._chunk_pool, 'd'):
+            return
+        
+        try:
+            removed, removed_bytes = await ChunkStore(self._chunk_pool).collect_garbage()
+        except (ChunkStoreError, OSError) as e:
+            self._logger.error(f'Failed to collect unreferenced chunks: {e}')
+            return
+        
+        if removed:
+            self._logger.info(f'Removed {removed} unreferenced chunk(s) ({removed_bytes / 1000 ** 2:.2f} MB) from storage "{self._name}"')
+    
+    async def _update_stats(self, reclaimed: int) -> None:
+        trash = self._datastore.get('trash', {})
+        
+        stats = trash.get(self._name, {'reclaimed': 0, 'last_reclaimed': None})
+        stats['reclaimed'] += reclaimed
+        stats['last_reclaimed'] = datetime.datetime.now()
+        
+        trash[self._name] = stats
+        
+        self._datastore.set('trash', trash)
\ No newline at end of file
@@ -2,10 +2,13 @@ import logging
 import datetime
 import io
 from usbackup.libraries.cleanup_queue import CleanupQueue
+from usbackup.libraries.fs_adapter import FsAdapter
 from usbackup.libraries.remote_sync import RemoteSync
 from usbackup.models.retention_policy import RetentionPolicyModel
 from usbackup.models.result import ResultModel
+from usbackup.models.transfer_stats import TransferStatsModel
 from usbackup.models.path import PathModel
+from usbackup.models.version import BackupVersionModel
 from usbackup.services.runner import Runner
 from usbackup.services.context import ContextService
 from usbackup.exceptions import UsBackupRuntimeError
@@ -37,9 +40,14 @@ class ReplicationRunner(Runner):
         src = replicate_version.path
         dest = self._context.destination
         error = None
+        stats = {}
         
         try:
-            await self._run_replication(src, dest)
+            # chunks first, so replicated indexes never reference missing chunks
+            await self._replicate_chunks(replicate_context, replicate_version)
+            stats['replication'] = await self._run_replication(src, dest)
+            await self._replicate_manifest(replicate_context, replicate_version)
+            await self._context.register_version(replicate_version)
         except Exception as e:
             self._logger.exception(e)
             error = e
@@ -60,9 +68,9 @@ class ReplicationRunner(Runner):
 
         self._logger.info(f'Replication finished at {finish_time}. Elapsed time: {elapsed_s:.2f} seconds')
         
-        return ResultModel(self._context, error=error, elapsed=elapsed)
+        return ResultModel(self._context, error=error, elapsed=elapsed, stats=stats)
     
-    async def _run_replication(self, source: PathModel, dest: PathModel) -> None:
+    async def _run_replication(self, source: PathModel, dest: PathModel) -> TransferStatsModel:
         options = [
             'archive',
             'hard-links',
@@ -75,4 +83,36 @@ class ReplicationRunner(Runner):
         self._logger.info(f'Replicating "{source}" to "{dest}"')
         
         stats = await RemoteSync.rsync(source, dest, options=options)
-        self._logger.debug(stats)
\ No newline at end of file
+        self._logger.info(f'Replication transfer: {stats}')
+        
+        return stats
+    
+    async def _replicate_chunks(self, replicate_context: ContextService, version: BackupVersionModel) -> None:
+        src_store = replicate_context.chunk_store
+        dest_store = self._context.chunk_store
+        
+        if not src_store or not await FsAdapter.exists(src_store.pool, 'd'):
+            return
+        
+        if not dest_store:
+            raise UsBackupRuntimeError(f'Version "{version}" references chunks but the destination storage is not local')
+        
+        self._logger.info(f'Replicating chunks of "{version}" to "{dest_store.pool}"')
+        
+        copied = await src_store.replicate(version.path, dest_store)
+        
+        self._logger.info(f'Copied {copied / 1000 ** 2:.2f} MB of new chunks')
+    
+    async def _replicate_manifest(self, replicate_context: ContextService, version: BackupVersionModel) -> None:
+        src_manifest = replicate_context.get_manifest(version)
+        dest_manifest = self._context.get_manifest(version)
+        
+        if not src_manifest or not await src_manifest.exists():
+            self._logger.info(f'Version "{version}" has no checksum manifest')
+            return
+        
+        if not dest_manifest:
+            return
+        
+        # the replicated files are the same, so are their checksums
+        await src_manifest.copy(dest_manifest)
\ No newline at end of file
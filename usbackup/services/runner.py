@@ -33,7 +33,7 @@ class Runner:
             self._logger.info(f'No backup versions found. Nothing to prune')
             return 0
         
-        protected = self._get_protected_versions(versions)
+        protected = self._add_dependencies(self._get_protected_versions(versions), versions)
         versions_cnt = len(protected)
         
         if not versions_cnt:
@@ -42,10 +42,30 @@ class Runner:
         # exclude protected versions from the list
         prune = [version for version in versions if version.version not in protected]
         
+        # expired versions are only moved to the storage trash, the pruner reclaims them in background
         for version in prune:
-            await self._context.remove_version(version)
+            await self._context.trash_version(version)
             
         return versions_cnt
+    
+    def _add_dependencies(self, protected: list, versions: list[BackupVersionModel]) -> list:
+        # a kept version needs every version it depends on (eg. the full archive of an incremental chain)
+        depends_on = {version.version: version.depends_on or [] for version in versions}
+        closure = set(protected)
+        pending = list(protected)
+        
+        while pending:
+            for dependency in depends_on.get(pending.pop(), []):
+                if dependency not in closure:
+                    closure.add(dependency)
+                    pending.append(dependency)
+        
+        added = sorted(closure - set(protected))
+        
+        if added:
+            self._logger.info(f'dependency protected versions: {added}')
+        
+        return sorted(closure)
         
     def _get_protected_versions(self, versions: list[BackupVersionModel]) -> list:
         categories = {